@@ -0,0 +1,165 @@
+"""
+処理の各段（YOLOでの検出，チーム判別，射影変換，フォーメーション推定，防御フェーズ検出）を
+上限付きのキューでつなぎ，フレーム単位で流していく asyncio のパイプラインです．
+前の段がファイル全体を書き終わるのを待たずに次の段が処理を始め，キューが一杯なら前の段が待つので
+メモリの使用量も一定に保たれます．各段の処理数・スループット・キューの長さを report で確認できます．
+"""
+
+import asyncio
+import inspect
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+_END = object()
+
+
+class Stage:
+    """
+    パイプラインの1段．func は1つの入力を受け取って出力を返す（None なら次の段へ渡さない）．
+    expand=True なら func は出力のリストを返し，それぞれを次の段へ渡す．
+    mode は "inline"（イベントループ上で実行．コルーチン関数も可），"thread"，"process" のいずれか．
+    flush はデータの終わりに呼ばれ，残りの出力のリストを返す
+    """
+
+    def __init__(self, name, func, mode="inline", expand=False, flush=None):
+        self.name = name
+        self.func = func
+        self.mode = mode
+        self.expand = expand
+        self.flush = flush
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.max_depth = 0
+        self.depth_total = 0
+
+    async def _call(self, loop, executor, func, *args):
+        if self.mode == "inline":
+            result = func(*args)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        return await loop.run_in_executor(executor, func, *args)
+
+    async def run(self, inbox, outbox):
+        loop = asyncio.get_running_loop()
+        executor = None
+        if self.mode == "thread":
+            executor = ThreadPoolExecutor(max_workers=1)
+        elif self.mode == "process":
+            executor = ProcessPoolExecutor(max_workers=1)
+        try:
+            while True:
+                depth = inbox.qsize()
+                self.max_depth = max(self.max_depth, depth)
+                self.depth_total += depth
+                item = await inbox.get()
+                if item is _END:
+                    break
+                self.items_in += 1
+                started = time.perf_counter()
+                result = await self._call(loop, executor, self.func, item)
+                self.busy_seconds += time.perf_counter() - started
+                await self._put(outbox, result)
+            if self.flush is not None:
+                # process モードの段は状態を持たないので，flush はイベントループ上で呼ぶ
+                if self.mode == "thread":
+                    result = await loop.run_in_executor(executor, self.flush)
+                else:
+                    result = self.flush()
+                await self._put(outbox, result)
+        finally:
+            await outbox.put(_END)
+            if executor is not None:
+                executor.shutdown()
+
+    async def _put(self, outbox, result):
+        if result is None:
+            return
+        for output in (result if self.expand else [result]):
+            self.items_out += 1
+            await outbox.put(output)
+
+
+class PipelineRunner:
+    def __init__(self, stages, maxsize=64):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.elapsed = 0.0
+        self.first_output_seconds = None
+
+    async def run(self, source, sink=None):
+        """
+        source（イテラブルか非同期イテラブル）の要素を順に流し，最後の段の出力ごとに sink を呼ぶ．
+        最後の段の出力のリスト（sink を渡した場合は空）を返す
+        """
+        queues = [asyncio.Queue(maxsize=self.maxsize) for _ in range(len(self.stages) + 1)]
+        started = time.perf_counter()
+        outputs = []
+
+        async def feed():
+            if hasattr(source, "__aiter__"):
+                async for item in source:
+                    await queues[0].put(item)
+            else:
+                for item in source:
+                    await queues[0].put(item)
+                    # 同期イテラブルでも他の段に処理を回す
+                    await asyncio.sleep(0)
+            await queues[0].put(_END)
+
+        async def drain():
+            while True:
+                item = await queues[-1].get()
+                if item is _END:
+                    break
+                if self.first_output_seconds is None:
+                    self.first_output_seconds = time.perf_counter() - started
+                if sink is None:
+                    outputs.append(item)
+                else:
+                    result = sink(item)
+                    if inspect.isawaitable(result):
+                        await result
+
+        tasks = [feed(), drain()]
+        tasks += [stage.run(queues[k], queues[k + 1]) for k, stage in enumerate(self.stages)]
+        await asyncio.gather(*tasks)
+        self.elapsed = time.perf_counter() - started
+        return outputs
+
+    def run_sync(self, source, sink=None):
+        return asyncio.run(self.run(source, sink))
+
+    def report(self):
+        """段ごとの処理数・スループット・キューの長さを文字列で返す"""
+        lines = [f"{'段':<16}{'入力':>8}{'出力':>8}{'処理[s]':>10}{'件/s':>10}{'最大キュー':>10}{'平均キュー':>10}"]
+        for stage in self.stages:
+            throughput = stage.items_in / self.elapsed if self.elapsed else 0.0
+            mean_depth = stage.depth_total / (stage.items_in + 1)
+            lines.append(
+                f"{stage.name:<16}{stage.items_in:>8}{stage.items_out:>8}{stage.busy_seconds:>10.2f}"
+                f"{throughput:>10.1f}{stage.max_depth:>10}{mean_depth:>10.1f}"
+            )
+        if self.first_output_seconds is not None:
+            lines.append(f"最初の出力まで {self.first_output_seconds:.2f} 秒，全体 {self.elapsed:.2f} 秒")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from online_classifier import OnlineFormationClassifier, classify_frame, iter_tracking_frames
+
+    # 射影変換済みのCSVから流す．映像から流す場合は検出・チーム判別・射影変換の Stage を先頭に加える
+    csv_file = "../data/transform/transformed_player_points.csv"
+
+    classifier = OnlineFormationClassifier()
+    runner = PipelineRunner([
+        Stage("formation", classify_frame),
+        Stage("phase", lambda item: classifier.push_classified(*item), expand=True, flush=classifier.flush),
+    ])
+
+    def print_phase(record):
+        print(f"{record['start_frame']}-{record['end_frame']} {record['direction']} {record['formation']}")
+
+    runner.run_sync(iter_tracking_frames(csv_file), sink=print_phase)
+    print(runner.report())
@@ -0,0 +1,204 @@
+"""
+コート上の領域（ゾーン）判定をまとめたモジュールです．
+9mラインの外側の帯，6mエリア，ゴール前の左・中央・右，コート外の監督エリアなどの領域を
+細かいグリッドに一度だけラスタライズしておき，選手の座標からの領域判定を配列のインデックス参照1回で行います．
+座標は上面図に正規化した (x, y)（0〜1，yは下向き）で，ゴールは direction が right なら x=1，left なら x=0 にあります．
+分類器は left のフレームを反転した正準座標（observations.CANONICAL_SIDE の向き）で right のゾーンだけを使います．
+x だけの反転なので，攻撃側から見た "left" / "right" のゾーンは入れ替わる点に注意してください．
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+# コート画像（img/right_court.png, left_court.png）から測った 1m あたりの正規化座標
+METER = 0.048
+GOAL_Y = 0.5
+# ゴールポストはゴール中心から ±1.5m
+GOAL_HALF_WIDTH = 1.5 * METER
+
+# ゾーン名とビット番号．1つの座標が複数のゾーンに属することもある
+ZONE_BITS = {
+    "6m_area": 0,
+    "9m_band": 1,
+    "left": 2,
+    "center": 3,
+    "right": 4,
+    "coach_area": 5,
+    # これまでの矩形による判定（9mラインの外側 / 内側に戻った）
+    "outer_box": 6,
+    "returned": 7,
+}
+
+# 矩形の境界がセルの境界に重なり，セルの中心では境界上の座標を正しく判定できないゾーン
+BOX_ZONES = ("outer_box", "returned")
+BOX_BITS = sum(1 << ZONE_BITS[name] for name in BOX_ZONES)
+
+# グリッドの範囲．オフセット適用でコートの外にはみ出した座標も扱えるように少し広めに取る
+GRID_EXTENT = (-0.1, 1.1, -0.1, 1.1)
+
+
+def goal_x(side):
+    return 1.0 if side == "right" else 0.0
+
+
+def goal_line_distance(x, y, side):
+    """ゴールライン上のゴール（ポスト間の線分）からの距離[m]．6mライン，9mラインはこの距離が6, 9になる線"""
+    dx = np.abs(np.asarray(x, dtype=np.float64) - goal_x(side))
+    dy = np.maximum(np.abs(np.asarray(y, dtype=np.float64) - GOAL_Y) - GOAL_HALF_WIDTH, 0.0)
+    return np.hypot(dx, dy) / METER
+
+
+def goal_angle(x, y, side):
+    """ゴール中心から見た角度[度]．攻撃側から見て左が負，右が正"""
+    toward_court = np.abs(np.asarray(x, dtype=np.float64) - goal_x(side))
+    lateral = np.asarray(y, dtype=np.float64) - GOAL_Y
+    # right側のゴールへ攻める選手から見ると -y が左，left側では +y が左
+    if side == "left":
+        lateral = -lateral
+    return np.degrees(np.arctan2(lateral, toward_court))
+
+
+def zone_masks(x, y, side, band_width=3.0, coach_margin=0.04):
+    """各ゾーンに属するかどうかを直接計算する．ラスタライズ時に1度だけ使う"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    distance = goal_line_distance(x, y, side)
+    angle = goal_angle(x, y, side)
+    front = distance < 9.0 + band_width
+
+    return {
+        "6m_area": distance < 6.0,
+        "9m_band": (9.0 <= distance) & front,
+        "left": front & (angle < -30.0),
+        "center": front & (np.abs(angle) <= 30.0),
+        "right": front & (angle > 30.0),
+        "coach_area": (y > 1.0 - coach_margin) | (y < 0.0) | (x < 0.0) | (x > 1.0),
+        **box_masks(x, y, side),
+    }
+
+
+def box_masks(x, y, side):
+    """
+    これまでの矩形による判定（outer_box / returned）．境界は不等号のとおり厳密に扱うので，
+    ZoneGrid もこの2つはセルではなくこの式で判定する
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if side == "right":
+        outer_box = (0.4 < x) & (x < 0.55) & (0.2 < y) & (y < 0.8)
+        returned = ~(0.4 < x)
+    else:
+        outer_box = (0.45 < x) & (x < 0.6) & (0.2 < y) & (y < 0.8)
+        returned = ~(x < 0.6)
+    return {"outer_box": outer_box, "returned": returned}
+
+
+class ZoneGrid:
+    """
+    ゾーンをラスタライズしたルックアップテーブル．lookup は座標配列をまとめて判定する．
+    矩形のゾーン（BOX_ZONES）だけは境界上の座標も box_masks と同じになるように式で判定する
+    """
+
+    def __init__(self, side, resolution=0.0025, band_width=3.0, coach_margin=0.04):
+        self.side = side
+        self.resolution = resolution
+        self.x_min, x_max, self.y_min, y_max = GRID_EXTENT
+        self.nx = int(round((x_max - self.x_min) / resolution))
+        self.ny = int(round((y_max - self.y_min) / resolution))
+
+        # セルの中心でゾーンを評価してビットマスクのグリッドにする
+        xs = self.x_min + (np.arange(self.nx) + 0.5) * resolution
+        ys = self.y_min + (np.arange(self.ny) + 0.5) * resolution
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        self.codes = np.zeros((self.ny, self.nx), dtype=np.uint16)
+        for name, mask in zone_masks(grid_x, grid_y, side, band_width, coach_margin).items():
+            self.codes |= mask.astype(np.uint16) << ZONE_BITS[name]
+
+    def cell_index(self, x, y):
+        ix = np.floor((np.asarray(x) - self.x_min) / self.resolution).astype(np.intp)
+        iy = np.floor((np.asarray(y) - self.y_min) / self.resolution).astype(np.intp)
+        return np.clip(iy, 0, self.ny - 1), np.clip(ix, 0, self.nx - 1)
+
+    def lookup(self, x, y):
+        """各座標のゾーンのビットマスクを返す．矩形のゾーン（BOX_ZONES）は座標から直接判定する"""
+        iy, ix = self.cell_index(x, y)
+        codes = self.codes[iy, ix] & np.uint16(~BOX_BITS & 0xFFFF)
+        for name, mask in box_masks(x, y, self.side).items():
+            codes |= mask.astype(np.uint16) << ZONE_BITS[name]
+        return codes
+
+    def contains(self, zone, x, y):
+        """各座標が zone に入っているかの真偽値配列を返す"""
+        return (self.lookup(x, y) & (1 << ZONE_BITS[zone])) != 0
+
+
+@lru_cache(maxsize=None)
+def get_zone_grid(side, resolution=0.0025, band_width=3.0, coach_margin=0.04):
+    """設定ごとに1度だけグリッドを作って使い回す"""
+    return ZoneGrid(side, resolution, band_width, coach_margin)
+
+
+def contains(zone, x, y, side):
+    return get_zone_grid(side).contains(zone, x, y)
+
+
+class DistanceField:
+    """
+    ゴールからの距離[m]をグリッドの格子点で事前計算したもの．
+    sample はバイリニア補間で任意の座標の距離を配列のまままとめて求める．
+    6mライン・9mラインまでの符号付き距離（ラインより外側が正）は distance_to_line で得られる
+    """
+
+    def __init__(self, side, resolution=0.005):
+        self.side = side
+        self.resolution = resolution
+        self.x_min, x_max, self.y_min, y_max = GRID_EXTENT
+        self.nx = int(round((x_max - self.x_min) / resolution)) + 1
+        self.ny = int(round((y_max - self.y_min) / resolution)) + 1
+        xs = self.x_min + np.arange(self.nx) * resolution
+        ys = self.y_min + np.arange(self.ny) * resolution
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        self.values = goal_line_distance(grid_x, grid_y, side).astype(np.float32)
+
+    def sample(self, x, y):
+        fx = np.clip((np.asarray(x, dtype=np.float64) - self.x_min) / self.resolution, 0, self.nx - 1)
+        fy = np.clip((np.asarray(y, dtype=np.float64) - self.y_min) / self.resolution, 0, self.ny - 1)
+        ix = np.minimum(np.floor(fx).astype(np.intp), self.nx - 2)
+        iy = np.minimum(np.floor(fy).astype(np.intp), self.ny - 2)
+        tx = fx - ix
+        ty = fy - iy
+        v = self.values
+        top = v[iy, ix] * (1 - tx) + v[iy, ix + 1] * tx
+        bottom = v[iy + 1, ix] * (1 - tx) + v[iy + 1, ix + 1] * tx
+        return top * (1 - ty) + bottom * ty
+
+    def distance_to_line(self, x, y, line=9.0):
+        """line[m] のラインまでの符号付き距離[m]．ラインより外側（コート中央側）が正"""
+        return self.sample(x, y) - line
+
+
+@lru_cache(maxsize=None)
+def get_distance_field(side, resolution=0.005):
+    return DistanceField(side, resolution)
+
+
+def hysteresis_states(values, groups, enter_margin=0.5, exit_margin=0.5, initial=False):
+    """
+    values が enter_margin を超えたら True，-exit_margin を下回ったら False，その間は直前の状態を保つ．
+    values, groups はグループ（選手）ごと・時刻順に並べておくこと．グループの先頭の未確定値は initial になる
+    """
+    values = np.asarray(values)
+    groups = np.asarray(groups)
+    n = len(values)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    decided = (values > enter_margin) | (values < -exit_margin)
+    group_start = np.ones(n, dtype=bool)
+    group_start[1:] = groups[1:] != groups[:-1]
+
+    # 状態が決まった位置（またはグループの先頭）のインデックスを前方に伝播させる
+    source = np.where(decided | group_start, np.arange(n), 0)
+    source = np.maximum.accumulate(source)
+    state = np.where(decided, values > enter_margin, initial)
+    return state[source]
@@ -0,0 +1,191 @@
+"""
+攻撃方向（direction）を追跡データそのものから推定するモジュールです．
+上流の direction 列はリプレイなどで切り替わりが不安定なので，
+両チームの選手の重心が上面図の中央（HALF_X）よりどちら側にあるかから方向を求めます．
+重心の位置にヒステリシスをかけ，さらに新しい方向が min_dwell フレーム続いたときだけ切り替えるので，
+一瞬のリプレイや検出の乱れでは方向が変わりません．
+
+全フレームをまとめて配列で計算する estimate_directions（バッチ用）と，
+1フレームごとに O(1) で更新する DirectionEstimator（ライブ用）があり，どちらも同じ結果になります．
+切り替えは新しい方向が min_dwell フレーム続いたフレームで起こります（ライブでは先のフレームを見られないため）．
+"""
+
+import numpy as np
+
+from court_zones import hysteresis_states
+from observations import DIRECTION_NAMES, LEFT, RED, RIGHT, UNKNOWN, WHITE
+
+# 上面図の中央のx座標．両チームの重心がこれより右なら right
+HALF_X = 0.5
+
+
+def frame_scores(observations):
+    """
+    フレームごとに，チームごとの重心のx座標から HALF_X を引いたものの平均を求める．
+    (フレーム番号, スコア) を返す．選手のいないチームは平均に入れない
+    """
+    frames, index = np.unique(observations.frame_num, return_inverse=True)
+    known = observations.team >= 0
+    group = index[known] * 2 + observations.team[known]
+    sums = np.bincount(group, weights=observations.x[known], minlength=len(frames) * 2).reshape(-1, 2)
+    counts = np.bincount(group, minlength=len(frames) * 2).reshape(-1, 2)
+    present = counts > 0
+    offsets = np.divide(sums, counts, out=np.zeros_like(sums), where=present) - HALF_X
+    n_teams = present.sum(axis=1)
+    scores = np.divide(
+        (offsets * present).sum(axis=1), n_teams,
+        out=np.full(len(frames), np.nan), where=n_teams > 0,
+    )
+    return frames, scores
+
+
+def estimate_directions(scores, enter_margin=0.05, exit_margin=0.05, min_dwell=30, backdate=False):
+    """
+    フレーム順のスコアから方向コード（RIGHT / LEFT，最初に決まるまでは UNKNOWN）の配列を返す．
+    スコアが enter_margin を超えたら right，-exit_margin を下回ったら left，その間は直前の方向を保つ．
+    最初に決まった方向はすぐに採用し，その後は反対の方向が min_dwell フレーム続いたときに切り替える．
+    backdate=True なら切り替えを反対の方向になった最初のフレームまでさかのぼらせる（バッチ処理のときだけ使える）
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    n = len(scores)
+    result = np.full(n, UNKNOWN, dtype=np.int8)
+    decided = (scores > enter_margin) | (scores < -exit_margin)
+    if not decided.any():
+        return result
+
+    # ヒステリシスをかけた方向（最初に決まるまでは使わない）
+    first = int(np.argmax(decided))
+    raw = np.where(
+        hysteresis_states(scores[first:], np.zeros(n - first), enter_margin, exit_margin), RIGHT, LEFT
+    ).astype(np.int8)
+
+    # 同じ方向が続く区間（ラン）ごとに，min_dwell フレーム続いた時点で確定する
+    run_starts = np.flatnonzero(np.concatenate(([True], raw[1:] != raw[:-1])))
+    run_lengths = np.diff(np.append(run_starts, len(raw)))
+    confirmed = run_lengths >= min_dwell
+    confirmed[0] = True
+    delay = 0 if backdate else min_dwell - 1
+    confirm_at = np.where(run_starts == 0, 0, run_starts + delay)[confirmed]
+    confirm_state = raw[run_starts[confirmed]]
+
+    # 確定したフレームから次の確定までその方向を伝播させる
+    source = np.zeros(len(raw), dtype=np.intp)
+    source[confirm_at] = np.arange(len(confirm_at))
+    marks = np.zeros(len(raw), dtype=bool)
+    marks[confirm_at] = True
+    source = np.maximum.accumulate(np.where(marks, source, 0))
+    result[first:] = confirm_state[source]
+    return result
+
+
+class DirectionEstimator:
+    """estimate_directions と同じ推定を1フレームずつ O(1) で行う"""
+
+    def __init__(self, enter_margin=0.05, exit_margin=0.05, min_dwell=30):
+        self.enter_margin = enter_margin
+        self.exit_margin = exit_margin
+        self.min_dwell = min_dwell
+        self.raw = None
+        self.direction = UNKNOWN
+        self.pending = 0
+
+    def push_score(self, score):
+        """1フレーム分のスコアを追加し，そのフレームの方向コードを返す"""
+        if score > self.enter_margin:
+            self.raw = RIGHT
+        elif score < -self.exit_margin:
+            self.raw = LEFT
+        if self.raw is None:
+            return self.direction
+
+        if self.direction == UNKNOWN:
+            self.direction = self.raw
+        elif self.raw == self.direction:
+            self.pending = 0
+        else:
+            # 反対の方向が min_dwell フレーム続いたら切り替える
+            self.pending += 1
+            if self.pending >= self.min_dwell:
+                self.direction = self.raw
+                self.pending = 0
+        return self.direction
+
+    def push_frame(self, frame):
+        """1フレーム分の Observations から推定する"""
+        offsets = []
+        for team in (RED, WHITE):
+            xs = frame.x[frame.team == team]
+            if len(xs):
+                offsets.append(float(xs.sum(dtype=np.float64)) / len(xs) - HALF_X)
+        score = sum(offsets) / len(offsets) if offsets else float("nan")
+        return self.push_score(score)
+
+
+def direction_runs(frames, directions):
+    """方向コードの配列を (開始フレーム, 終了フレーム, 方向コード) の区間にまとめる"""
+    if len(frames) == 0:
+        return []
+    change = np.flatnonzero(directions[1:] != directions[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.append(change, len(frames)) - 1
+    return [(int(frames[s]), int(frames[e]), int(directions[s])) for s, e in zip(starts, ends)]
+
+
+def apply_estimated_directions(observations, mode="override", backdate=True, **kwargs):
+    """
+    observations の direction 列を推定した方向で置き換える（mode="override"）か，
+    そのままにして食い違う区間を調べる（mode="validate"）。
+    試合全体があるので，既定では切り替えを反対の方向になった最初のフレームまでさかのぼらせる。
+    (新しい Observations, 推定と direction 列が食い違う (開始フレーム, 終了フレーム, 推定した方向コード) のリスト) を返す。
+    まだ方向が決まらないフレームは direction 列のままにする
+    """
+    frames, scores = frame_scores(observations)
+    estimated = estimate_directions(scores, backdate=backdate, **kwargs)
+    per_row = estimated[np.searchsorted(frames, observations.frame_num)]
+    mismatch = (per_row != UNKNOWN) & (per_row != observations.direction)
+
+    frame_mismatch = np.zeros(len(frames), dtype=bool)
+    frame_mismatch[np.searchsorted(frames, observations.frame_num[mismatch])] = True
+    mismatches = [
+        (start, end, direction)
+        for start, end, direction in direction_runs(frames, np.where(frame_mismatch, estimated, UNKNOWN))
+        if direction != UNKNOWN
+    ]
+
+    if mode == "validate":
+        return observations, mismatches
+    if mode != "override":
+        raise ValueError(f"未対応のモードです: {mode}")
+    result = observations.take(slice(None))
+    result.direction = np.where(per_row != UNKNOWN, per_row, observations.direction).astype(np.int8)
+    return result.sorted(), mismatches
+
+
+def with_estimated_directions(frames, estimator=None, mode="override"):
+    """
+    iter_tracking_frames の ((frame_num, direction), frame) を1フレームずつ推定しながら流す．
+    override なら direction を推定した方向に置き換え，validate なら食い違ったフレームに印を付ける．
+    ((frame_num, direction), frame, direction 列と推定が食い違ったか) を返す
+    """
+    estimator = estimator or DirectionEstimator()
+    for (frame_num, direction), frame in frames:
+        estimated = estimator.push_frame(frame)
+        if estimated == UNKNOWN:
+            yield (frame_num, direction), frame, False
+            continue
+        name = DIRECTION_NAMES[estimated]
+        mismatch = name != direction
+        if mode == "override":
+            direction = name
+        yield (frame_num, direction), frame, mismatch
+
+
+if __name__ == "__main__":
+    from observations import Observations, decode
+
+    csv_file = "../data/transform/transformed_player_points.csv"
+    observations = Observations.from_csv(csv_file)
+    _, mismatches = apply_estimated_directions(observations, mode="validate")
+    print(f"direction 列と推定が食い違う区間: {len(mismatches)}")
+    for start_frame, end_frame, direction in mismatches:
+        print(f"{start_frame}-{end_frame} 推定: {decode(direction, DIRECTION_NAMES)}")
@@ -7,11 +7,6 @@ CSVファイルから選手の位置情報を読み込み，6人の選手の位
 
 import csv
 from collections import defaultdict, Counter
-from scipy.spatial.distance import cdist
-from scipy.optimize import linear_sum_assignment
-import numpy as np
-from itertools import combinations
-from tqdm import tqdm
 import time  # Add import for time module
 
 
@@ -8,14 +8,19 @@ CSVファイルから選手の位置情報を読み込み，6人の選手の位
 
 import csv
 from collections import defaultdict, Counter
-from typing import List, Tuple
-from scipy.spatial.distance import cdist
-from scipy.optimize import linear_sum_assignment
 import numpy as np
-from itertools import combinations
-from tqdm import tqdm
 import time
 
+from court_zones import get_distance_field, get_zone_grid, hysteresis_states
+from direction_estimator import apply_estimated_directions
+from formation_rle import FormationRLE
+from observations import CANONICAL_SIDE, DIRECTION_NAMES, Observations, decode
+from phase_kernels import NUMBA_AVAILABLE, REASON_NAMES, dense_ids, raw_phase_kernel
+from phase_smoothing import dominant_by_smoothed_labels, smooth_raw_phases
+from replay_detector import detect_replays, drop_ranges
+from track_repair import fill_track_gaps
+from track_stitching import stitch_tracks
+
 # 理想的なフォーメーション座標
 # formation_positions = {
 #     "0-6_right": [(0.8, 0.175), (0.7, 0.3), (0.65, 0.4), (0.65, 0.6), (0.7, 0.7),(0.8, 0.825)],
@@ -30,103 +35,183 @@ import time
 #     "2-4_left": [(0.3,0.3), (0.5,0.4), (0.325,0.4), (0.5,0.6), (0.325,0.6), (0.3,0.7)],
 # }
 
+def formation_from_outer_count(red_count):
+    """9mラインの外側にいる防御選手の数からフォーメーション名を決める"""
+    if red_count == 1:
+        formation = "1--5"
+    elif red_count == 0:
+        formation = "0--6"
+    elif red_count == 2:
+        formation = "2--4"
+    elif red_count == 3:
+        formation = "3--3"
+    else:
+        formation = "Unknown"
+    return formation
+
+
 class FormationClassifier:
-    def __init__(self, csv_file):
+    def __init__(self, csv_file, zone_mode="box", max_gap=0, observations=None, direction_mode=None,
+                 skip_replays=False, stitch_gap=0, smoothing="merge", switch_penalty=5.0):
+        """
+        zone_mode が "box" なら従来の矩形で，"distance" なら9mラインまでの距離とヒステリシスで
+        9mラインの外側にいるか・内側に戻ったかを判定する。
+        max_gap > 0 なら，同じIDの選手の検出が max_gap フレーム以下途切れた間を線形補間で埋める。
+        observations を渡した場合はCSVを読まずにそれを使う（試合の一部だけを処理するとき）
+        direction_mode が "override" なら direction 列を選手の重心から推定した方向で置き換え，
+        "validate" なら置き換えずに食い違う区間を direction_mismatches に残す
+        skip_replays が True ならリプレイとみなした区間を除き，その区間を skipped_ranges に残す
+        stitch_gap > 0 なら，IDが入れ替わって stitch_gap フレーム以内に始まった軌跡を前の軌跡と同じIDにつなぐ
+        smoothing が "viterbi" なら，短いフェーズの結合と代表フォーメーションの決定を
+        Viterbi による平滑化（phase_smoothing）で行う．switch_penalty はフレームごとの推定の切り替えのペナルティ
+        """
+        if smoothing not in ("merge", "viterbi"):
+            raise ValueError(f"未対応の平滑化の方法です: {smoothing}")
+        self.smoothing = smoothing
+        self.switch_penalty = switch_penalty
         self.csv_file = csv_file
-        self.attack_formations = self.load_csv()
+        self.observations = self.load_csv() if observations is None else observations
+        self.skipped_ranges = []
+        if skip_replays:
+            self.skipped_ranges = detect_replays(self.observations)
+            self.observations = drop_ranges(self.observations, self.skipped_ranges)
+        self.direction_mismatches = []
+        if direction_mode is not None:
+            self.observations, self.direction_mismatches = apply_estimated_directions(
+                self.observations, direction_mode
+            )
+        self.stitched_links = []
+        if stitch_gap > 0:
+            self.observations, self.stitched_links = stitch_tracks(self.observations, stitch_gap)
+            self.observations = self.observations.sorted()
+        # (frame_num, direction) ごとの補完した選手の数
+        self.imputed_counts = Counter()
+        if max_gap > 0:
+            self.repair_tracks(max_gap)
+        self.zone_mode = zone_mode
+        # distance モードの閾値[m]．9mラインより enter_margin 外に出たら外側，exit_margin 内に入ったら戻ったとみなす
+        self.enter_margin = 0.5
+        self.exit_margin = 0.5
+        self.band_width = 3.0
+        if zone_mode == "distance":
+            self.outer_zone, self.returned_zone = "outer_9m", "returned_9m"
+        else:
+            self.outer_zone, self.returned_zone = "outer_box", "returned"
 
     def load_csv(self):
-        frames = defaultdict(list)
         # チームごとのオフセット
         self.RED_X_OFFSET = 0.1
         self.RED_Y_OFFSET = -0.1
         self.WHITE_X_OFFSET = 0.06
         self.WHITE_Y_OFFSET = 0.0
 
-
-        # CSVファイルを読み込み、フレームごとにオフセットを適用した選手位置をまとめる
-        with open(self.csv_file, 'r') as file:
-            reader = csv.reader(file)
-            header = next(reader)
-            idx = {name: i for i, name in enumerate(header)}
-            for row in reader:
-                frame_num = int(row[idx['frame_num']])
-                x = float(row[idx['x']])
-                y = float(row[idx['y']])
-                direction = row[idx['direction']]
-                team_color = row[idx['team_color']]
-                player_id = row[idx['id']]
-
-                # オフセットの適用
-                if team_color == "red":
-                    x += self.RED_X_OFFSET
-                    y += self.RED_Y_OFFSET
-                elif team_color == "white":
-                    x += self.WHITE_X_OFFSET
-                    y += self.WHITE_Y_OFFSET
-
-                frames[(frame_num, direction)].append((x, y, team_color, player_id))
-        return frames
+        # CSVファイルを読み込み、オフセットを適用した選手位置を (frame_num, direction) 順の配列で持つ
+        return Observations.from_csv(
+            self.csv_file,
+            (self.RED_X_OFFSET, self.RED_Y_OFFSET),
+            (self.WHITE_X_OFFSET, self.WHITE_Y_OFFSET),
+        )
+
+    @property
+    def attack_formations(self):
+        """(frame_num, direction) -> [(x, y, team_color, player_id), ...] の形。出力や他のコードとの受け渡し用"""
+        return self.observations.to_attack_formations()
+
+    def repair_tracks(self, max_gap=5, method="linear"):
+        """検出の途切れを補完して observations を置き換える"""
+        self.observations = fill_track_gaps(self.observations, max_gap, method).sorted()
+        imputed = self.observations.take(self.observations.imputed)
+        self.imputed_counts = Counter(
+            (frame_num, DIRECTION_NAMES[direction])
+            for frame_num, direction in zip(imputed.frame_num.tolist(), imputed.direction.tolist())
+        )
+        if hasattr(self, '_zone_flag_cache'):
+            del self._zone_flag_cache
 
     def classify_formations(self):
         """フレームごとに9mラインの外側にいる選手の数でフォーメーションを判別"""
-        classified = []
-        # 防御選手のみの位置を取得
-        for (frame_num, direction), positions in self.attack_formations.items():
-            defender_team = 'red' if direction == 'right' else 'white'
-            defenders = [(x, y) for x, y, team_color, _ in positions if team_color == defender_team]
-
-            if len(defenders) < 6:
+        return list(self._iter_frame_formations())
+
+    def classify_formations_rle(self):
+        """classify_formations と同じ推定を，フレーム順にランレングス符号化した形で返す"""
+        rle = FormationRLE()
+        for frame_num, direction, formation, confidence in self._iter_frame_formations():
+            rle.append(frame_num, direction, formation, confidence)
+        return rle
+
+    def _iter_frame_formations(self):
+        frames, directions, starts = self.observations.frame_groups()
+        if len(frames) == 0:
+            return
+        # 防御選手の数と，そのうち9mラインの外側にいる選手の数をフレームごとにまとめて数える
+        defender = self.observations.defender_mask()
+        outer = defender & self._zone_flags(self.outer_zone)
+        n_defenders = np.add.reduceat(defender.astype(np.int32), starts)
+        n_outer = np.add.reduceat(outer.astype(np.int32), starts)
+
+        for frame_num, direction, defender_count, red_count in zip(
+            frames.tolist(), directions.tolist(), n_defenders.tolist(), n_outer.tolist()
+        ):
+            if defender_count < 6:
                 continue 
 
-            red_count = 0
-            for x, y in defenders:
-                if direction == "right" and (0.4 < x < 0.55) and (0.2 < y < 0.8):
-                    red_count += 1
-                elif direction == "left" and (0.45 < x < 0.6) and (0.2 < y < 0.8):
-                    red_count += 1
-
-            if red_count == 1:
-                formation = "1--5"
-            elif red_count == 0:
-                formation = "0--6"
-            elif red_count == 2:
-                formation = "2--4"
-            elif red_count == 3:
-                formation = "3--3"
-            else:
-                formation = "Unknown"
-
+            formation = formation_from_outer_count(red_count)
             confidence = 1.0
-            classified.append((frame_num, direction, formation, confidence))
-        return classified
+            yield frame_num, decode(direction, DIRECTION_NAMES), formation, confidence
     
 
     def detect_defense_phases(self, min_phase_length=50):
         """
         フェーズを検出する。方向が変わるまでの間に、6人以上の選手が9mラインの外側にいる場合をフェーズとする。
         フェーズの長さが min_phase_length より短い場合は、前後のフェーズと結合する。
+        smoothing が "viterbi" なら、結合はフェーズの方向を平滑化して行う（smooth_raw_phases）。
+        """
+        raw_phases = self.detect_raw_defense_phases()
+        if self.smoothing == "viterbi":
+            return smooth_raw_phases(raw_phases, min_phase_length)
+        return self._merge_short_phases(raw_phases, min_phase_length)
+
+    def detect_raw_defense_phases(self, use_jit=None):
         """
-        all_frames = sorted(self.attack_formations.items())
+        結合前のフェーズを (開始フレーム, 終了フレーム, 方向, 終了理由) のリストで返す。
+        use_jit が None なら numba が使えるときだけJITカーネル（phase_kernels）を使う
+        """
+        if use_jit is None:
+            use_jit = NUMBA_AVAILABLE
+        if use_jit:
+            return self._detect_raw_defense_phases_jit()
+
+        frames, directions, starts = self.observations.frame_groups()
+        frames = frames.tolist()
+        directions = directions.tolist()
+        bounds = np.append(starts, len(self.observations))
+        pids = self.observations.player_id
+        defender = self.observations.defender_mask()
+        outer_flags = defender & self._zone_flags(self.outer_zone)
+        returned_flags = defender & self._zone_flags(self.returned_zone)
+        n_defenders = np.add.reduceat(defender.astype(np.int32), starts).tolist() if len(starts) else []
         phases = []
 
+        def defenders_in(k, flags):
+            """k 番目のフレームで flags が立っている防御選手のIDの集合"""
+            s, e = bounds[k], bounds[k + 1]
+            return set(pids[s:e][flags[s:e]].tolist())
+
+        n_frames = len(frames)
         current_direction = None
         i = 0
-        while i < len(all_frames):
-            (frame_num, direction), players = all_frames[i]
+        while i < n_frames:
+            direction = directions[i]
             #　方向が変わった瞬間を探す
             if direction != current_direction:
                 current_direction = direction
-                defender_team = 'red' if direction == 'right' else 'white'
 
                 # フェーズ開始探し
                 found_valid_start = False
-                while i < len(all_frames):
-                    (start_frame_candidate, dir_check), players = all_frames[i]
-                    if dir_check != direction:
+                while i < n_frames:
+                    if directions[i] != direction:
                         break
-                    defenders = [(x, y, pid) for x, y, team, pid in players if team == defender_team]
-                    if len(defenders) >= 6:
+                    if n_defenders[i] >= 6:
                         found_valid_start = True
                         break
                     i += 1
@@ -134,67 +219,35 @@ class FormationClassifier:
                 if not found_valid_start:
                     continue  # 有効な開始フレームが見つからなければスキップ
 
-                start_frame = all_frames[i][0][0]
+                start_frame = frames[i]
 
-                defenders = [(x, y, pid) for x, y, team, pid in players if team == defender_team]
                 # 9mラインの外側にいる選手を取得
-                outer_defenders = [
-                    pid for x, y, pid in defenders
-                    if (direction == 'right' and (0.4 < x < 0.55) and (0.2 < y < 0.8)) or
-                    (direction == 'left' and (0.45 < x < 0.6) and (0.2 < y < 0.8))
-                ]
+                outer_defenders = defenders_in(i, outer_flags)
 
                 # フェーズ終了探し
                 j = i + 1
                 end_frame = start_frame
                 end_reason = None
 
-                while j < len(all_frames):
-                    (next_frame, next_direction), next_players = all_frames[j]
+                while j < n_frames:
                     # フェーズの方向が変わったら終了
-                    if next_direction != direction:
+                    if directions[j] != direction:
                         end_reason = 'direction_change'
                         break
-                    
-                    next_defenders = {
-                        (pid, x, y) for x, y, team, pid in next_players if team == defender_team
-                    }
 
-                    someone_returned = False
                     # outer_defenders のうち戻った選手がいるか確認
-                    returned_pids = set()
-                    for pid in outer_defenders:
-                        for p, x, y in next_defenders:
-                            if p == pid:
-                                if direction == 'right' and not (0.4 < x):
-                                    returned_pids.add(p)
-                                elif direction == 'left' and not (x < 0.6):
-                                    returned_pids.add(p)
+                    returned_pids = defenders_in(j, returned_flags) & outer_defenders
 
                     if returned_pids:
                         # 一時的な戻りか確認する
                         temp_j = j + 1
                         check_window = 20
                         reentered = False
-                        while temp_j < len(all_frames) and temp_j - j <= check_window:
-                            (future_frame, future_direction), future_players = all_frames[temp_j]
-                            if future_direction != direction:
+                        while temp_j < n_frames and temp_j - j <= check_window:
+                            if directions[temp_j] != direction:
                                 break
-                            future_defenders = {
-                                (pid, x, y) for x, y, team, pid in future_players if team == defender_team
-                            }
-                            for pid in returned_pids:
-                                for p, x, y in future_defenders:
-                                    if p == pid:
-                                        if direction == 'right' and (0.4 < x < 0.55) and (0.2 < y < 0.8):
-                                            reentered = True
-                                            break
-                                        elif direction == 'left' and (0.45 < x < 0.6) and (0.2 < y < 0.8):
-                                            reentered = True
-                                            break
-                                if reentered:
-                                    break
-                            if reentered:
+                            if defenders_in(temp_j, outer_flags) & returned_pids:
+                                reentered = True
                                 break
                             temp_j += 1
 
@@ -203,21 +256,24 @@ class FormationClassifier:
                             break  # フェーズ終了とみなす
 
 
-                    end_frame = next_frame 
+                    end_frame = frames[j]
                     j += 1
 
                 # 保存（end_reason 付きで）
-                phases.append((start_frame, end_frame, direction, end_reason))
+                phases.append((start_frame, end_frame, decode(direction, DIRECTION_NAMES), end_reason))
                 i = j
             else:
                 i += 1
 
-        return self._merge_short_phases(phases, min_phase_length)
+        return phases
     
     def get_dominant_formations_by_defense_phase(self, classified_formations, defense_phases, min_length=0):
         """
         各守備フェーズ内で最多推定フォーメーションを代表とする。
+        smoothing が "viterbi" なら、フェーズ内の推定を平滑化してから数える（get_dominant_formations_by_viterbi）。
         """
+        if self.smoothing == "viterbi":
+            return self.get_dominant_formations_by_viterbi(classified_formations, defense_phases, min_length)
         direction_indexed = defaultdict(list)
         for frame_num, direction, formation, _ in classified_formations:
             direction_indexed[direction].append((frame_num, formation))
@@ -236,7 +292,12 @@ class FormationClassifier:
                 dominant_formations.append((start_frame, end_frame, best_formation, direction))
         return dominant_formations
 
-    
+    def get_dominant_formations_by_viterbi(self, classified_formations, defense_phases, min_length=0):
+        """
+        get_dominant_formations_by_defense_phase と同じ防御フェーズごとに、
+        フェーズ内のフレームごとの推定をViterbiで平滑化してから最多のフォーメーションを代表とする。
+        """
+        return dominant_by_smoothed_labels(classified_formations, defense_phases, self.switch_penalty, min_length)
 
     def save_dominant_formations_by_defense_phase(self, dominant_formations, classified_formations, output_file):
         with open(output_file, 'w', newline='') as file:
@@ -264,7 +325,102 @@ class FormationClassifier:
             for formation, count in formation_counts.items():
                 writer.writerow([formation, count])
 
-    def _merge_short_phases(self, phases, min_length):
+    def get_dominant_formations_from_rle(self, formation_rle, defense_phases, min_length=0):
+        """
+        get_dominant_formations_by_defense_phase のRLE版。フェーズ内のランだけを二分探索で集計する。
+        """
+        dominant_formations = []
+        for start_frame, end_frame, direction in defense_phases:
+            counts, _ = formation_rle.query(start_frame, end_frame, direction)
+            if not counts:
+                continue
+            best_formation = counts.most_common(1)[0][0]
+            if end_frame - start_frame >= min_length:
+                dominant_formations.append((start_frame, end_frame, best_formation, direction))
+        return dominant_formations
+
+    def save_dominant_formations_from_rle(self, dominant_formations, formation_rle, output_file):
+        """save_dominant_formations_by_defense_phase のRLE版。出力形式は同じ"""
+        with open(output_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["開始フレーム", "終了フレーム", "フォーメーション", "方向", "信頼度", "内訳"])
+            for start_frame, end_frame, dominant_formation, direction in dominant_formations:
+                counts, confidences = formation_rle.query(start_frame, end_frame, direction)
+                n_dominant = counts[dominant_formation]
+                avg_confidence = round(confidences[dominant_formation] / n_dominant, 2) if n_dominant else 0
+                breakdown_str = ', '.join(f"{k}: {v}" for k, v in counts.items())
+                writer.writerow([start_frame, end_frame, dominant_formation, direction, avg_confidence, breakdown_str])
+
+        count_output_file = output_file.replace(".csv", "_counts.csv")
+        with open(count_output_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["フォーメーション", "出現数"])
+            for formation, count in formation_rle.total_counts().items():
+                writer.writerow([formation, count])
+
+    def _detect_raw_defense_phases_jit(self, check_window=20):
+        frames, directions, starts = self.observations.frame_groups()
+        if len(frames) == 0:
+            return []
+        defender = self.observations.defender_mask()
+        n_defenders = np.add.reduceat(defender.astype(np.int32), starts)
+        pids, n_players = dense_ids(self.observations.player_id)
+        raw = raw_phase_kernel(
+            directions.astype(np.int64),
+            n_defenders.astype(np.int64),
+            np.append(starts, len(self.observations)).astype(np.int64),
+            pids,
+            defender & self._zone_flags(self.outer_zone),
+            defender & self._zone_flags(self.returned_zone),
+            n_players,
+            check_window,
+        )
+        return [
+            (int(frames[start]), int(frames[end]), decode(direction, DIRECTION_NAMES), REASON_NAMES[reason])
+            for start, end, direction, reason in raw.tolist()
+        ]
+
+    def _zone_flags(self, zone):
+        """
+        全フレームの選手が zone に入っているかをまとめて判定し，observations と同じ並びの真偽値配列で返す。
+        zone はゾーングリッドのゾーン名か，9mラインまでの距離で判定する "outer_9m" / "returned_9m"
+        """
+        if not hasattr(self, '_zone_flag_cache'):
+            self._zone_flag_cache = {}
+        if zone in self._zone_flag_cache:
+            return self._zone_flag_cache[zone]
+
+        # 正準座標（全て right の向き）で1組のゾーンだけを使う．right / left 以外の方向はどのゾーンにも入らない
+        obs = self.observations.canonical()
+        known = obs.direction >= 0
+        if zone == "outer_9m":
+            flags = self._outer_9m_states(obs)
+        elif zone == "returned_9m":
+            flags = get_distance_field(CANONICAL_SIDE).distance_to_line(obs.x, obs.y, 9.0) < -self.exit_margin
+        else:
+            flags = get_zone_grid(CANONICAL_SIDE).contains(zone, obs.x, obs.y)
+        flags = flags & known
+
+        self._zone_flag_cache[zone] = flags
+        return flags
+
+    def _outer_9m_states(self, obs):
+        """
+        direction が続く区間・選手IDごとに時系列でヒステリシスをかけて，9mラインの外側（band_width[m]以内）にいるかを判定．
+        状態は direction が切り替わるたびにやり直すので，split_direction_chunks で分けて処理しても同じ結果になる．
+        obs は正準座標にしたもの
+        """
+        distance = get_distance_field(CANONICAL_SIDE).distance_to_line(obs.x, obs.y, 9.0)
+        segment = np.zeros(len(obs), dtype=np.int64)
+        segment[1:] = np.cumsum(obs.direction[1:] != obs.direction[:-1])
+        order = np.lexsort((obs.frame_num, obs.player_id, segment))
+        groups = segment[order] * (2 ** 32) + obs.player_id[order]
+        states = np.empty(len(distance), dtype=bool)
+        states[order] = hysteresis_states(distance[order], groups, self.enter_margin, self.exit_margin)
+        return states & (distance <= self.band_width)
+
+    @staticmethod
+    def _merge_short_phases(phases, min_length):
         """
         direction_changeで終わる短いフェーズを、前後と結合。
         outer_returnによる短いフェーズはそのまま保持。
@@ -14,9 +14,7 @@ CSVデータの一番最後までこの処理を実行して，防御フェー
 
 import csv
 from collections import defaultdict, Counter
-import numpy as np
 import time
-from tqdm import tqdm
 
 # 理想的なフォーメーション座標
 # formation_positions = {
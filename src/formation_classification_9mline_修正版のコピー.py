@@ -8,12 +8,7 @@ CSVファイルから選手の位置情報を読み込み，6人の選手の位
 
 import csv
 from collections import defaultdict, Counter
-from typing import List, Tuple
-from scipy.spatial.distance import cdist
-from scipy.optimize import linear_sum_assignment
 import numpy as np
-from itertools import combinations
-from tqdm import tqdm
 import time
 
 # 理想的なフォーメーション座標
@@ -7,11 +7,8 @@ CSVファイルから選手の位置情報を読み込み，6人の選手の位
 
 import csv
 from collections import defaultdict, Counter
-from scipy.spatial.distance import cdist
-from scipy.optimize import linear_sum_assignment
 import numpy as np
 from itertools import combinations
-from tqdm import tqdm
 import time  # Add import for time module
 
 # 理想的なフォーメーション座標
@@ -51,6 +48,9 @@ class FormationClassifier:
     
     def classify_formations(self):
         """全選手から6人を選び、最も一致度の高い組を使ってフォーメーション分類"""
+        from scipy.optimize import linear_sum_assignment
+        from scipy.spatial.distance import cdist
+        from tqdm import tqdm
         classified_formations = []
 
         all_items = list(self.attack_formations.items())
@@ -8,11 +8,7 @@ CSVファイルから選手の位置情報を読み込み，6人の選手の位
 
 import csv
 from collections import defaultdict, Counter
-from scipy.spatial.distance import cdist
-from scipy.optimize import linear_sum_assignment
 import numpy as np
-from itertools import combinations
-from tqdm import tqdm
 import time  # Add import for time module
 
 # 理想的なフォーメーション座標
@@ -52,6 +48,8 @@ class FormationClassifier:
 
     def classify_formations(self):
         """フレームごとに6人(x軸に基づく)まとめてフォーメーション判別（ハンガリアン法ベース）"""
+        from scipy.optimize import linear_sum_assignment
+        from scipy.spatial.distance import cdist
         classified_formations = []
 
         for (frame_num, direction), positions in self.attack_formations.items():
@@ -0,0 +1,183 @@
+"""
+フレームごとのフォーメーション推定結果をランレングス符号化（RLE）で保持するモジュールです．
+(frame_num, direction, formation, confidence) のタプルを全フレーム分持つ代わりに，
+同じフォーメーション・方向が連続するフレームを1つのラン
+（開始フレーム, 長さ, フォーメーション番号, 方向番号, 信頼度の合計）にまとめます．
+フレーム範囲での集計と，npz形式での保存・読み込みができます．
+"""
+
+from collections import Counter
+
+import numpy as np
+
+
+class FormationRLE:
+    def __init__(self, labels=None, directions=("right", "left")):
+        self.labels = list(labels) if labels else []
+        self.directions = list(directions)
+        self._starts = []
+        self._lengths = []
+        self._label_ids = []
+        self._direction_ids = []
+        self._conf_sums = []
+        self._arrays = None
+        self._cummax_ends = None
+
+    @classmethod
+    def from_classified(cls, classified_formations):
+        """classify_formations の結果のリストから作成"""
+        rle = cls()
+        for frame_num, direction, formation, confidence in sorted(classified_formations):
+            rle.append(frame_num, direction, formation, confidence)
+        return rle
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _label_id(self, formation):
+        if formation not in self.labels:
+            self.labels.append(formation)
+        return self.labels.index(formation)
+
+    def _direction_id(self, direction):
+        if direction not in self.directions:
+            self.directions.append(direction)
+        return self.directions.index(direction)
+
+    def append(self, frame_num, direction, formation, confidence=1.0):
+        """
+        1フレーム分の推定結果を追加する．フレーム番号は昇順で渡すこと．
+        直前のランと連続したフレームで，フォーメーションと方向が同じならランを延長する
+        """
+        label_id = self._label_id(formation)
+        direction_id = self._direction_id(direction)
+        self._arrays = None
+        self._cummax_ends = None
+        if (
+            self._starts
+            and self._starts[-1] + self._lengths[-1] == frame_num
+            and self._label_ids[-1] == label_id
+            and self._direction_ids[-1] == direction_id
+        ):
+            self._lengths[-1] += 1
+            self._conf_sums[-1] += confidence
+            return
+        self._starts.append(frame_num)
+        self._lengths.append(1)
+        self._label_ids.append(label_id)
+        self._direction_ids.append(direction_id)
+        self._conf_sums.append(confidence)
+
+    def discard_before(self, frame_num):
+        """
+        frame_num より前に終わっているランを先頭から捨てる（ストリーム処理で確定済みの区間を手放すため）．
+        方向の違うランが重なっていても，まだ終わっていないランより後ろは残す
+        """
+        n = 0
+        max_end = None
+        for start, length in zip(self._starts, self._lengths):
+            end = start + length - 1
+            max_end = end if max_end is None else max(max_end, end)
+            if max_end >= frame_num:
+                break
+            n += 1
+        if n == 0:
+            return 0
+        for values in (self._starts, self._lengths, self._label_ids, self._direction_ids, self._conf_sums):
+            del values[:n]
+        self._arrays = None
+        self._cummax_ends = None
+        return n
+
+    def arrays(self):
+        """(開始フレーム, 長さ, フォーメーション番号, 方向番号, 信頼度の合計) の配列を返す"""
+        if self._arrays is None:
+            self._cummax_ends = None
+            self._arrays = (
+                np.asarray(self._starts, dtype=np.int64),
+                np.asarray(self._lengths, dtype=np.int32),
+                np.asarray(self._label_ids, dtype=np.int16),
+                np.asarray(self._direction_ids, dtype=np.int8),
+                np.asarray(self._conf_sums, dtype=np.float64),
+            )
+        return self._arrays
+
+    def _max_ends(self):
+        starts, lengths, _, _, _ = self.arrays()
+        if self._cummax_ends is None:
+            self._cummax_ends = np.maximum.accumulate(starts + lengths - 1)
+        return self._cummax_ends
+
+    def query(self, start_frame, end_frame, direction=None):
+        """
+        start_frame <= frame <= end_frame の範囲で，フォーメーションごとのフレーム数と信頼度の合計を返す．
+        フォーメーションは範囲内で最初に現れた順に並ぶ
+        """
+        starts, lengths, label_ids, direction_ids, conf_sums = self.arrays()
+        counts = Counter()
+        confidences = Counter()
+        if len(starts) == 0:
+            return counts, confidences
+
+        # 範囲と重なるランだけを二分探索で取り出す（方向の違うランは重なり得るので終了フレームの累積最大で探す）
+        first = int(np.searchsorted(self._max_ends(), start_frame, side="left"))
+        last = int(np.searchsorted(starts, end_frame, side="right"))
+        ends = starts[first:last] + lengths[first:last] - 1
+        overlap = (
+            np.minimum(ends, end_frame) - np.maximum(starts[first:last], start_frame) + 1
+        )
+        mask = overlap > 0
+        if direction is not None:
+            if direction not in self.directions:
+                return counts, confidences
+            mask &= direction_ids[first:last] == self.directions.index(direction)
+
+        # 一部だけ重なるランの信頼度はフレーム数で按分する
+        weights = overlap / lengths[first:last]
+        for label_id, n, conf in zip(
+            label_ids[first:last][mask], overlap[mask], (conf_sums[first:last] * weights)[mask]
+        ):
+            formation = self.labels[label_id]
+            counts[formation] += int(n)
+            confidences[formation] += float(conf)
+        return counts, confidences
+
+    def total_counts(self):
+        """全フレームでのフォーメーションごとの出現数"""
+        _, lengths, label_ids, _, _ = self.arrays()
+        totals = np.bincount(label_ids, weights=lengths, minlength=len(self.labels))
+        counts = Counter()
+        for label_id in dict.fromkeys(label_ids.tolist()):
+            counts[self.labels[label_id]] = int(totals[label_id])
+        return counts
+
+    def iter_frames(self):
+        """フレームごとの (frame_num, direction, formation, confidence) に展開する．信頼度はラン内の平均"""
+        for start, length, label_id, direction_id, conf_sum in zip(*self.arrays()):
+            confidence = float(conf_sum) / int(length)
+            for frame_num in range(int(start), int(start) + int(length)):
+                yield frame_num, self.directions[direction_id], self.labels[label_id], confidence
+
+    def save(self, path):
+        starts, lengths, label_ids, direction_ids, conf_sums = self.arrays()
+        np.savez_compressed(
+            path,
+            starts=starts,
+            lengths=lengths,
+            label_ids=label_ids,
+            direction_ids=direction_ids,
+            conf_sums=conf_sums,
+            labels=np.asarray(self.labels, dtype=str),
+            directions=np.asarray(self.directions, dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            rle = cls(labels=data["labels"].tolist(), directions=data["directions"].tolist())
+            rle._starts = data["starts"].tolist()
+            rle._lengths = data["lengths"].tolist()
+            rle._label_ids = data["label_ids"].tolist()
+            rle._direction_ids = data["direction_ids"].tolist()
+            rle._conf_sums = data["conf_sums"].tolist()
+        return rle
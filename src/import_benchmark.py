@@ -0,0 +1,76 @@
+"""
+中核のモジュールの読み込み時間を測り，重い依存ライブラリを読み込んでいないかを確かめるスクリプトです．
+短時間で終わるワーカーのプロセスをたくさん起動するバッチ処理やライブの処理では読み込み時間が効いてくるので，
+モジュールを変更したときに実行して，予算を超えていないかを確認します．
+予算を超えたか重いライブラリを読み込んだモジュールがあれば終了コード 1 で終わります．
+"""
+
+import statistics
+import subprocess
+import sys
+
+# 読み込むだけで使えるようにしておきたいモジュールと，読み込み時に必要な標準ライブラリ．
+# 標準ライブラリの読み込み時間（asyncio なら数十ms）は基準に含め，予算はモジュール自身の分だけにかける
+CORE_MODULES = {
+    "observations": (),
+    "court_zones": (),
+    "formation_classification_9mline_latest": (),
+    "online_classifier": (),
+    "phase_stream": ("json",),
+    "live_server": ("asyncio", "json", "urllib.parse"),
+    "incremental_pipeline": ("json",),
+    "parallel_phases": ("concurrent.futures.process",),
+}
+
+# 必要になった戦略や表示の中でだけ読み込むライブラリ
+HEAVY_MODULES = ("scipy", "pandas", "matplotlib", "tqdm", "numba", "openvino", "cv2", "torch")
+
+# NumPy と必要な標準ライブラリの読み込みに上乗せしてよい時間[ms]
+BUDGET_MS = 50.0
+
+_PROBE = """
+import sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+heavy = sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy!r}))
+print(elapsed * 1000, ",".join(heavy))
+"""
+
+
+def measure(module, repeat=5):
+    """新しいインタプリタで module を読み込み，(読み込み時間[ms]の中央値, 読み込まれた重いライブラリ) を返す"""
+    times = []
+    heavy = ""
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        times.append(float(output[0]))
+        heavy = output[1] if len(output) > 1 else ""
+    return statistics.median(times), heavy
+
+
+def run(modules=CORE_MODULES, budget_ms=BUDGET_MS, repeat=5):
+    baselines = {}
+    ok = True
+    for module, stdlib in modules.items():
+        # 同じ標準ライブラリを使うモジュールは基準を1回だけ測る
+        baseline = ", ".join(("numpy",) + tuple(stdlib))
+        if baseline not in baselines:
+            baselines[baseline], _ = measure(baseline, repeat)
+            print(f"{baseline:<42}{baselines[baseline]:>8.1f} ms")
+        elapsed, heavy = measure(module, repeat)
+        extra = elapsed - baselines[baseline]
+        over = extra > budget_ms
+        status = "予算超過" if over else ""
+        if heavy:
+            status += f" 重いライブラリ: {heavy}"
+        print(f"  {module:<40}{elapsed:>8.1f} ms  ({extra:+.1f}) {status}")
+        ok = ok and not over and not heavy
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
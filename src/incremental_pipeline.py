@@ -0,0 +1,63 @@
+"""
+試合の一部の追跡データを修正したときに，変わった部分だけを再計算するためのモジュールです．
+防御フェーズの検出は direction が切り替わるたびにやり直しになるので，
+direction が続く区間ごとにデータを分け（チャンク），チャンクごとのフレームごとの推定結果と結合前のフェーズを
+result_cache.ResultCache に保存します．キーはチャンクの内容のハッシュ，パラメータ，CACHE_VERSION で，
+古いものは ResultCache の上限を超えたときに LRU で消えます．
+再実行時はハッシュが変わったチャンクだけを計算し直し，最後にチャンクをつないで短いフェーズの結合を行います．
+"""
+
+from formation_classification_9mline_latest import FormationClassifier
+from result_cache import ResultCache, classifier_params
+
+STRATEGY = "9mline_latest_chunk"
+
+
+class IncrementalClassifier:
+    def __init__(self, cache_dir="../data/cache/results", zone_mode="box", max_gap=0, cache=None):
+        """cache（ResultCache）を渡せば他の処理とキャッシュを共有する．なければ cache_dir に作る"""
+        self.cache = cache if cache is not None else ResultCache(cache_dir)
+        self.params = classifier_params(zone_mode=zone_mode, max_gap=max_gap)
+        self.stats = {"chunks": 0, "recomputed": 0}
+
+    def run(self, observations, min_phase_length=50):
+        """
+        フレームごとの推定結果（フレーム順）と，結合済みの防御フェーズを返す。
+        distance モードのヒステリシスは FormationClassifier でも direction の区間ごとにやり直すので，
+        結果は試合全体を1度に処理した場合と同じになる
+        """
+        classified_formations = []
+        raw_phases = []
+        self.stats = {"chunks": 0, "recomputed": 0}
+        for chunk in observations.split_direction_chunks():
+            classified, phases = self._run_chunk(chunk)
+            classified_formations.extend(classified)
+            raw_phases.extend(phases)
+            self.stats["chunks"] += 1
+        return classified_formations, FormationClassifier._merge_short_phases(raw_phases, min_phase_length)
+
+    def _run_chunk(self, chunk):
+        data_hash = chunk.content_hash()
+        cached = self.cache.get(data_hash, STRATEGY, self.params)
+        if cached is not None and cached[1] is not None:
+            return cached
+
+        classifier = FormationClassifier(None, observations=chunk, **self.params)
+        classified = list(classifier._iter_frame_formations())
+        phases = classifier.detect_raw_defense_phases()
+        self.cache.put(data_hash, STRATEGY, self.params, classified, phases)
+        self.stats["recomputed"] += 1
+        return classified, phases
+
+
+if __name__ == "__main__":
+    import time
+
+    csv_file = "../data/transform/transformed_player_points.csv"
+
+    start_time = time.time()
+    observations = FormationClassifier(csv_file).observations
+    incremental = IncrementalClassifier()
+    classified_formations, defense_phases = incremental.run(observations)
+    print(f"{incremental.stats['recomputed']}/{incremental.stats['chunks']} チャンクを再計算しました。")
+    print(f"Processing completed in {time.time() - start_time:.2f} seconds.")
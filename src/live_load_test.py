@@ -0,0 +1,92 @@
+"""
+live_server の負荷試験です．試合のCSVを再生しながら多数の WebSocket クライアントを接続し，
+サーバが状態を作ってからクライアントが受け取るまでの遅延と，受け取ったメッセージ数を集計します．
+サーバとクライアントは同じイベントループで動かすので，結果はノートPC1台で全てを動かした場合の目安です．
+"""
+
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+
+from live_server import LiveFormationServer, encode_frame, read_frame
+from online_classifier import iter_tracking_frames
+
+
+async def simulated_client(host, port, latencies, stop):
+    """WebSocket で接続し，stop が立つまで受け取ったメッセージの遅延[s]を latencies に追加する"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f"GET /ws HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {os.urandom(16).hex()[:22]}==\r\nSec-WebSocket-Version: 13\r\n\r\n".encode()
+    )
+    await writer.drain()
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+
+    received = 0
+    try:
+        while not stop.is_set():
+            try:
+                opcode, payload = await asyncio.wait_for(read_frame(reader), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            if opcode == 0x8:
+                break
+            state = json.loads(payload)
+            # 接続直後の1件は過去の状態なので数えない
+            if received:
+                latencies.append(time.time() - state["sent_at"])
+            received += 1
+        writer.write(encode_frame(b"", opcode=0x8, mask=os.urandom(4)))
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+    return received
+
+
+async def run_load_test(csv_file, n_clients=200, speed=4.0, host="127.0.0.1", port=8766, max_frames=None):
+    """speed 倍速で試合を再生しながら n_clients 台のクライアントで受信し，集計結果の辞書を返す"""
+    live = LiveFormationServer()
+    await live.start(host, port)
+    latencies = []
+    stop = asyncio.Event()
+    clients = [asyncio.ensure_future(simulated_client(host, port, latencies, stop)) for _ in range(n_clients)]
+    # 全員がつながってから再生を始める
+    while len(live.clients) < n_clients:
+        await asyncio.sleep(0.01)
+
+    frames = iter_tracking_frames(csv_file)
+    if max_frames is not None:
+        frames = (item for n, item in zip(range(max_frames), frames))
+    started = time.monotonic()
+    await live.replay(frames, speed=speed)
+    elapsed = time.monotonic() - started
+    await asyncio.sleep(0.5)
+    stop.set()
+    received = await asyncio.gather(*clients)
+    await live.stop()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "clients": n_clients,
+        "frames": live.frames_processed,
+        "replay_seconds": round(elapsed, 2),
+        "messages_per_client": round(float(np.mean(received)), 1),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 1) if len(latencies) else None,
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 1) if len(latencies) else None,
+        "latency_ms_max": round(float(latencies.max()), 1) if len(latencies) else None,
+        "phases": len(live.history),
+    }
+
+
+if __name__ == "__main__":
+    csv_file = "../data/transform/transformed_player_points.csv"
+
+    for n_clients in (10, 100, 500):
+        result = asyncio.run(run_load_test(csv_file, n_clients=n_clients))
+        print(result)
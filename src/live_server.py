@@ -0,0 +1,327 @@
+"""
+試合中にベンチのタブレットから相手の防御フォーメーションを見るための，ローカルで動くサーバです．
+OnlineFormationClassifier でフレームを1つずつ処理し，進行中のフェーズ・現在のフォーメーション・
+直近のフレームの内訳を，接続しているクライアントへ WebSocket で送ります．
+確定したフェーズは上限付きのリングバッファに持ち，HTTP で最近の履歴を返します．
+標準ライブラリ（asyncio）だけで動くので，アナリストのノートPC以外に何も要りません．
+
+    GET /          タブレット用の簡単な表示ページ
+    GET /current   現在の状態（JSON）
+    GET /history   最近の確定フェーズ（JSON，?n=件数）
+    GET /ws        WebSocket．状態が変わるたびに現在の状態を送る
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qs, urlsplit
+
+from online_classifier import OnlineFormationClassifier, iter_tracking_frames
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# 既定ではこのPCからしか繋がらない．ベンチのタブレットから見るときは LAN_HOST を明示して渡す
+DEFAULT_HOST = "127.0.0.1"
+LAN_HOST = "0.0.0.0"
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width">
+<title>防御フォーメーション</title>
+<style>body{font-family:sans-serif;text-align:center}#f{font-size:20vw;margin:0}</style></head>
+<body><p id="d"></p><p id="f">-</p><p id="b"></p><ol id="h" reversed></ol>
+<script>
+const ws = new WebSocket(`ws://${location.host}/ws`);
+ws.onmessage = (e) => {
+  const s = JSON.parse(e.data);
+  const p = s.phase;
+  document.getElementById("f").textContent = p ? p.formation : "-";
+  document.getElementById("d").textContent = `フレーム ${s.frame_num}（${s.direction}）`;
+  document.getElementById("b").textContent =
+    Object.entries(s.breakdown).map(([k, v]) => `${k}: ${Math.round(v * 100)}%`).join("  ");
+  if (s.closed.length) {
+    const h = document.getElementById("h");
+    for (const r of s.closed) {
+      const li = document.createElement("li");
+      li.textContent = `${r.start_frame}-${r.end_frame} ${r.direction} ${r.formation}`;
+      h.prepend(li);
+    }
+  }
+};
+</script></body></html>
+"""
+
+
+##################WebSocket##################
+
+def websocket_accept(key):
+    """Sec-WebSocket-Key から Sec-WebSocket-Accept の値を作る"""
+    return base64.b64encode(hashlib.sha1((key + _WS_GUID).encode()).digest()).decode()
+
+
+def encode_frame(payload, opcode=0x1, mask=None):
+    """1つのフレームにまとめる．クライアントから送るときは4バイトの mask を渡す"""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 1 << 16:
+        header.append(mask_bit | 126)
+        header += struct.pack("!H", length)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack("!Q", length)
+    if mask:
+        header += mask
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return bytes(header) + payload
+
+
+async def read_frame(reader):
+    """1つのフレームを読み (opcode, payload) を返す"""
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+async def read_http_request(reader):
+    """リクエスト行とヘッダーを読み (メソッド, パス, ヘッダーの辞書) を返す"""
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1")
+        if line in ("\r\n", "\n", ""):
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    method, path, _ = (request_line.split(" ") + ["", "", ""])[:3]
+    return method, path, headers
+
+
+##################サーバ##################
+
+class LiveFormationServer:
+    """
+    history_size 件までの確定フェーズをリングバッファに持つ．
+    breakdown_window フレーム分の推定の割合を「直近の内訳」として送る．
+    状態は push_interval 秒ごと，またはフェーズが確定したときにすぐ送る
+    """
+
+    def __init__(self, min_phase_length=50, history_size=200, breakdown_window=150,
+                 push_interval=0.2, client_queue_size=8):
+        self.classifier = OnlineFormationClassifier(min_phase_length, windowed=True)
+        self.history = deque(maxlen=history_size)
+        self.recent_formations = deque(maxlen=breakdown_window)
+        self.recent_counts = Counter()
+        self.push_interval = push_interval
+        self.client_queue_size = client_queue_size
+        self.clients = set()
+        self.state = self._make_state(None, None, [])
+        self.last_push = 0.0
+        self.pending_closed = []
+        self.frames_processed = 0
+        self.server = None
+        self.handlers = set()
+
+    ##################フレームの処理##################
+
+    def push_frame(self, key, frame):
+        """1フレーム分（Observations）を処理し，必要ならクライアントへ送る"""
+        closed = self.classifier.push_frame(key, frame)
+        # フレーム数と直近の内訳は実際に処理したフレームだけで数える（flush では数えない）
+        self.frames_processed += 1
+        formation = self.classifier.last_frame[1] if self.classifier.last_frame else None
+        if formation is not None:
+            # 直近 breakdown_window フレームの内訳を差分で更新する
+            if len(self.recent_formations) == self.recent_formations.maxlen:
+                old = self.recent_formations[0]
+                self.recent_counts[old] -= 1
+                if self.recent_counts[old] == 0:
+                    del self.recent_counts[old]
+            self.recent_formations.append(formation)
+            self.recent_counts[formation] += 1
+        self._update(key, closed)
+
+    def flush(self):
+        closed = self.classifier.flush()
+        key = self.classifier.last_frame[0] if self.classifier.last_frame else (None, None)
+        self._update(key, closed, force=True)
+
+    def _update(self, key, closed, force=False):
+        self.history.extend(closed)
+        self.pending_closed.extend(closed)
+
+        now = time.monotonic()
+        if force or closed or now - self.last_push >= self.push_interval:
+            self.last_push = now
+            self.state = self._make_state(key[0], key[1], self.pending_closed)
+            self.pending_closed = []
+            self.broadcast(json.dumps(self.state, ensure_ascii=False))
+
+    def _make_state(self, frame_num, direction, closed):
+        total = sum(self.recent_counts.values())
+        return {
+            "frame_num": frame_num,
+            "direction": direction,
+            "phase": self.classifier.current_phase() if frame_num is not None else None,
+            "breakdown": {k: round(v / total, 3) for k, v in self.recent_counts.items()} if total else {},
+            "closed": list(closed),
+            "sent_at": time.time(),
+        }
+
+    async def replay(self, source, fps=30.0, speed=1.0):
+        """
+        (key, frame) のイテラブルを試合の速さで流す（speed 倍速．fps=None なら待たずに流す）．
+        映像から直接流す場合は，位置のリストを frame_from_positions で変換して push_frame を呼べばよい
+        """
+        started = time.monotonic()
+        first_frame = None
+        for key, frame in source:
+            if fps:
+                first_frame = key[0] if first_frame is None else first_frame
+                wait = started + (key[0] - first_frame) / (fps * speed) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            else:
+                await asyncio.sleep(0)
+            self.push_frame(key, frame)
+        self.flush()
+
+    ##################クライアントへの送信##################
+
+    def broadcast(self, message):
+        """全クライアントのキューに入れる．遅いクライアントは古いメッセージから捨てて待たせない"""
+        for queue in self.clients:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def handle(self, reader, writer):
+        self.handlers.add(asyncio.current_task())
+        try:
+            method, path, headers = await read_http_request(reader)
+            url = urlsplit(path)
+            if method != "GET":
+                await self._respond(writer, 405, "text/plain", b"method not allowed")
+            elif url.path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                if "sec-websocket-key" in headers:
+                    await self._websocket(reader, writer, headers)
+                else:
+                    await self._respond(writer, 400, "text/plain", b"missing Sec-WebSocket-Key")
+            elif url.path == "/":
+                await self._respond(writer, 200, "text/html; charset=utf-8", PAGE.encode("utf-8"))
+            elif url.path == "/current":
+                await self._respond_json(writer, self.state)
+            elif url.path == "/history":
+                n = int(parse_qs(url.query).get("n", [len(self.history)])[0])
+                await self._respond_json(writer, list(self.history)[-n:] if n > 0 else [])
+            else:
+                await self._respond(writer, 404, "text/plain", b"not found")
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+            self.handlers.discard(asyncio.current_task())
+
+    async def _respond(self, writer, status, content_type, body):
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}[status]
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nAccess-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+    async def _respond_json(self, writer, value):
+        await self._respond(writer, 200, "application/json", json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    async def _websocket(self, reader, writer, headers):
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {websocket_accept(headers['sec-websocket-key'])}\r\n\r\n".encode()
+        )
+        queue = asyncio.Queue(maxsize=self.client_queue_size)
+        # 接続直後に現在の状態と最近の確定フェーズを送る
+        queue.put_nowait(json.dumps({**self.state, "closed": list(self.history)[-20:]}, ensure_ascii=False))
+        self.clients.add(queue)
+
+        async def receive():
+            # クライアントからは close と ping だけを扱う
+            try:
+                while True:
+                    opcode, payload = await read_frame(reader)
+                    if opcode == 0x8:
+                        return
+                    if opcode == 0x9:
+                        writer.write(encode_frame(payload, opcode=0xA))
+            except (ConnectionError, asyncio.IncompleteReadError):
+                return
+
+        receiving = asyncio.ensure_future(receive())
+        try:
+            while not receiving.done():
+                getting = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getting, receiving}, return_when=asyncio.FIRST_COMPLETED)
+                if getting not in done:
+                    getting.cancel()
+                    break
+                message = getting.result()
+                if message is None:
+                    break  # サーバの停止
+                writer.write(encode_frame(message))
+                await writer.drain()
+            writer.write(encode_frame(b"", opcode=0x8))
+        finally:
+            receiving.cancel()
+            self.clients.discard(queue)
+
+    async def start(self, host=DEFAULT_HOST, port=8765):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def stop(self):
+        """WebSocket のクライアントに close を送り，処理中の接続が終わるのを待ってから止める"""
+        if self.server is None:
+            return
+        self.server.close()
+        for queue in self.clients:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+
+async def serve_replay(csv_file, host=DEFAULT_HOST, port=8765, speed=1.0):
+    """
+    CSVを試合の速さで流しながらサーバを動かす（映像の処理の代わりの試合の再生）．
+    タブレットなど他の端末から見るときは host=LAN_HOST を渡す
+    """
+    live = LiveFormationServer()
+    await live.start(host, port)
+    print(f"http://{host}:{port}/ で待ち受けています。")
+    await live.replay(iter_tracking_frames(csv_file), speed=speed)
+    # 再生が終わっても履歴は見られるようにしておく
+    await live.server.serve_forever()
+
+
+if __name__ == "__main__":
+    csv_file = "../data/transform/transformed_player_points.csv"
+    # 同じLANのタブレットから見るときは LAN_HOST にする
+    host = DEFAULT_HOST
+    asyncio.run(serve_replay(csv_file, host))
@@ -0,0 +1,215 @@
+"""
+試合ごとの推定結果をSQLiteにまとめて保存・検索するモジュールです．
+formations_output*.csv などのCSVを試合ごとに読み直さなくても，
+チーム・フォーメーション・フレーム範囲で防御フェーズやフレームごとの推定結果を検索できます．
+登録はまとめて1つのトランザクションで行います．
+"""
+
+import csv
+import sqlite3
+from collections import Counter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    match_id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    red_team TEXT,
+    white_team TEXT
+);
+CREATE TABLE IF NOT EXISTS phases (
+    phase_id INTEGER PRIMARY KEY,
+    match_id INTEGER NOT NULL REFERENCES matches(match_id) ON DELETE CASCADE,
+    phase_no INTEGER NOT NULL,
+    start_frame INTEGER NOT NULL,
+    end_frame INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    defender_team TEXT,
+    formation TEXT,
+    confidence REAL
+);
+CREATE TABLE IF NOT EXISTS phase_formations (
+    phase_id INTEGER NOT NULL REFERENCES phases(phase_id) ON DELETE CASCADE,
+    formation TEXT NOT NULL,
+    frame_count INTEGER NOT NULL,
+    PRIMARY KEY (phase_id, formation)
+);
+CREATE TABLE IF NOT EXISTS frame_runs (
+    match_id INTEGER NOT NULL REFERENCES matches(match_id) ON DELETE CASCADE,
+    start_frame INTEGER NOT NULL,
+    end_frame INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    formation TEXT NOT NULL,
+    conf_sum REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_phases_team ON phases(defender_team, match_id, phase_no);
+CREATE INDEX IF NOT EXISTS idx_phases_formation ON phases(formation);
+CREATE INDEX IF NOT EXISTS idx_phases_frames ON phases(match_id, start_frame, end_frame);
+CREATE INDEX IF NOT EXISTS idx_phase_formations_formation ON phase_formations(formation);
+CREATE INDEX IF NOT EXISTS idx_frame_runs_frames ON frame_runs(match_id, start_frame, end_frame);
+"""
+
+
+def parse_breakdown(breakdown_str):
+    """"0--6: 447, 1--5: 175" の形式の内訳を {フォーメーション: フレーム数} にする"""
+    counts = Counter()
+    for item in breakdown_str.split(","):
+        if ":" not in item:
+            continue
+        formation, count = item.rsplit(":", 1)
+        counts[formation.strip()] += int(count)
+    return counts
+
+
+class MatchArchive:
+    def __init__(self, db_path="../data/output/match_archive.sqlite3"):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ##################登録##################
+
+    def add_match(self, name, dominant_formations, breakdowns, formation_rle=None,
+                  red_team="red", white_team="white", confidences=None):
+        """
+        1試合分の結果を登録する．同じ名前の試合があれば置き換える。
+        dominant_formations: (開始フレーム, 終了フレーム, フォーメーション, 方向) のリスト
+        breakdowns: フェーズごとの {フォーメーション: フレーム数}
+        formation_rle: フレームごとの推定結果（FormationRLE）．あればフレーム単位でも登録する
+        """
+        confidences = confidences or [None] * len(dominant_formations)
+        with self.conn:
+            self.conn.execute("DELETE FROM matches WHERE name = ?", (name,))
+            match_id = self.conn.execute(
+                "INSERT INTO matches (name, red_team, white_team) VALUES (?, ?, ?)",
+                (name, red_team, white_team),
+            ).lastrowid
+
+            for phase_no, ((start, end, formation, direction), counts, confidence) in enumerate(
+                zip(dominant_formations, breakdowns, confidences)
+            ):
+                defender_team = red_team if direction == "right" else white_team
+                phase_id = self.conn.execute(
+                    "INSERT INTO phases (match_id, phase_no, start_frame, end_frame, direction, "
+                    "defender_team, formation, confidence) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (match_id, phase_no, start, end, direction, defender_team, formation, confidence),
+                ).lastrowid
+                self.conn.executemany(
+                    "INSERT INTO phase_formations (phase_id, formation, frame_count) VALUES (?, ?, ?)",
+                    [(phase_id, form, int(count)) for form, count in counts.items()],
+                )
+
+            if formation_rle is not None:
+                starts, lengths, label_ids, direction_ids, conf_sums = formation_rle.arrays()
+                self.conn.executemany(
+                    "INSERT INTO frame_runs (match_id, start_frame, end_frame, direction, formation, conf_sum) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (match_id, int(s), int(s) + int(n) - 1, formation_rle.directions[d],
+                         formation_rle.labels[l], float(c))
+                        for s, n, l, d, c in zip(starts, lengths, label_ids, direction_ids, conf_sums)
+                    ],
+                )
+        return match_id
+
+    def add_match_from_rle(self, name, dominant_formations, formation_rle, **kwargs):
+        """分類器の出力（フェーズと FormationRLE）からそのまま登録する"""
+        breakdowns = []
+        confidences = []
+        for start, end, formation, direction in dominant_formations:
+            counts, conf_sums = formation_rle.query(start, end, direction)
+            breakdowns.append(counts)
+            confidences.append(round(conf_sums[formation] / counts[formation], 2) if counts[formation] else 0)
+        return self.add_match(name, dominant_formations, breakdowns, formation_rle,
+                              confidences=confidences, **kwargs)
+
+    def import_phase_csv(self, name, csv_file, **kwargs):
+        """save_dominant_formations_by_defense_phase で出力したCSVを登録する"""
+        dominant_formations = []
+        breakdowns = []
+        confidences = []
+        with open(csv_file, "r") as file:
+            reader = csv.reader(file)
+            next(reader)
+            for row in reader:
+                dominant_formations.append((int(row[0]), int(row[1]), row[2], row[3]))
+                confidences.append(float(row[4]))
+                breakdowns.append(parse_breakdown(row[5]) if len(row) > 5 else Counter({row[2]: 0}))
+        return self.add_match(name, dominant_formations, breakdowns, confidences=confidences, **kwargs)
+
+    ##################検索##################
+
+    def phases(self, team=None, formation=None, match=None):
+        """条件に合う防御フェーズを (試合名, 開始, 終了, 方向, 防御チーム, フォーメーション, 信頼度) で返す"""
+        query = (
+            "SELECT m.name, p.start_frame, p.end_frame, p.direction, p.defender_team, p.formation, p.confidence "
+            "FROM phases p JOIN matches m USING (match_id) WHERE 1 = 1"
+        )
+        params = []
+        if team is not None:
+            query += " AND p.defender_team = ?"
+            params.append(team)
+        if formation is not None:
+            query += " AND p.formation = ?"
+            params.append(formation)
+        if match is not None:
+            query += " AND m.name = ?"
+            params.append(match)
+        query += " ORDER BY m.name, p.phase_no"
+        return self.conn.execute(query, params).fetchall()
+
+    def formation_counts(self, team=None):
+        """防御チームごとの，代表フォーメーションになったフェーズ数"""
+        query = "SELECT formation, COUNT(*) FROM phases"
+        params = []
+        if team is not None:
+            query += " WHERE defender_team = ?"
+            params.append(team)
+        query += " GROUP BY formation ORDER BY COUNT(*) DESC"
+        return Counter(dict(self.conn.execute(query, params).fetchall()))
+
+    def formation_transitions(self, team):
+        """同じ試合で続くフェーズ間のフォーメーションの切り替え (前, 後) の回数"""
+        rows = self.conn.execute(
+            "SELECT formation, next_formation, COUNT(*) FROM ("
+            "SELECT formation, LEAD(formation) OVER (PARTITION BY match_id ORDER BY phase_no) AS next_formation "
+            "FROM phases WHERE defender_team = ?) "
+            "WHERE next_formation IS NOT NULL GROUP BY formation, next_formation",
+            (team,),
+        ).fetchall()
+        return Counter({(before, after): count for before, after, count in rows})
+
+    def frame_breakdown(self, match, start_frame, end_frame, direction=None):
+        """フレーム範囲内のフォーメーションごとのフレーム数をフレーム単位の推定結果から集計する"""
+        query = (
+            "SELECT r.formation, SUM(MIN(r.end_frame, ?) - MAX(r.start_frame, ?) + 1) "
+            "FROM frame_runs r JOIN matches m USING (match_id) "
+            "WHERE m.name = ? AND r.start_frame <= ? AND r.end_frame >= ?"
+        )
+        params = [end_frame, start_frame, match, end_frame, start_frame]
+        if direction is not None:
+            query += " AND r.direction = ?"
+            params.append(direction)
+        query += " GROUP BY r.formation"
+        return Counter(dict(self.conn.execute(query, params).fetchall()))
+
+
+if __name__ == "__main__":
+    import glob
+    import os
+
+    with MatchArchive() as archive:
+        for csv_file in sorted(glob.glob("../data/output/formations_output*.csv")):
+            if csv_file.endswith("_counts.csv"):
+                continue
+            name = os.path.splitext(os.path.basename(csv_file))[0]
+            archive.import_phase_csv(name, csv_file)
+        print(archive.formation_counts())
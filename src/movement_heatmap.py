@@ -0,0 +1,177 @@
+"""
+防御フェーズごとに選手の移動量を集計し，どこが攻められているかを調べるモジュールです．
+選手IDごとに隣り合うフレームの座標の差から移動距離と速度を求め，
+防御側・攻撃側それぞれについて上面図の2次元ヒストグラム（ヒートマップ）と，
+ゴール前を左・中央・右に3分割したゾーンごとの合計を出します．
+複数試合の全フェーズをまとめて1回の配列処理で計算します．
+"""
+
+import csv
+import glob
+import os
+
+import numpy as np
+
+from court_zones import METER, ZONE_BITS, get_zone_grid
+from observations import CANONICAL_SIDE, DIRECTION_NAMES, LEFT, RIGHT, Observations, encode
+
+TEAMS = ("defense", "offense")
+FRONT_ZONES = ("left", "center", "right")
+
+
+def assign_phases(frame_nums, directions, phases):
+    """各観測が属する防御フェーズの番号を返す．directions は方向コード．どのフェーズにも入らなければ -1"""
+    if not phases:
+        return np.full(len(frame_nums), -1)
+    starts = np.array([start for start, _, _ in phases])
+    ends = np.array([end for _, end, _ in phases])
+    phase_dirs = encode([direction for _, _, direction in phases], DIRECTION_NAMES)
+
+    order = np.argsort(starts, kind="stable")
+    idx = np.searchsorted(starts[order], frame_nums, side="right") - 1
+    idx = np.where(idx >= 0, order[np.maximum(idx, 0)], -1)
+    valid = (idx >= 0) & (frame_nums <= ends[idx]) & (directions == phase_dirs[idx])
+    return np.where(valid, idx, -1)
+
+
+def movement_by_phase(observations, phases, bins=(40, 40), fps=30.0, max_step=3):
+    """
+    observations: Observations（オフセット適用済み）
+    phases: (開始フレーム, 終了フレーム, 方向) のリスト
+    max_step フレーム以内の間隔で続く同じ選手の検出の間を移動とみなす。
+    heatmap は (フェーズ, チーム, y, x) の移動距離[m]，zone_totals は (フェーズ, チーム, 左・中央・右) の移動距離[m]
+    """
+    n_phases = len(phases)
+    n_x, n_y = bins
+    phase_idx = assign_phases(observations.frame_num, observations.direction, phases)
+    in_phase = phase_idx >= 0
+    obs = observations.take(in_phase)
+    phase = phase_idx[in_phase]
+    # 0 が防御側，1 が攻撃側
+    team = np.where(obs.defender_mask(), 0, 1)
+
+    order = np.lexsort((obs.frame_num, obs.player_id, phase))
+    obs = obs.take(order)
+    phase = phase[order]
+    team = team[order]
+
+    # 同じフェーズ・同じ選手で連続した検出の間の移動
+    dt = np.diff(obs.frame_num)
+    step = (
+        (phase[1:] == phase[:-1])
+        & (obs.player_id[1:] == obs.player_id[:-1])
+        & (team[1:] == team[:-1])
+        & (dt >= 1)
+        & (dt <= max_step)
+    )
+    distance = np.hypot(np.diff(obs.x), np.diff(obs.y)).astype(np.float64) / METER
+    distance = distance[step]
+    seconds = dt[step] / fps
+    moved = np.flatnonzero(step) + 1
+    end = obs.take(moved)
+    end_phase = phase[moved]
+    end_team = team[moved]
+
+    # 移動後の位置にその移動距離を積み上げる
+    ix = np.clip((end.x * n_x).astype(np.intp), 0, n_x - 1)
+    iy = np.clip((end.y * n_y).astype(np.intp), 0, n_y - 1)
+    cell = ((end_phase * len(TEAMS) + end_team) * n_y + iy) * n_x + ix
+    heatmap = np.bincount(cell, weights=distance, minlength=n_phases * len(TEAMS) * n_y * n_x)
+    heatmap = heatmap.reshape(n_phases, len(TEAMS), n_y, n_x).astype(np.float32)
+
+    # 正準座標で1つのゾーングリッドだけを引く．x の反転で攻撃側から見た左右が入れ替わるので left は戻す
+    codes = get_zone_grid(CANONICAL_SIDE).lookup(end.canonical_x, end.y)
+    zone = np.full(len(distance), -1)
+    for k, name in enumerate(FRONT_ZONES):
+        zone[(codes & (1 << ZONE_BITS[name])) != 0] = k
+    mirrored = (end.direction == LEFT) & (zone >= 0)
+    zone[mirrored] = len(FRONT_ZONES) - 1 - zone[mirrored]
+    zone[(end.direction != LEFT) & (end.direction != RIGHT)] = -1
+    in_zone = zone >= 0
+    zone_cell = (end_phase[in_zone] * len(TEAMS) + end_team[in_zone]) * len(FRONT_ZONES) + zone[in_zone]
+    zone_totals = np.bincount(
+        zone_cell, weights=distance[in_zone], minlength=n_phases * len(TEAMS) * len(FRONT_ZONES)
+    ).reshape(n_phases, len(TEAMS), len(FRONT_ZONES))
+
+    group = end_phase * len(TEAMS) + end_team
+    total_distance = np.bincount(group, weights=distance, minlength=n_phases * len(TEAMS))
+    total_seconds = np.bincount(group, weights=seconds, minlength=n_phases * len(TEAMS))
+    mean_speed = np.divide(
+        total_distance, total_seconds, out=np.zeros_like(total_distance), where=total_seconds > 0
+    )
+
+    return {
+        "heatmap": heatmap,
+        "zone_totals": zone_totals,
+        "total_distance": total_distance.reshape(n_phases, len(TEAMS)),
+        "mean_speed": mean_speed.reshape(n_phases, len(TEAMS)),
+    }
+
+
+def season_movement(matches, **kwargs):
+    """
+    matches: (試合名, Observations, フェーズのリスト) のリスト
+    全試合のフェーズを通し番号にして movement_by_phase を1回だけ呼ぶ。
+    結果と (試合名, 開始フレーム, 終了フレーム, 方向) の行のリストを返す
+    """
+    parts = []
+    all_phases = []
+    phase_rows = []
+    frame_offset = 0
+    id_offset = 0
+    for match_name, observations, phases in matches:
+        # 試合ごとにフレーム番号と選手IDをずらし，試合をまたがないようにする
+        part = observations.take(slice(None))
+        part.frame_num = observations.frame_num + frame_offset
+        part.player_id = observations.player_id + id_offset
+        parts.append(part)
+        for start, end, direction in phases:
+            all_phases.append((start + frame_offset, end + frame_offset, direction))
+            phase_rows.append((match_name, start, end, direction))
+        if len(observations):
+            frame_offset = int(part.frame_num.max()) + 1
+            id_offset = int(part.player_id.max()) + 1
+    return movement_by_phase(Observations.concat(*parts), all_phases, **kwargs), phase_rows
+
+
+def save_movement(result, phase_rows, output_dir):
+    """フェーズごとのヒートマップをnpzに，移動量のまとめをCSVに保存する"""
+    os.makedirs(output_dir, exist_ok=True)
+    np.savez_compressed(
+        os.path.join(output_dir, "movement_heatmaps.npz"),
+        heatmap=result["heatmap"],
+        zone_totals=result["zone_totals"],
+        phases=np.asarray(phase_rows, dtype=str),
+    )
+    with open(os.path.join(output_dir, "movement_summary.csv"), "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["試合", "開始フレーム", "終了フレーム", "方向", "チーム", "移動距離[m]", "平均速度[m/s]",
+                         "左", "中央", "右", "移動量が最も多いゾーン"])
+        for p, (match_name, start, end, direction) in enumerate(phase_rows):
+            for t, team in enumerate(TEAMS):
+                zones = result["zone_totals"][p, t]
+                busiest = FRONT_ZONES[int(np.argmax(zones))] if zones.sum() > 0 else ""
+                writer.writerow([
+                    match_name, start, end, direction, team,
+                    round(float(result["total_distance"][p, t]), 2),
+                    round(float(result["mean_speed"][p, t]), 2),
+                    *(round(float(v), 2) for v in zones),
+                    busiest,
+                ])
+
+
+if __name__ == "__main__":
+    from formation_classification_9mline_latest import FormationClassifier
+
+    csv_files = sorted(glob.glob("../data/transform/*.csv"))
+    output_dir = "../data/output/movement"
+
+    matches = []
+    for csv_file in csv_files:
+        classifier = FormationClassifier(csv_file)
+        phases = classifier.detect_defense_phases()
+        matches.append((os.path.splitext(os.path.basename(csv_file))[0], classifier.observations, phases))
+
+    result, phase_rows = season_movement(matches)
+    save_movement(result, phase_rows, output_dir)
+    print(f"{len(matches)}試合，{len(phase_rows)}フェーズの移動量を保存しました。")
@@ -0,0 +1,310 @@
+"""
+大きな追跡データのCSVを，必要なフレーム範囲だけ読み込むためのモジュールです（ビューア用）．
+試合全体のCSVを読み終わるまで待たずに，最初のフレームや指定したフレーム範囲をすぐに表示できます．
+
+フレーム範囲の読み込みは次の順に使えるものを使います．
+    ・バイナリキャッシュ: 一度全体を読んだCSVの列を .npy で保存したもの．memmap で開くので，
+      範囲を切り出したときに触ったページだけがディスクから読まれる
+    ・フレームインデックス: 最初にCSVを1度だけバイト列のまま走査して，フレーム番号ごとに最初の行のバイト位置を求めておき，
+      範囲の先頭の行へ移動してその範囲の行だけを読む．走査ではフレーム番号が昇順に並んでいるかも確かめ，
+      並んでいなければ使わずに全体の読み込みを待つ
+インデックスの走査と全体の読み込みはどちらも別スレッドで行い，全体を読み終わったらバイナリキャッシュを書き出します．
+数値でないIDは IdTable で番号を振るので，どの範囲から読んでも同じIDは同じ番号になります．
+"""
+
+import csv
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from observations import RED_OFFSET, WHITE_OFFSET, IdTable, Observations
+
+# インデックスを作るときに1度に読む大きさ[バイト]
+SCAN_BYTES = 8 * 1024 * 1024
+
+
+def _first_field(line, column):
+    return int(line.split(b",")[column])
+
+
+def _line_frames(block, column):
+    """
+    改行で終わる block の各行の (先頭の位置, フレーム番号) の配列．空行は除く．
+    frame_num の列が数字だけなら（何列目でも）配列のまままとめて読み，そうでなければ1行ずつ読む
+    """
+    buf = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == ord("\n"))
+    starts = np.concatenate(([0], newlines[:-1] + 1)) if len(newlines) else np.zeros(0, dtype=np.int64)
+    keep = (buf[starts] != ord("\n")) & (buf[starts] != ord("\r"))
+    starts, ends = starts[keep], newlines[keep]
+    if len(starts):
+        # 各行の column 番目のカンマの次から column + 1 番目のカンマ（なければ行末）までがフレーム番号
+        commas = np.append(np.flatnonzero(buf == ord(",")), len(buf))
+        k = np.minimum(np.searchsorted(commas, starts) + column, len(commas) - 1)
+        field_starts = starts if column == 0 else commas[k - 1] + 1
+        line_ends = ends - (buf[np.maximum(ends - 1, 0)] == ord("\r"))
+        field_ends = np.minimum(commas[k], line_ends)
+        width = field_ends - field_starts
+        # 列が足りない行があれば1行ずつ読む（_first_field がエラーにする）
+        numeric = bool(np.all(field_starts <= line_ends)) and width.min() > 0
+        values = np.zeros(len(starts), dtype=np.int64)
+        for j in range(int(width.max()) if numeric else 0):
+            has = j < width
+            digit = buf[np.minimum(field_starts + j, len(buf) - 1)].astype(np.int64) - ord("0")
+            if np.any(has & ((digit < 0) | (digit > 9))):
+                numeric = False
+                break
+            values = np.where(has, values * 10 + digit, values)
+        if numeric:
+            return starts, values
+    values = [_first_field(block[start:block.index(b"\n", start)], column) for start in starts.tolist()]
+    return starts, np.asarray(values, dtype=np.int64)
+
+
+class FrameIndex:
+    """
+    CSVのフレーム番号から，そのフレームの最初の行の先頭のバイト位置を求める．
+    作るときに読むのはヘッダーだけで，走査は build（background=True なら別スレッド）で行う．
+    is_sorted などの走査の結果は，走査が終わるまで待ってから返す
+    """
+
+    def __init__(self, csv_file, background=False):
+        self.csv_file = csv_file
+        self.file_size = os.path.getsize(csv_file)
+        with open(csv_file, 'rb') as file:
+            header_line = file.readline()
+            self.data_start = file.tell()
+        self.header = next(csv.reader([header_line.decode("utf-8-sig")]))
+        self.frame_column = self.header.index("frame_num")
+        self._built = threading.Event()
+        self._error = None
+        if background:
+            threading.Thread(target=self.build, daemon=True).start()
+        else:
+            self.build()
+
+    @property
+    def ready(self):
+        return self._built.is_set()
+
+    def wait(self, timeout=None):
+        """走査が終わるまで待つ．走査が失敗していればその例外を送出する"""
+        finished = self._built.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return finished
+
+    @property
+    def is_sorted(self):
+        self.wait()
+        return self._is_sorted
+
+    @property
+    def min_frame(self):
+        self.wait()
+        return self._min_frame
+
+    @property
+    def max_frame(self):
+        self.wait()
+        return self._max_frame
+
+    def build(self):
+        try:
+            with open(self.csv_file, 'rb') as file:
+                file.seek(self.data_start)
+                self._build(file)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._built.set()
+
+    def _build(self, file):
+        """ファイル全体を走査して，フレームが変わる行の位置と，フレーム番号が昇順に並んでいるかを調べる"""
+        frames = []
+        offsets = []
+        is_sorted = True
+        min_frame = max_frame = None
+        previous = None
+        base = self.data_start
+        rest = b""
+        while True:
+            chunk = file.read(SCAN_BYTES)
+            data = rest + chunk
+            if chunk:
+                cut = data.rfind(b"\n") + 1
+                block, rest = data[:cut], data[cut:]
+            else:
+                block, rest = data, b""
+                if block and not block.endswith(b"\n"):
+                    block += b"\n"
+            if block:
+                starts, values = _line_frames(block, self.frame_column)
+                if len(values):
+                    if np.any(np.diff(values) < 0) or (previous is not None and values[0] < previous):
+                        is_sorted = False
+                    change = np.ones(len(values), dtype=bool)
+                    change[1:] = values[1:] != values[:-1]
+                    if previous is not None and values[0] == previous:
+                        change[0] = False
+                    frames.append(values[change])
+                    offsets.append(base + starts[change])
+                    block_min, block_max = int(values.min()), int(values.max())
+                    min_frame = block_min if min_frame is None else min(min_frame, block_min)
+                    max_frame = block_max if max_frame is None else max(max_frame, block_max)
+                    previous = int(values[-1])
+                base += len(block) if chunk else len(data)
+            if not chunk:
+                break
+        self.frames = np.concatenate(frames) if frames else np.zeros(0, dtype=np.int64)
+        self.frame_offsets = np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64)
+        self._is_sorted = is_sorted
+        self._min_frame, self._max_frame = min_frame, max_frame
+
+    def offset(self, frame_num):
+        """frame_num 以上の最初の行の先頭のバイト位置．昇順に並んだCSVでだけ使える"""
+        k = int(np.searchsorted(self.frames, frame_num, side="left"))
+        return int(self.frame_offsets[k]) if k < len(self.frames) else self.file_size
+
+    def read_range(self, start_frame, end_frame, red_offset=RED_OFFSET, white_offset=WHITE_OFFSET, id_table=None):
+        """start_frame から end_frame（含む）までの行だけを読んで Observations にする"""
+        if not self.is_sorted:
+            raise ValueError(f"フレーム番号が昇順に並んでいないので範囲だけを読めません: {self.csv_file}")
+        rows = []
+        with open(self.csv_file, 'rb') as file:
+            file.seek(self.offset(start_frame))
+            for line in file:
+                if not line.strip():
+                    continue
+                if _first_field(line, self.frame_column) > end_frame:
+                    break
+                rows.append(line.decode("utf-8"))
+        return Observations.from_rows(self.header, csv.reader(rows), red_offset, white_offset, id_table)
+
+
+def cache_dir_for(csv_file, red_offset, white_offset, cache_root="../data/cache/observations"):
+    """CSVのパス・大きさ・更新時刻とオフセットで決まるキャッシュのディレクトリ"""
+    stat = os.stat(csv_file)
+    key = json.dumps([os.path.abspath(csv_file), stat.st_size, stat.st_mtime_ns, red_offset, white_offset])
+    return os.path.join(cache_root, hashlib.sha1(key.encode()).hexdigest())
+
+
+def save_cache(observations, cache_dir):
+    """列ごとに .npy で保存する．書き終わってから置き換えるので，途中のものを読むことはない"""
+    tmp_dir = f"{cache_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name in Observations.FIELDS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(getattr(observations, name)))
+    with open(os.path.join(tmp_dir, "id_names.json"), 'w') as file:
+        json.dump(observations.id_names, file)
+    os.replace(tmp_dir, cache_dir)
+
+
+def load_cache(cache_dir):
+    """save_cache で保存した列を memmap で開く．なければ None"""
+    if not os.path.isdir(cache_dir):
+        return None
+    columns = [np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r') for name in Observations.FIELDS]
+    with open(os.path.join(cache_dir, "id_names.json"), 'r') as file:
+        id_names = json.load(file)
+    return Observations(*columns, id_names=id_names)
+
+
+class PagedObservations:
+    """
+    CSVのフレーム範囲を必要になったときに読む．
+    全体の読み込み（load_all）が終わるかバイナリキャッシュがあれば，範囲はその配列から切り出す
+    """
+
+    def __init__(self, csv_file, red_offset=RED_OFFSET, white_offset=WHITE_OFFSET,
+                 cache_root="../data/cache/observations"):
+        self.csv_file = csv_file
+        self.red_offset = red_offset
+        self.white_offset = white_offset
+        self.cache_dir = cache_dir_for(csv_file, red_offset, white_offset, cache_root)
+        self.full = load_cache(self.cache_dir)
+        # インデックスの走査は別スレッドで行う（ビューアのメインスレッドを止めない）
+        self.index = None if self.full is not None else FrameIndex(csv_file, background=True)
+        # 範囲ごとの読み込みと全体の読み込みで，数値でないIDに同じ番号を振る
+        self.id_table = IdTable(self.full.id_names if self.full is not None else None)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.full is not None
+
+    @property
+    def ready(self):
+        """frame_bounds と frame_range が待たずに返せるか（ビューアはこれが True になってから表示する）"""
+        if self.full is not None:
+            return True
+        return self.index.ready and self.index.is_sorted
+
+    @property
+    def frame_bounds(self):
+        """(最初のフレーム番号, 最後のフレーム番号)．データがなければ (None, None)．インデックスの走査が終わるまで待つ"""
+        if self.full is not None:
+            if len(self.full) == 0:
+                return None, None
+            return int(self.full.frame_num[0]), int(self.full.frame_num[-1])
+        return self.index.min_frame, self.index.max_frame
+
+    def frame_range(self, start_frame, end_frame):
+        """
+        start_frame から end_frame（含む）までの Observations．インデックスの走査が終わるまで待ち，
+        CSVのフレーム番号が昇順に並んでいなければ，全体の読み込みが終わるのを待ってから切り出す
+        """
+        full = self.full
+        if full is None and not self.index.is_sorted:
+            full = self.load_all()
+        if full is not None:
+            lo = np.searchsorted(full.frame_num, start_frame, side="left")
+            hi = np.searchsorted(full.frame_num, end_frame, side="right")
+            return full.take(slice(lo, hi))
+        with self._lock:
+            return self.index.read_range(start_frame, end_frame, self.red_offset, self.white_offset, self.id_table)
+
+    def load_all(self):
+        """CSV全体を読み込み，バイナリキャッシュを書き出す．別スレッドから呼ぶ"""
+        # 別スレッドの読み込みと frame_range から同時に呼ばれても，読み込むのは1回だけ
+        with self._load_lock:
+            if self.full is not None:
+                return self.full
+            observations = Observations.from_csv(self.csv_file, self.red_offset, self.white_offset, self.id_table)
+            try:
+                save_cache(observations, self.cache_dir)
+            except OSError as e:
+                print(f"キャッシュを保存できませんでした: {e}")
+            self.full = observations
+            return observations
+
+    def load_all_in_background(self, on_done=None):
+        """load_all を別スレッドで行う．on_done はそのスレッドで呼ばれるので，Tk の操作は after で行うこと"""
+        def run():
+            self.load_all()
+            if on_done is not None:
+                on_done()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == "__main__":
+    import time
+
+    csv_file = "../data/transform/transformed_player_points.csv"
+
+    start_time = time.time()
+    pages = PagedObservations(csv_file)
+    min_frame, max_frame = pages.frame_bounds
+    first = pages.frame_range(min_frame, min_frame + 100)
+    print(f"最初の100フレーム（{len(first)} 行）: {time.time() - start_time:.3f} 秒")
+
+    start_time = time.time()
+    pages.load_all()
+    print(f"全体（{len(pages.full)} 行）: {time.time() - start_time:.2f} 秒")
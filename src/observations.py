@@ -0,0 +1,294 @@
+"""
+選手の位置情報（検出結果）をコンパクトな列ごとの配列で扱うモジュールです．
+チームと方向は小さな整数コード，選手IDは int32，座標は float32 の連続した配列で持ち，
+"red" や "right" などの文字列はCSVの読み書きなど入出力のときだけ使います．
+並びは (frame_num, direction) の昇順（同じフレーム内はCSVの順）で，
+分類器の attack_formations（(frame_num, direction) -> [(x, y, team_color, player_id), ...]）とも相互に変換できます．
+
+ゾーンやテンプレートとの比較には，left のフレームのx座標を反転して全て right（ゴールが x=1）の向きに
+そろえた正準座標（canonical）を使います．x 以外の列は元の配列をそのまま共有し，
+元の座標に戻すのは出力と描画のときだけです．
+"""
+
+import csv
+import hashlib
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+# 文字列の昇順と同じ並びになるようにコードを振る
+DIRECTION_NAMES = ("left", "right")
+TEAM_NAMES = ("red", "white")
+LEFT, RIGHT = 0, 1
+RED, WHITE = 0, 1
+UNKNOWN = -1
+
+# チームごとのオフセット（FormationClassifier.load_csv と同じ値）
+RED_OFFSET = (0.1, -0.1)
+WHITE_OFFSET = (0.06, 0.0)
+# CSVから読む列
+CSV_COLUMNS = ("frame_num", "id", "team_color", "x", "y", "direction")
+# 正準座標の向き．ゾーンとテンプレートはこの向きのものだけを使う
+CANONICAL_SIDE = "right"
+
+
+def _encode_categorical(series, names):
+    """pandas の category 型の列を names の中の番号にする．カテゴリごとに1回だけ比べる"""
+    lookup = np.append(encode(series.cat.categories.astype(str), names), np.int8(UNKNOWN))
+    # 欠損のコードは -1 なので lookup の最後（UNKNOWN）を指す
+    return lookup[series.cat.codes.to_numpy()]
+
+
+def encode(values, names):
+    """文字列の配列を names の中の番号にする．names にないものは UNKNOWN"""
+    values = np.asarray(values, dtype=str)
+    codes = np.full(len(values), UNKNOWN, dtype=np.int8)
+    for code, name in enumerate(names):
+        codes[values == name] = code
+    return codes
+
+
+def decode(code, names):
+    return names[code] if 0 <= code < len(names) else "unknown"
+
+
+def mirror_x(x, direction):
+    """
+    direction が left の行のx座標を反転する（正準座標にする）．
+    反転は2回かけると（float32 の丸めの範囲で）元に戻るので，正準座標から元の座標に戻すのにも使う
+    """
+    x = np.asarray(x, dtype=np.float32)
+    return np.where(np.asarray(direction) == LEFT, np.float32(1.0) - x, x)
+
+
+class IdTable:
+    """
+    CSVをページやブロックに分けて読むときに，数値でないIDに全体で同じ番号を振るための表．
+    names は読んだ全ての Observations の id_names として共有する（後から名前が増えても番号は変わらない）
+    """
+
+    def __init__(self, names=None):
+        self.names = list(names or [])
+        self.codes = {name: code for code, name in enumerate(self.names)}
+        # ビューアでは表示用の読み込みと全体の読み込みが別スレッドで同時に番号を振る
+        self._lock = threading.Lock()
+
+    def encode(self, values):
+        unique, inverse = np.unique(values, return_inverse=True)
+        mapped = np.empty(len(unique), dtype=np.int32)
+        with self._lock:
+            for k, name in enumerate(unique.tolist()):
+                code = self.codes.get(name)
+                if code is None:
+                    code = self.codes[name] = len(self.names)
+                    self.names.append(name)
+                mapped[k] = code
+        return mapped[inverse]
+
+
+def encode_ids(values, id_table=None):
+    """
+    選手IDを int32 にする．数値でないIDが混ざっていれば文字列ごとに番号を振り，元の文字列の表を返す．
+    id_table（IdTable）を渡せば，その表で番号を振る
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        return values.astype(np.int32), None
+    values = values.astype(str)
+    try:
+        return values.astype(np.int64).astype(np.int32), None
+    except ValueError:
+        if id_table is not None:
+            return id_table.encode(values), id_table.names
+        id_names, codes = np.unique(values, return_inverse=True)
+        return codes.astype(np.int32), id_names.tolist()
+
+
+class Observations:
+    FIELDS = ("frame_num", "player_id", "team", "direction", "x", "y", "imputed")
+
+    def __init__(self, frame_num, player_id, team, direction, x, y, imputed=None, id_names=None):
+        self.frame_num = np.asarray(frame_num, dtype=np.int32)
+        self.player_id = np.asarray(player_id, dtype=np.int32)
+        self.team = np.asarray(team, dtype=np.int8)
+        self.direction = np.asarray(direction, dtype=np.int8)
+        self.x = np.asarray(x, dtype=np.float32)
+        self.y = np.asarray(y, dtype=np.float32)
+        self.imputed = np.zeros(len(self.frame_num), dtype=bool) if imputed is None else np.asarray(imputed, dtype=bool)
+        # 数値でないIDのときの元の文字列
+        self.id_names = id_names
+        self._canonical_x = None
+
+    def __len__(self):
+        return len(self.frame_num)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.FIELDS)
+
+    ##################入出力##################
+
+    @classmethod
+    def from_csv(cls, csv_file, red_offset=RED_OFFSET, white_offset=WHITE_OFFSET, id_table=None):
+        """
+        CSV（frame_num, id, team_color, x, y, direction）を読み込み，チームごとのオフセットを適用する．
+        pandas があれば列の型を指定してまとめて読み込み，なければ csv モジュールで読む
+        """
+        try:
+            import pandas as pd
+        except ImportError:
+            pd = None
+        if pd is None:
+            with open(csv_file, 'r') as file:
+                reader = csv.reader(file)
+                header = next(reader)
+                return cls.from_rows(header, reader, red_offset, white_offset, id_table)
+
+        # 座標は float() と同じ値になるように round_trip で読む（pandas がないときと結果を同じにする）
+        df = pd.read_csv(
+            csv_file,
+            usecols=CSV_COLUMNS,
+            dtype={"frame_num": np.int64, "team_color": "category", "direction": "category",
+                   "x": np.float64, "y": np.float64},
+            keep_default_na=False,
+            float_precision="round_trip",
+        )
+        ids = df["id"].to_numpy()
+        return cls._from_columns(
+            df["frame_num"].to_numpy(),
+            ids if ids.dtype.kind in "iu" else ids.astype(str),
+            _encode_categorical(df["team_color"], TEAM_NAMES),
+            _encode_categorical(df["direction"], DIRECTION_NAMES),
+            df["x"].to_numpy(dtype=np.float64, copy=True),
+            df["y"].to_numpy(dtype=np.float64, copy=True),
+            red_offset,
+            white_offset,
+            id_table,
+        )
+
+    @classmethod
+    def from_rows(cls, header, rows, red_offset=RED_OFFSET, white_offset=WHITE_OFFSET, id_table=None):
+        """
+        CSVのヘッダーと行（文字列のリスト）から作る．CSVの一部だけを読むときにも使う．
+        一部ずつ読むときは，同じ id_table（IdTable）を渡して数値でないIDの番号をそろえる
+        """
+        idx = {name: i for i, name in enumerate(header)}
+        rows = rows if isinstance(rows, list) else list(rows)
+        if not rows:
+            return cls([], [], [], [], [], [])
+        # 行を列にするときは zip(*rows) より列ごとの内包表記のほうがずっと速い
+        columns = {name: [row[idx[name]] for row in rows] for name in CSV_COLUMNS}
+        return cls._from_columns(
+            np.asarray(columns['frame_num'], dtype=np.int64),
+            columns['id'],
+            encode(columns['team_color'], TEAM_NAMES),
+            encode(columns['direction'], DIRECTION_NAMES),
+            np.asarray(columns['x'], dtype=np.float64),
+            np.asarray(columns['y'], dtype=np.float64),
+            red_offset,
+            white_offset,
+            id_table,
+        )
+
+    @classmethod
+    def _from_columns(cls, frame_num, ids, team, direction, x, y, red_offset, white_offset, id_table):
+        """読み込んだ列（チームと方向はコード，座標は float64）から作る．オフセットは float32 にする前に足す"""
+        player_id, id_names = encode_ids(ids, id_table)
+        for code, (x_offset, y_offset) in ((RED, red_offset), (WHITE, white_offset)):
+            x[team == code] += x_offset
+            y[team == code] += y_offset
+        return cls(frame_num, player_id, team, direction, x, y, id_names=id_names).sorted()
+
+    @classmethod
+    def from_attack_formations(cls, attack_formations, id_table=None):
+        rows = [
+            (frame_num, player_id, team_color, x, y, direction)
+            for (frame_num, direction), positions in attack_formations.items()
+            for x, y, team_color, player_id in positions
+        ]
+        if not rows:
+            return cls([], [], [], [], [], [])
+        frame_num, ids, teams, xs, ys, directions = zip(*rows)
+        player_id, id_names = encode_ids(ids, id_table)
+        return cls(frame_num, player_id, encode(teams, TEAM_NAMES), encode(directions, DIRECTION_NAMES),
+                   xs, ys, id_names=id_names).sorted()
+
+    def to_attack_formations(self):
+        """attack_formations の形に戻す．文字列に戻すのはここだけ"""
+        frames = defaultdict(list)
+        for frame_num, player_id, team, direction, x, y in zip(
+            self.frame_num.tolist(), self.player_id.tolist(), self.team.tolist(),
+            self.direction.tolist(), self.x.tolist(), self.y.tolist(),
+        ):
+            frames[(frame_num, decode(direction, DIRECTION_NAMES))].append(
+                (x, y, decode(team, TEAM_NAMES), self.id_name(player_id))
+            )
+        return frames
+
+    def id_name(self, player_id):
+        return self.id_names[player_id] if self.id_names is not None else str(player_id)
+
+    ##################配列の操作##################
+
+    def take(self, index):
+        """全ての列に同じインデックス（またはマスク）を適用する"""
+        return Observations(*(getattr(self, name)[index] for name in self.FIELDS), id_names=self.id_names)
+
+    def __getitem__(self, index):
+        return self.take(index)
+
+    @staticmethod
+    def concat(*parts):
+        return Observations(
+            *(np.concatenate([getattr(part, name) for part in parts]) for name in Observations.FIELDS),
+            id_names=parts[0].id_names,
+        )
+
+    def sorted(self):
+        """(frame_num, direction) の昇順に並べ替える（同じフレーム内の順は保つ）"""
+        order = np.lexsort((self.direction, self.frame_num))
+        return self.take(order)
+
+    def frame_groups(self):
+        """同じ (frame_num, direction) が続く区間の (フレーム番号, 方向コード, 開始位置) の配列"""
+        if len(self) == 0:
+            empty = np.zeros(0, dtype=np.intp)
+            return empty, empty, empty
+        change = (self.frame_num[1:] != self.frame_num[:-1]) | (self.direction[1:] != self.direction[:-1])
+        starts = np.concatenate(([0], np.flatnonzero(change) + 1))
+        return self.frame_num[starts], self.direction[starts], starts
+
+    @property
+    def canonical_x(self):
+        """正準座標のx座標（オフセット適用後の座標を反転したもの）．初めて使うときに1度だけ計算する"""
+        if self._canonical_x is None:
+            self._canonical_x = mirror_x(self.x, self.direction)
+        return self._canonical_x
+
+    def canonical(self):
+        """x を正準座標にした Observations．x 以外の列は元の配列を共有する"""
+        return Observations(
+            self.frame_num, self.player_id, self.team, self.direction, self.canonical_x, self.y,
+            self.imputed, id_names=self.id_names,
+        )
+
+    def defender_mask(self):
+        """direction が right なら red，それ以外なら white の選手を防御選手とする"""
+        return self.team == np.where(self.direction == RIGHT, RED, WHITE)
+
+    def split_direction_chunks(self):
+        """direction が続く区間ごとに分ける"""
+        if len(self) == 0:
+            return []
+        change = np.flatnonzero(self.direction[1:] != self.direction[:-1]) + 1
+        bounds = np.concatenate(([0], change, [len(self)]))
+        return [self.take(slice(s, e)) for s, e in zip(bounds[:-1], bounds[1:])]
+
+    def content_hash(self):
+        digest = hashlib.sha1()
+        for name in self.FIELDS:
+            digest.update(np.ascontiguousarray(getattr(self, name)).tobytes())
+        if self.id_names is not None:
+            digest.update("\n".join(self.id_names).encode())
+        return digest.hexdigest()
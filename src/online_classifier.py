@@ -0,0 +1,312 @@
+"""
+フォーメーションの推定と防御フェーズの検出を1フレームずつ行うモジュールです．
+FormationClassifier（formation_classification_9mline_latest.py）と同じ規則で，
+フレームが届くたびに推定し，終了が確定した防御フェーズから順に返します．
+9mラインの外側から戻った選手の再侵入の確認（20フレーム先まで）の分だけフレームを保留します．
+CSVはフレーム番号の昇順に並んでいることを前提とします．
+
+1フレーム分の選手は Observations（チームと方向は整数コード，座標は float32 の配列）で受け取るので，
+フレームごとに文字列を比べたりタプルを作ったりしません．
+"""
+
+import csv
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+from court_zones import ZONE_BITS, get_zone_grid
+from formation_classification_9mline_latest import formation_from_outer_count
+from formation_rle import FormationRLE
+from observations import (
+    CANONICAL_SIDE, DIRECTION_NAMES, RED, RED_OFFSET, RIGHT, UNKNOWN, WHITE, WHITE_OFFSET,
+    IdTable, Observations, decode, mirror_x,
+)
+
+
+def iter_tracking_frames(csv_file, red_offset=RED_OFFSET, white_offset=WHITE_OFFSET, block_rows=50000):
+    """
+    CSVを先頭から block_rows 行ずつ読み，((frame_num, direction), そのフレームの Observations) を順に返す．
+    記録全体をメモリに載せないので，長い記録でも使うメモリは block_rows 行分で決まる
+    """
+    id_table = IdTable()
+    with open(csv_file, 'r') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        carry = None
+        while True:
+            rows = list(islice(reader, block_rows))
+            block = Observations.from_rows(header, rows, red_offset, white_offset, id_table) if rows else None
+            if carry is not None:
+                block = carry if block is None else Observations.concat(carry, block).sorted()
+            if block is None or len(block) == 0:
+                break
+            # 最後のフレームは次のブロックに続きがあるかもしれないので持ち越す
+            n_complete = len(block) if not rows else int(np.searchsorted(block.frame_num, block.frame_num[-1]))
+            frames, directions, starts = block.frame_groups()
+            bounds = np.append(starts, len(block)).tolist()
+            for k, (frame_num, direction) in enumerate(zip(frames.tolist(), directions.tolist())):
+                if bounds[k] >= n_complete:
+                    break
+                yield (frame_num, decode(direction, DIRECTION_NAMES)), block.take(slice(bounds[k], bounds[k + 1]))
+            carry = block.take(slice(n_complete, len(block))) if rows else None
+            if not rows:
+                break
+
+
+def frame_from_positions(key, positions, id_table=None):
+    """
+    [(x, y, team_color, player_id), ...]（オフセット適用後）を1フレーム分の Observations にする．
+    映像から直接流すときなど，CSVを通さないフレームに使う
+    """
+    frame_num, direction = key
+    attack_formations = {(frame_num, direction): positions} if positions else {}
+    return Observations.from_attack_formations(attack_formations, id_table)
+
+
+def frame_defenders(key, frame):
+    """防御選手の (pid, 9mラインの外側か, 内側に戻ったか) のリスト"""
+    direction = DIRECTION_NAMES.index(key[1]) if key[1] in DIRECTION_NAMES else UNKNOWN
+    defender = frame.team == (RED if direction == RIGHT else WHITE)
+    pids = frame.player_id[defender].tolist()
+    if not pids or direction == UNKNOWN:
+        return [(pid, False, False) for pid in pids]
+    xs = mirror_x(frame.x[defender], direction)
+    ys = frame.y[defender]
+    # 2つのゾーンは同じビットマスクから判定する
+    codes = get_zone_grid(CANONICAL_SIDE).lookup(xs, ys)
+    outer = ((codes & (1 << ZONE_BITS["outer_box"])) != 0).tolist()
+    returned = ((codes & (1 << ZONE_BITS["returned"])) != 0).tolist()
+    return list(zip(pids, outer, returned))
+
+
+def classify_frame(item):
+    """
+    (key, frame) から1フレーム分の推定を行い，(key, 防御選手のリスト, フォーメーション) を返す．
+    防御選手が6人未満ならフォーメーションは None
+    """
+    key, frame = item
+    defenders = frame_defenders(key, frame)
+    formation = None
+    if len(defenders) >= 6:
+        formation = formation_from_outer_count(sum(outer for _, outer, _ in defenders))
+    return key, defenders, formation
+
+
+def classify_windowed(csv_file, min_phase_length=50, check_window=20):
+    """
+    CSVを先頭から読みながら，確定した防御フェーズの辞書を順に返す．
+    記録全体をメモリに載せないので，複数試合をつないだ記録や1日分の記録にも使える
+    """
+    classifier = OnlineFormationClassifier(min_phase_length, check_window, windowed=True)
+    for key, frame in iter_tracking_frames(csv_file):
+        yield from classifier.push_frame(key, frame)
+    yield from classifier.flush()
+
+
+class OnlinePhaseDetector:
+    """FormationClassifier.detect_raw_defense_phases を1フレームずつ行う"""
+
+    def __init__(self, check_window=20):
+        self.check_window = check_window
+        self.buffer = deque()
+        self.current_direction = None
+        self.state = "seek"
+        self.start_frame = None
+        self.end_frame = None
+        self.outer_defenders = set()
+
+    @property
+    def open_phase(self):
+        """進行中のフェーズの (開始フレーム, 現在の終了フレーム, 方向)．なければ None"""
+        if self.state != "phase":
+            return None
+        return self.start_frame, self.end_frame, self.current_direction
+
+    def push(self, key, defenders):
+        """1フレーム分の防御選手を追加し，終了が確定した (開始, 終了, 方向, 終了理由) のリストを返す"""
+        self.buffer.append((key, defenders))
+        return self._process(final=False)
+
+    def flush(self):
+        phases = self._process(final=True)
+        if self.state == "phase":
+            phases.append((self.start_frame, self.end_frame, self.current_direction, None))
+        self.state = "seek"
+        self.current_direction = None
+        return phases
+
+    def _process(self, final):
+        phases = []
+        while self.buffer:
+            (frame_num, direction), defenders = self.buffer[0]
+            # 方向が変わった瞬間を探す
+            if direction != self.current_direction:
+                if self.state == "phase":
+                    phases.append((self.start_frame, self.end_frame, self.current_direction, 'direction_change'))
+                self.current_direction = direction
+                self.state = "seek"
+
+            if self.state == "seek":
+                if len(defenders) >= 6:
+                    self.state = "phase"
+                    self.start_frame = self.end_frame = frame_num
+                    self.outer_defenders = {pid for pid, outer, _ in defenders if outer}
+            elif self.state == "phase":
+                returned_pids = {pid for pid, _, returned in defenders if returned and pid in self.outer_defenders}
+                if returned_pids:
+                    reentered = self._reentered(returned_pids, final)
+                    if reentered is None:
+                        break  # 先のフレームが揃うまで待つ
+                    if not reentered:
+                        phases.append((self.start_frame, self.end_frame, direction, 'outer_return'))
+                        self.state = "skip"
+                        self.buffer.popleft()
+                        continue
+                self.end_frame = frame_num
+            self.buffer.popleft()
+        return phases
+
+    def _reentered(self, returned_pids, final):
+        """戻った選手が check_window フレーム以内に外側へ出たら True．まだ判断できなければ None"""
+        for n, ((_, direction), defenders) in enumerate(self.buffer):
+            if n == 0:
+                continue
+            if n > self.check_window or direction != self.current_direction:
+                return False
+            if any(outer and pid in returned_pids for pid, outer, _ in defenders):
+                return True
+        return False if final else None
+
+
+class OnlinePhaseMerger:
+    """
+    FormationClassifier._merge_short_phases を1フェーズずつ行う．
+    短いフェーズは次のフェーズを見るまで，結合後のフェーズは後ろから結合される可能性がなくなるまで保留する．
+    結合後のフェーズは (開始, 終了, 方向, 終了理由) で返す
+    """
+
+    def __init__(self, min_length=50):
+        self.min_length = min_length
+        self.held = None
+        self.last = None
+
+    def push(self, phase):
+        emitted = []
+        if self.held is not None:
+            held, self.held = self.held, None
+            if phase[2] == held[2]:
+                # 次のフェーズと結合
+                self._append((held[0], phase[1], held[2], phase[3]), emitted)
+                return emitted
+            self._resolve_without_next(held, emitted)
+
+        start_frame, end_frame, direction, reason = phase
+        if end_frame - start_frame < self.min_length and reason == 'direction_change':
+            self.held = phase
+        else:
+            self._append(phase, emitted)
+        return emitted
+
+    def flush(self):
+        emitted = []
+        if self.held is not None:
+            held, self.held = self.held, None
+            self._resolve_without_next(held, emitted)
+        if self.last is not None:
+            emitted.append(self.last)
+            self.last = None
+        return emitted
+
+    def _resolve_without_next(self, held, emitted):
+        # 前のフェーズとdirectionが同じなら結合
+        if self.last is not None and self.last[2] == held[2]:
+            self.last = (self.last[0], held[1], held[2], held[3])
+        else:
+            self._append(held, emitted)
+
+    def _append(self, phase, emitted):
+        if self.last is not None:
+            emitted.append(self.last)
+        self.last = phase
+
+
+class OnlineFormationClassifier:
+    """
+    1フレームずつ推定し，確定した防御フェーズごとに代表フォーメーションと内訳を返す．
+    返す値は start_frame, end_frame, direction, end_reason, formation, counts, confidence を持つ辞書．
+    windowed=True なら，フェーズを返した後にもう集計に使わないフレームの推定結果を捨てる．
+    このとき持っておくのは進行中（と結合待ち）のフェーズと再侵入の確認の分のフレームだけで，
+    使うメモリは記録全体の長さではなく最も長いフェーズで決まる
+    """
+
+    def __init__(self, min_phase_length=50, check_window=20, windowed=False):
+        self.detector = OnlinePhaseDetector(check_window)
+        self.merger = OnlinePhaseMerger(min_phase_length)
+        self.formations = FormationRLE()
+        self.last_frame = None
+        self.windowed = windowed
+
+    def push_frame(self, key, frame):
+        """frame は1フレーム分の Observations（位置のタプルのリストは frame_from_positions で変換してから渡す）"""
+        return self.push_classified(*classify_frame((key, frame)))
+
+    def push_classified(self, key, defenders, formation):
+        self.last_frame = (key, formation)
+        if formation is not None:
+            self.formations.append(key[0], key[1], formation, 1.0)
+        merged = []
+        for phase in self.detector.push(key, defenders):
+            merged.extend(self.merger.push(phase))
+        records = self._summarize(merged)
+        if self.windowed:
+            self.formations.discard_before(self.keep_from())
+        return records
+
+    def keep_from(self):
+        """これから返すフェーズに含まれうる最初のフレーム番号"""
+        candidates = []
+        if self.merger.last is not None:
+            candidates.append(self.merger.last[0])
+        if self.merger.held is not None:
+            candidates.append(self.merger.held[0])
+        if self.detector.state == "phase":
+            candidates.append(self.detector.start_frame)
+        if self.detector.buffer:
+            candidates.append(self.detector.buffer[0][0][0])
+        if not candidates and self.last_frame is not None:
+            candidates.append(self.last_frame[0][0] + 1)
+        return min(candidates) if candidates else 0
+
+    def flush(self):
+        merged = []
+        for phase in self.detector.flush():
+            merged.extend(self.merger.push(phase))
+        merged.extend(self.merger.flush())
+        return self._summarize(merged)
+
+    def current_phase(self):
+        """進行中（結合前）のフェーズのここまでの集計．なければ None"""
+        open_phase = self.detector.open_phase
+        if open_phase is None:
+            return None
+        records = self._summarize([(*open_phase, None)])
+        return records[0] if records else None
+
+    def _summarize(self, phases):
+        records = []
+        for start_frame, end_frame, direction, reason in phases:
+            counts, conf_sums = self.formations.query(start_frame, end_frame, direction)
+            if not counts:
+                continue
+            formation = counts.most_common(1)[0][0]
+            records.append({
+                "start_frame": start_frame,
+                "end_frame": end_frame,
+                "direction": direction,
+                "end_reason": reason,
+                "formation": formation,
+                "counts": dict(counts),
+                "confidence": round(conf_sums[formation] / counts[formation], 2),
+            })
+        return records
@@ -0,0 +1,214 @@
+"""
+推定したフォーメーションと防御フェーズを試合映像に重ねて，新しい映像として書き出すモジュールです．
+コーチに見せる資料を，ビューアのスクリーンショットではなく映像のまま作れます．
+
+重ねるもの
+    ・フォーメーション名（フェーズの代表フォーメーション）と方向
+    ・フェーズの経過時間と長さ，経過を示すバー
+    ・コート画像（img/right_court.png, left_court.png）のミニマップ上の防御選手の位置
+
+映像は VideoFrameReader で先頭から1回だけ読み，書き出しも1回で済ませます．
+フレームは確保済みの配列に写してからスレッドプールで描画し（cv2 の描画と書き出しは GIL を放すので並列になる），
+読んだ順に書き出します．
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from observations import DIRECTION_NAMES, decode
+from template_library import load_labeled_phases
+from video_frames import VideoFrameReader
+
+COURT_IMAGES = {"right": "../img/right_court.png", "left": "../img/left_court.png"}
+# 色は BGR
+DEFENDER_COLOR = (0, 0, 255)
+TEXT_COLOR = (255, 255, 255)
+PANEL_COLOR = (0, 0, 0)
+BAR_COLOR = (0, 200, 255)
+
+
+class MatchOverlay:
+    """フレーム番号から，そのフレームに重ねる防御フェーズと防御選手の位置を引く"""
+
+    def __init__(self, observations, phases):
+        """phases: (開始フレーム, 終了フレーム, フォーメーション, 方向) のリスト"""
+        phases = sorted(phases)
+        self.phase_start = np.array([phase[0] for phase in phases], dtype=np.int64)
+        self.phase_end = np.array([phase[1] for phase in phases], dtype=np.int64)
+        self.formations = [phase[2] for phase in phases]
+        self.directions = [phase[3] for phase in phases]
+        # 描画は元の向きの座標のまま，方向ごとのコート画像に重ねる
+        defenders = observations.take(observations.defender_mask())
+        self.frame_num = defenders.frame_num
+        self.direction = defenders.direction
+        self.x = defenders.x
+        self.y = defenders.y
+
+    def phase_at(self, frame_num):
+        """frame_num を含むフェーズの番号．どのフェーズにも入らなければ -1"""
+        k = int(np.searchsorted(self.phase_start, frame_num, side="right")) - 1
+        if k >= 0 and frame_num <= self.phase_end[k]:
+            return k
+        return -1
+
+    def defenders_at(self, frame_num):
+        """(x の配列, y の配列, 方向名) を返す．そのフレームに防御選手がいなければ方向名は None"""
+        lo = np.searchsorted(self.frame_num, frame_num, side="left")
+        hi = np.searchsorted(self.frame_num, frame_num, side="right")
+        if lo == hi:
+            return self.x[lo:hi], self.y[lo:hi], None
+        return self.x[lo:hi], self.y[lo:hi], decode(int(self.direction[lo]), DIRECTION_NAMES)
+
+
+class OverlayRenderer:
+    """1フレームに重ねる描画．コート画像の縮小などは最初に1度だけ行う"""
+
+    def __init__(self, width, height, fps, minimap_width=None, court_images=COURT_IMAGES):
+        import cv2
+
+        self.cv2 = cv2
+        self.fps = fps
+        self.margin = max(8, height // 60)
+        self.font_scale = height / 720
+        self.thickness = max(1, int(round(2 * self.font_scale)))
+        minimap_width = minimap_width or width // 4
+        self.minimaps = {}
+        for side, path in court_images.items():
+            image = cv2.imread(path)
+            if image is None:
+                raise OSError(f"コート画像を読み込めませんでした: {path}")
+            minimap_height = int(round(image.shape[0] * minimap_width / image.shape[1]))
+            self.minimaps[side] = cv2.resize(image, (minimap_width, minimap_height), interpolation=cv2.INTER_AREA)
+        self.minimap_width = minimap_width
+        self.minimap_height = max(image.shape[0] for image in self.minimaps.values())
+        # ミニマップは右下に置く
+        self.minimap_x = width - minimap_width - self.margin
+        self.minimap_y = height - self.minimap_height - self.margin
+        self.radius = max(3, minimap_width // 60)
+
+    def render(self, frame, frame_num, overlay):
+        """frame に直接描画して返す"""
+        cv2 = self.cv2
+        phase = overlay.phase_at(frame_num)
+        xs, ys, direction = overlay.defenders_at(frame_num)
+        if phase >= 0:
+            direction = overlay.directions[phase]
+
+        # ミニマップと防御選手
+        minimap = self.minimaps.get(direction)
+        if minimap is not None:
+            h, w = minimap.shape[:2]
+            frame[self.minimap_y:self.minimap_y + h, self.minimap_x:self.minimap_x + w] = minimap
+            px = (self.minimap_x + np.clip(xs, 0.0, 1.0) * (w - 1)).astype(np.int32)
+            py = (self.minimap_y + np.clip(ys, 0.0, 1.0) * (h - 1)).astype(np.int32)
+            for x, y in zip(px.tolist(), py.tolist()):
+                cv2.circle(frame, (x, y), self.radius, DEFENDER_COLOR, -1, cv2.LINE_AA)
+
+        # フォーメーション名とフェーズの経過時間
+        line_height = int(36 * self.font_scale)
+        panel_width = int(360 * self.font_scale)
+        cv2.rectangle(
+            frame, (self.margin, self.margin),
+            (self.margin + panel_width, self.margin + 3 * line_height), PANEL_COLOR, -1,
+        )
+        if phase >= 0:
+            start_frame = overlay.phase_start[phase]
+            end_frame = overlay.phase_end[phase]
+            elapsed = (frame_num - start_frame) / self.fps
+            length = (end_frame - start_frame + 1) / self.fps
+            lines = (
+                f"Formation: {overlay.formations[phase]} ({direction})",
+                f"Phase {phase + 1}: {elapsed:5.1f}s / {length:.1f}s",
+            )
+            progress = (frame_num - start_frame + 1) / (end_frame - start_frame + 1)
+            bar_top = self.margin + int(2.4 * line_height)
+            cv2.rectangle(
+                frame, (self.margin + 8, bar_top),
+                (self.margin + 8 + int((panel_width - 16) * progress), bar_top + line_height // 3), BAR_COLOR, -1,
+            )
+        else:
+            lines = ("Formation: -", "No defense phase")
+        for k, text in enumerate(lines):
+            cv2.putText(
+                frame, text, (self.margin + 8, self.margin + (k + 1) * line_height - line_height // 4),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8 * self.font_scale, TEXT_COLOR, self.thickness, cv2.LINE_AA,
+            )
+        return frame
+
+
+def export_overlay_video(video_path, observations, phases, output_file, workers=None,
+                         start_frame=0, end_frame=None, fourcc="mp4v", frame_offset=0):
+    """
+    映像に重ねた結果を output_file に書き出し，処理の速さのまとめを返す．
+    frame_offset は追跡データのフレーム番号と映像のフレーム番号の差（映像 = 追跡データ + frame_offset）
+    """
+    import cv2
+
+    reader = VideoFrameReader(video_path)
+    overlay = MatchOverlay(observations, phases)
+    renderer = OverlayRenderer(reader.width, reader.height, reader.fps)
+    workers = workers or os.cpu_count() or 1
+
+    # 描画中と書き出し待ちのフレーム用の配列．ワーカー数の2倍あれば描画が止まらない
+    n_buffers = workers * 2
+    buffers = np.empty((n_buffers, reader.height, reader.width, 3), dtype=np.uint8)
+    free = deque(range(n_buffers))
+    pending = deque()
+
+    writer = cv2.VideoWriter(output_file, cv2.VideoWriter_fourcc(*fourcc), reader.fps, (reader.width, reader.height))
+    if not writer.isOpened():
+        raise OSError(f"書き出し先を開けませんでした: {output_file}")
+
+    def write_oldest():
+        slot, future = pending.popleft()
+        future.result()
+        writer.write(buffers[slot])
+        free.append(slot)
+
+    start_time = time.perf_counter()
+    n_frames = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for frame_num, frame in reader.read_range(start_frame, end_frame):
+                if not free:
+                    write_oldest()
+                slot = free.popleft()
+                # 読み込み側の配列はすぐに使い回されるので，描画用の配列に写してから渡す
+                np.copyto(buffers[slot], frame)
+                pending.append((slot, executor.submit(renderer.render, buffers[slot], frame_num - frame_offset, overlay)))
+                n_frames += 1
+            while pending:
+                write_oldest()
+    finally:
+        writer.release()
+
+    elapsed = time.perf_counter() - start_time
+    output_fps = n_frames / elapsed if elapsed > 0 else 0.0
+    return {
+        "frames": n_frames,
+        "seconds": elapsed,
+        "fps": output_fps,
+        "realtime_ratio": output_fps / reader.fps if reader.fps else 0.0,
+        "decode_fps": reader.decode_fps,
+    }
+
+
+if __name__ == "__main__":
+    from observations import Observations
+
+    video_path = "../data/video/match.mp4"
+    csv_file = "../data/transform/transformed_player_points.csv"
+    phase_file = "../data/output/formations_output_latest.csv"
+    output_file = "../data/output/match_overlay.mp4"
+
+    observations = Observations.from_csv(csv_file)
+    phases = load_labeled_phases(phase_file)
+    summary = export_overlay_video(video_path, observations, phases, output_file)
+    print(
+        f"{summary['frames']} フレームを {summary['seconds']:.1f} 秒で書き出しました"
+        f"（{summary['fps']:.1f} fps，実時間の {summary['realtime_ratio']:.1f} 倍）。"
+    )
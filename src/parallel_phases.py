@@ -0,0 +1,62 @@
+"""
+フォーメーションの推定と防御フェーズの検出を，direction の区間ごとに並列で行うモジュールです．
+detect_defense_phases は direction が切り替わるたびに状態をリセットするので，
+direction の区間どうしは独立に計算できます．各区間をプロセスプールで処理し，
+結果をフレーム順につないでから短いフェーズの結合（_merge_short_phases）を行います．
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from formation_classification_9mline_latest import FormationClassifier
+
+
+def _process_chunk(args):
+    chunk, params = args
+    classifier = FormationClassifier(None, observations=chunk, **params)
+    return list(classifier._iter_frame_formations()), classifier.detect_raw_defense_phases()
+
+
+def classify_in_parallel(observations, min_phase_length=50, workers=None, zone_mode="box", max_gap=0):
+    """
+    フレームごとの推定結果（フレーム順）と，結合済みの防御フェーズを返す。
+    結果は FormationClassifier で1度に処理した場合と同じになる
+    """
+    params = {"zone_mode": zone_mode, "max_gap": max_gap}
+    chunks = observations.split_direction_chunks()
+    workers = workers or os.cpu_count() or 1
+
+    tasks = [(chunk, params) for chunk in chunks]
+    if workers == 1 or len(chunks) <= 1:
+        results = list(map(_process_chunk, tasks))
+    else:
+        # 区間の数がワーカー数よりずっと多いので，いくつかずつまとめて渡す
+        chunksize = max(1, len(chunks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_process_chunk, tasks, chunksize=chunksize))
+
+    classified_formations = []
+    raw_phases = []
+    for classified, phases in results:
+        classified_formations.extend(classified)
+        raw_phases.extend(phases)
+
+    return classified_formations, FormationClassifier._merge_short_phases(raw_phases, min_phase_length)
+
+
+if __name__ == "__main__":
+    import time
+
+    csv_file = "../data/transform/transformed_player_points.csv"
+    output_file = "../data/output/formations_output_test.csv"
+
+    print("Processing...")
+    start_time = time.time()
+
+    classifier = FormationClassifier(csv_file)
+    classified_formations, defense_phases = classify_in_parallel(classifier.observations)
+    dominant_formations = classifier.get_dominant_formations_by_defense_phase(classified_formations, defense_phases)
+    classifier.save_dominant_formations_by_defense_phase(dominant_formations, classified_formations, output_file)
+
+    end_time = time.time()
+    print(f"Processing completed in {end_time - start_time:.2f} seconds.")
@@ -0,0 +1,155 @@
+"""
+防御フェーズ検出の逐次的なループ（9mラインの外側から戻った選手の20フレーム先までの再侵入の確認など）を，
+型の決まった配列の上でJITコンパイルして速くするモジュールです．
+numba が入っていれば使い，入っていなければ FormationClassifier は今までのNumPy＋集合の処理を使います．
+どちらでも結果は同じです．
+
+カーネルはフレーム（(frame_num, direction) のまとまり）の番号で動き，
+選手IDは 0 から始まる連番にしてから渡します（集合の代わりに印を付けた配列を使うため）．
+"""
+
+import importlib.util
+
+import numpy as np
+
+# numba の読み込みには時間がかかるので，入っているかだけ調べて，初めてカーネルを使うときに読み込む
+NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
+_compiled = {}
+
+# 終了理由のコード
+REASON_NONE = 0
+REASON_DIRECTION_CHANGE = 1
+REASON_OUTER_RETURN = 2
+REASON_NAMES = (None, 'direction_change', 'outer_return')
+
+
+def _jit(func):
+    """numba が入っていればコンパイルした関数を，なければそのままの関数を返す"""
+    if not NUMBA_AVAILABLE:
+        return func
+    if func not in _compiled:
+        import numba
+        _compiled[func] = numba.njit(cache=True, nogil=True)(func)
+    return _compiled[func]
+
+
+def raw_phase_kernel(*args):
+    return _jit(_raw_phase_kernel)(*args)
+
+
+def _raw_phase_kernel(directions, n_defenders, bounds, pids, outer, returned, n_players, check_window):
+    """
+    FormationClassifier.detect_raw_defense_phases と同じ規則でフェーズを探す．
+    directions, n_defenders はフレームごと，pids, outer, returned は観測ごとの配列で，
+    k 番目のフレームの観測は bounds[k]:bounds[k + 1]．
+    (開始フレームの番号, 終了フレームの番号, 方向コード, 終了理由コード) を列に持つ (フェーズ数, 4) の配列を返す
+    """
+    n_frames = len(directions)
+    result = np.empty((n_frames, 4), dtype=np.int64)
+    n_phases = 0
+    # outer_mark[p] == phase_no なら p はそのフェーズの開始時に外側にいた選手
+    outer_mark = np.zeros(n_players, dtype=np.int64)
+    # returned_mark[p] == stamp なら p はそのフレームで戻った選手
+    returned_mark = np.zeros(n_players, dtype=np.int64)
+    stamp = 0
+
+    current_direction = -128
+    i = 0
+    while i < n_frames:
+        direction = directions[i]
+        if direction == current_direction:
+            i += 1
+            continue
+        current_direction = direction
+
+        # フェーズ開始探し
+        while i < n_frames and directions[i] == direction and n_defenders[i] < 6:
+            i += 1
+        if i >= n_frames or directions[i] != direction:
+            continue
+
+        start = i
+        phase_no = n_phases + 1
+        for k in range(bounds[i], bounds[i + 1]):
+            if outer[k]:
+                outer_mark[pids[k]] = phase_no
+
+        # フェーズ終了探し
+        j = i + 1
+        end = start
+        reason = REASON_NONE
+        while j < n_frames:
+            if directions[j] != direction:
+                reason = REASON_DIRECTION_CHANGE
+                break
+
+            stamp += 1
+            any_returned = False
+            for k in range(bounds[j], bounds[j + 1]):
+                if returned[k] and outer_mark[pids[k]] == phase_no:
+                    returned_mark[pids[k]] = stamp
+                    any_returned = True
+
+            if any_returned:
+                # 一時的な戻りか確認する
+                reentered = False
+                t = j + 1
+                while t < n_frames and t - j <= check_window:
+                    if directions[t] != direction:
+                        break
+                    for k in range(bounds[t], bounds[t + 1]):
+                        if outer[k] and returned_mark[pids[k]] == stamp:
+                            reentered = True
+                            break
+                    if reentered:
+                        break
+                    t += 1
+                if not reentered:
+                    reason = REASON_OUTER_RETURN
+                    break
+
+            end = j
+            j += 1
+
+        result[n_phases, 0] = start
+        result[n_phases, 1] = end
+        result[n_phases, 2] = direction
+        result[n_phases, 3] = reason
+        n_phases += 1
+        i = j
+
+    return result[:n_phases]
+
+
+def dense_ids(pids):
+    """選手IDを 0 から始まる連番にする．(連番, 選手の数)"""
+    if len(pids) == 0:
+        return np.zeros(0, dtype=np.int64), 0
+    unique, dense = np.unique(pids, return_inverse=True)
+    return dense.astype(np.int64), len(unique)
+
+
+if __name__ == "__main__":
+    import time
+
+    from formation_classification_9mline_latest import FormationClassifier
+
+    # 1試合分で，NumPy＋集合の処理とJITカーネルの速さを比べる
+    csv_file = "../data/transform/transformed_player_points.csv"
+    classifier = FormationClassifier(csv_file)
+
+    start_time = time.perf_counter()
+    expected = classifier.detect_raw_defense_phases(use_jit=False)
+    python_seconds = time.perf_counter() - start_time
+    print(f"NumPy＋集合: {python_seconds:.3f} 秒")
+
+    if not NUMBA_AVAILABLE:
+        print("numba が入っていないのでJITカーネルは比べられません。")
+    else:
+        # 1回目はコンパイルの時間を含む
+        classifier.detect_raw_defense_phases(use_jit=True)
+        start_time = time.perf_counter()
+        phases = classifier.detect_raw_defense_phases(use_jit=True)
+        jit_seconds = time.perf_counter() - start_time
+        print(f"JIT: {jit_seconds:.3f} 秒（{python_seconds / jit_seconds:.1f} 倍）")
+        print("結果は同じです。" if phases == expected else "結果が一致しません。")
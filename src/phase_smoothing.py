@@ -0,0 +1,247 @@
+"""
+フレームごとのフォーメーション推定結果を時系列で平滑化するモジュールです．
+フレーム単位の推定はちらつく（例: "0--6: 447, 1--5: 175, 2--4: 18, 3--3: 3"）ため，
+切り替えにペナルティを課したHMM（Viterbi）で最尤のラベル列を求めます．
+計算量はフレーム数 × ラベル数^2 の1パスで，ラベル方向はnumpyでベクトル化しています．
+StreamingViterbi を使えば1フレームずつ入力し，確定した部分から順にラベルを受け取れます．
+
+smooth_raw_phases は同じ考え方を分類器が検出した結合前の防御フェーズの列に使い，
+_merge_short_phases（短いフェーズを隣と1つずつ結合する）の代わりに，方向のちらつきをまとめて取り除きます．
+"""
+
+from collections import Counter, deque
+
+import numpy as np
+
+
+def build_transition(n_labels, switch_penalty):
+    """同じラベルに留まれば0，別のラベルへ切り替えると -switch_penalty の遷移スコア行列"""
+    transition = np.full((n_labels, n_labels), -float(switch_penalty))
+    np.fill_diagonal(transition, 0.0)
+    return transition
+
+
+def viterbi_smooth(scores, switch_penalty=5.0, transition=None):
+    """
+    scores: (フレーム数, ラベル数) の各フレームのスコア（対数尤度や信頼度）
+    スコアの合計から切り替えペナルティを引いた値が最大となるラベル番号の列を返す
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    n_frames, n_labels = scores.shape
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.int32)
+    if transition is None:
+        transition = build_transition(n_labels, switch_penalty)
+
+    backpointers = np.empty((n_frames, n_labels), dtype=np.int32)
+    delta = scores[0].copy()
+    backpointers[0] = np.arange(n_labels)
+    for t in range(1, n_frames):
+        # cand[i, j]: 前フレームでラベルi，現フレームでラベルjとなる場合のスコア
+        cand = delta[:, None] + transition
+        backpointers[t] = np.argmax(cand, axis=0)
+        delta = cand[backpointers[t], np.arange(n_labels)] + scores[t]
+
+    path = np.empty(n_frames, dtype=np.int32)
+    path[-1] = int(np.argmax(delta))
+    for t in range(n_frames - 1, 0, -1):
+        path[t - 1] = backpointers[t, path[t]]
+    return path
+
+
+def segments_from_labels(frames, label_ids):
+    """ラベル列を (開始フレーム, 終了フレーム, ラベル番号) の区間リストに変換"""
+    frames = np.asarray(frames)
+    label_ids = np.asarray(label_ids)
+    if len(frames) == 0:
+        return []
+    change = np.flatnonzero(label_ids[1:] != label_ids[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change - 1, [len(frames) - 1]))
+    return [(int(frames[s]), int(frames[e]), int(label_ids[s])) for s, e in zip(starts, ends)]
+
+
+def scores_from_classified(classified_formations, labels):
+    """(frame_num, direction, formation, confidence) のリストからスコア行列を作る"""
+    label_index = {label: i for i, label in enumerate(labels)}
+    scores = np.zeros((len(classified_formations), len(labels)))
+    for t, (_, _, formation, confidence) in enumerate(classified_formations):
+        scores[t, label_index[formation]] = confidence
+    return scores
+
+
+def smooth_classified_formations(classified_formations, switch_penalty=5.0):
+    """
+    classify_formations の結果をdirectionの区間ごとにViterbiで平滑化する．
+    平滑化後の (frame_num, direction, formation, confidence) のリストと，
+    (開始フレーム, 終了フレーム, フォーメーション, 方向) の区間リストを返す
+    """
+    ordered = sorted(classified_formations)
+    labels = sorted({formation for _, _, formation, _ in ordered})
+    smoothed = []
+    segments = []
+
+    start = 0
+    while start < len(ordered):
+        direction = ordered[start][1]
+        end = start
+        while end < len(ordered) and ordered[end][1] == direction:
+            end += 1
+        block = ordered[start:end]
+        path = viterbi_smooth(scores_from_classified(block, labels), switch_penalty)
+        frames = [frame_num for frame_num, _, _, _ in block]
+        for (frame_num, _, _, confidence), label_id in zip(block, path):
+            smoothed.append((frame_num, direction, labels[label_id], confidence))
+        for seg_start, seg_end, label_id in segments_from_labels(frames, path):
+            segments.append((seg_start, seg_end, labels[label_id], direction))
+        start = end
+
+    return smoothed, segments
+
+
+def smooth_raw_phases(raw_phases, min_length=50, directions=("left", "right")):
+    """
+    結合前のフェーズ (開始, 終了, 方向, 終了理由) の列の方向をViterbiで平滑化し，
+    同じ方向になった隣り合うフェーズを結合した (開始, 終了, 方向) のリストを返す．
+    方向を変えられるのは _merge_short_phases と同じく direction_change で終わる min_length 未満のフェーズだけで，
+    それ以外のフェーズの方向と境界はそのまま残す．
+    スコアはフェーズの長さ，切り替えのペナルティは min_length / 2 なので，
+    同じ方向のフェーズに挟まれた min_length 未満のフェーズは前後の方向にそろえられる．
+    ちらつきのない入力では _merge_short_phases と同じ結果になる
+    """
+    if not raw_phases:
+        return []
+    labels = list(directions) + sorted({phase[2] for phase in raw_phases} - set(directions), key=str)
+    label_index = {label: i for i, label in enumerate(labels)}
+    soft = [end - start < min_length and reason == 'direction_change' for start, end, _, reason in raw_phases]
+
+    scores = np.zeros((len(raw_phases), len(labels)))
+    for i, (start, end, direction, _) in enumerate(raw_phases):
+        k = label_index[direction]
+        if soft[i]:
+            scores[i, k] = end - start
+        else:
+            # 長いフェーズと outer_return で終わるフェーズの方向は変えない
+            scores[i] = -np.inf
+            scores[i, k] = 0.0
+    path = viterbi_smooth(scores, min_length / 2)
+
+    merged = []
+    join_next = False
+    for i, (start, end, _, _) in enumerate(raw_phases):
+        direction = labels[path[i]]
+        next_same = i + 1 < len(raw_phases) and labels[path[i + 1]] == direction
+        if join_next or (soft[i] and not next_same and merged and merged[-1][2] == direction):
+            # 短いフェーズは次のフェーズと，次と方向が違えば前のフェーズと結合する
+            merged[-1] = (merged[-1][0], end, direction)
+        else:
+            merged.append((start, end, direction))
+        join_next = soft[i] and next_same
+    return merged
+
+
+def dominant_by_smoothed_labels(classified_formations, defense_phases, switch_penalty=5.0, min_length=0):
+    """
+    防御フェーズごとにフェーズ内のフレームごとの推定をViterbiで平滑化し，
+    平滑化後に最も多いフォーメーションを代表とする (開始, 終了, フォーメーション, 方向) のリストを返す．
+    一瞬だけ別のフォーメーションになったフレームは平滑化で消えるので，多数決がちらつきに左右されない
+    """
+    labels = sorted({formation for _, _, formation, _ in classified_formations})
+    by_direction = {}
+    for item in sorted(classified_formations):
+        by_direction.setdefault(item[1], []).append(item)
+    frame_nums = {direction: np.array([item[0] for item in items]) for direction, items in by_direction.items()}
+
+    dominant_formations = []
+    for start_frame, end_frame, direction in defense_phases:
+        items = by_direction.get(direction, [])
+        if not items:
+            continue
+        lo = np.searchsorted(frame_nums[direction], start_frame, side="left")
+        hi = np.searchsorted(frame_nums[direction], end_frame, side="right")
+        if lo == hi:
+            continue
+        path = viterbi_smooth(scores_from_classified(items[lo:hi], labels), switch_penalty)
+        best_formation = Counter(labels[label_id] for label_id in path.tolist()).most_common(1)[0][0]
+        if end_frame - start_frame >= min_length:
+            dominant_formations.append((start_frame, end_frame, best_formation, direction))
+    return dominant_formations
+
+
+class StreamingViterbi:
+    """
+    1フレームずつスコアを入力するオンライン版Viterbi．
+    全ラベルからの逆追跡が合流した時点までのラベルは以降変化しないので，そこまでを確定として返す．
+    max_lag フレーム以上確定しない場合は，その時点で最良の経路で強制的に確定させる．
+    """
+
+    def __init__(self, labels, switch_penalty=5.0, max_lag=300, transition=None):
+        self.labels = list(labels)
+        self.n_labels = len(self.labels)
+        self.transition = build_transition(self.n_labels, switch_penalty) if transition is None else transition
+        self.max_lag = max_lag
+        self.delta = None
+        self.frames = deque()
+        self.backpointers = deque()
+
+    def push(self, frame_num, score_row):
+        """1フレーム分のスコアを追加し，新たに確定した (frame_num, label) のリストを返す"""
+        score_row = np.asarray(score_row, dtype=np.float64)
+        if self.delta is None:
+            self.delta = score_row.copy()
+            backpointer = np.arange(self.n_labels)
+        else:
+            cand = self.delta[:, None] + self.transition
+            backpointer = np.argmax(cand, axis=0)
+            self.delta = cand[backpointer, np.arange(self.n_labels)] + score_row
+        self.frames.append(frame_num)
+        self.backpointers.append(backpointer)
+        return self._emit_converged()
+
+    def push_label(self, frame_num, formation, confidence=1.0):
+        """ラベルと信頼度から1フレーム分のスコアを作って push する"""
+        score_row = np.zeros(self.n_labels)
+        score_row[self.labels.index(formation)] = confidence
+        return self.push(frame_num, score_row)
+
+    def flush(self):
+        """残りのフレームを現時点の最良経路で確定させて返す"""
+        if self.delta is None:
+            return []
+        path = self._trace(np.array([int(np.argmax(self.delta))]))[:, 0]
+        emitted = [(frame, self.labels[label_id]) for frame, label_id in zip(self.frames, path)]
+        self.frames.clear()
+        self.backpointers.clear()
+        self.delta = None
+        return emitted
+
+    def _trace(self, states):
+        """保留中の各フレームについて，指定した終端ラベルからの逆追跡結果 (フレーム数, 終端数) を返す"""
+        paths = np.empty((len(self.backpointers), len(states)), dtype=np.int32)
+        paths[-1] = states
+        for t in range(len(self.backpointers) - 1, 0, -1):
+            paths[t - 1] = self.backpointers[t][paths[t]]
+        return paths
+
+    def _emit_converged(self):
+        paths = self._trace(np.arange(self.n_labels))
+        agreed = np.flatnonzero(np.all(paths == paths[:, :1], axis=1))
+        # 最後のフレームは終端ごとにラベルが異なるので，合流点は最後から2番目以前
+        agreed = agreed[agreed < len(paths) - 1]
+        if len(agreed):
+            n_emit = int(agreed[-1]) + 1
+        elif len(paths) > self.max_lag:
+            best = self._trace(np.array([int(np.argmax(self.delta))]))[:, 0]
+            paths = best[:, None]
+            n_emit = len(paths) - self.max_lag
+        else:
+            return []
+
+        emitted = []
+        for t in range(n_emit):
+            emitted.append((self.frames.popleft(), self.labels[int(paths[t, 0])]))
+            self.backpointers.popleft()
+        # 確定したフレームより前には戻らないので，先頭の逆ポインタは自分自身を指すようにする
+        if self.backpointers:
+            self.backpointers[0] = np.arange(self.n_labels)
+        return emitted
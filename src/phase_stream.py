@@ -0,0 +1,101 @@
+"""
+確定した防御フェーズを1行1件のJSON（JSON Lines）でファイルに追記していくモジュールです．
+試合全体の処理が終わるのを待たず，フェーズが確定するたびに書き込んでフラッシュするので，
+ベンチの表示やデータベースへの取り込みなどはファイルを tail して低い遅延で読めます．
+一定時間ごとに進行中のフェーズの状態（heartbeat）も書き込みます．
+
+行の "type" は "phase"（確定したフェーズ），"heartbeat"（進行中の状態），"end"（処理の終わり）のいずれかです．
+"""
+
+import json
+import os
+import time
+
+from online_classifier import OnlineFormationClassifier, iter_tracking_frames
+
+
+class JsonlPhaseSink:
+    """
+    phase の行は start_frame, end_frame, direction, end_reason, formation, counts, confidence を持つ．
+    heartbeat_seconds 秒ごとに，最後に処理したフレームと進行中のフェーズを heartbeat として書く
+    """
+
+    def __init__(self, output_file, heartbeat_seconds=1.0, append=False, fsync=False):
+        directory = os.path.dirname(output_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.output_file = output_file
+        self.file = open(output_file, 'a' if append else 'w', encoding='utf-8')
+        self.heartbeat_seconds = heartbeat_seconds
+        self.fsync = fsync
+        self.last_heartbeat = time.monotonic()
+        self.phases_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __call__(self, record):
+        """PipelineRunner の sink としても使えるように，確定したフェーズを書き込む"""
+        self.write_phase(record)
+
+    def write_phase(self, record):
+        self._write({"type": "phase", **record})
+        self.phases_written += 1
+
+    def heartbeat(self, frame_num, direction, formation, current_phase, force=False):
+        """前回から heartbeat_seconds 秒以上たっていれば進行中の状態を書き込む"""
+        now = time.monotonic()
+        if not force and now - self.last_heartbeat < self.heartbeat_seconds:
+            return False
+        self.last_heartbeat = now
+        self._write({
+            "type": "heartbeat",
+            "frame_num": frame_num,
+            "direction": direction,
+            "formation": formation,
+            "phase": current_phase,
+        })
+        return True
+
+    def close(self, frame_num=None):
+        if self.file.closed:
+            return
+        self._write({"type": "end", "frame_num": frame_num, "phases": self.phases_written})
+        self.file.close()
+
+    def _write(self, record):
+        record["time"] = round(time.time(), 3)
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # 読む側がすぐに見られるように1行ごとにフラッシュする
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+
+def stream_phases(csv_file, output_file, min_phase_length=50, heartbeat_seconds=1.0):
+    """CSVを先頭から1フレームずつ処理し，確定したフェーズを output_file に書き込む．書いたフェーズ数を返す"""
+    classifier = OnlineFormationClassifier(min_phase_length, windowed=True)
+    frame_num = None
+    with JsonlPhaseSink(output_file, heartbeat_seconds) as sink:
+        for key, frame in iter_tracking_frames(csv_file):
+            for record in classifier.push_frame(key, frame):
+                sink.write_phase(record)
+            frame_num, direction = key
+            sink.heartbeat(frame_num, direction, classifier.last_frame[1], classifier.current_phase())
+        for record in classifier.flush():
+            sink.write_phase(record)
+        sink.close(frame_num)
+        return sink.phases_written
+
+
+if __name__ == "__main__":
+    csv_file = "../data/transform/transformed_player_points.csv"
+    output_file = "../data/output/phases_stream.jsonl"
+
+    start_time = time.time()
+    n_phases = stream_phases(csv_file, output_file)
+    print(f"{n_phases}フェーズを {output_file} に書き込みました。")
+    print(f"Processing completed in {time.time() - start_time:.2f} seconds.")
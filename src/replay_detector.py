@@ -0,0 +1,144 @@
+"""
+試合映像に入るリプレイの区間を追跡データから見つけて取り除くモジュールです．
+リプレイは direction の切り替わりや防御フェーズの開始を乱し，すでに処理したプレーを二重に数えるので，
+フォーメーションの推定と防御フェーズの検出の前に取り除きます．
+
+使う手がかりは追跡データにすでにあるものだけです．
+    ・新しいIDの急増（映像が切り替わると追跡がやり直しになり，ほぼ全員が新しいIDになる）
+    ・全選手の位置の不連続な移動（前のフレームから続いているIDのほとんどが大きく動く．direction の切り替わりは除く）
+    ・短い direction の反転（前後と逆の direction が max_flip_frames フレーム以下だけ続く）
+上の2つが起きたフレームを映像の切り替わり（カット）とし，max_replay_frames フレーム以内に
+続く2つのカットの間をリプレイとみなします．短い direction の反転もそのままリプレイとして除きます．
+"""
+
+import csv
+
+import numpy as np
+
+
+def frame_signals(observations, memory=15, jump_distance=0.1):
+    """
+    フレームごとの手がかりを配列で返す．
+    new_ids: 直前の memory フレームに出ていなかったIDの数
+    moved: 前のフレームから同じ direction で続いているIDのうち jump_distance より大きく動いたものの割合
+    matched: 前のフレームから同じ direction で続いているIDの数
+    """
+    frames, frame_index = np.unique(observations.frame_num, return_inverse=True)
+    n_frames = len(frames)
+    order = np.lexsort((observations.frame_num, observations.player_id))
+    pids = observations.player_id[order]
+    index = frame_index[order]
+    same_id = np.zeros(len(order), dtype=bool)
+    same_id[1:] = pids[1:] == pids[:-1]
+    gap = np.full(len(order), np.iinfo(np.int64).max)
+    gap[1:] = np.where(same_id[1:], frames[index[1:]] - frames[index[:-1]], gap[1:])
+
+    is_new = gap > memory
+    new_ids = np.bincount(index[is_new], minlength=n_frames)
+
+    # 直前のフレーム（フレーム番号で1つ前に出たフレーム）から続いているIDの移動量．
+    # direction が変わるフレームでは座標の向きが変わり得るので，またいだ移動は数えない
+    directions = observations.direction[order]
+    continued = np.zeros(len(order), dtype=bool)
+    continued[1:] = same_id[1:] & (index[1:] - index[:-1] == 1) & (directions[1:] == directions[:-1])
+    x = observations.x[order]
+    y = observations.y[order]
+    step = np.zeros(len(order))
+    step[1:] = np.hypot(x[1:] - x[:-1], y[1:] - y[:-1])
+    matched = np.bincount(index[continued], minlength=n_frames)
+    jumped = np.bincount(index[continued & (step > jump_distance)], minlength=n_frames)
+    moved = np.divide(jumped, matched, out=np.zeros(n_frames), where=matched > 0)
+    return frames, new_ids, moved, matched
+
+
+def cut_frames(observations, min_new_ids=6, min_moved=0.8, min_matched=3, memory=15, jump_distance=0.1):
+    """映像が切り替わったとみなすフレームの番号（frames の中での位置）の配列"""
+    frames, new_ids, moved, matched = frame_signals(observations, memory, jump_distance)
+    cuts = (new_ids >= min_new_ids) | ((matched >= min_matched) & (moved >= min_moved))
+    # 最初のフレームは全員が新しいIDなので除く
+    cuts[:1] = False
+    return frames, np.flatnonzero(cuts)
+
+
+def direction_flips(frames, directions, max_flip_frames=45):
+    """前後と逆の direction が max_flip_frames フレーム以下だけ続く区間を (開始位置, 終了位置) で返す"""
+    if len(frames) == 0:
+        return []
+    change = np.flatnonzero(directions[1:] != directions[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.append(change, len(frames)) - 1
+    flips = []
+    for k in range(1, len(starts) - 1):
+        if (
+            frames[ends[k]] - frames[starts[k]] + 1 <= max_flip_frames
+            and directions[starts[k - 1]] == directions[starts[k + 1]]
+        ):
+            flips.append((int(starts[k]), int(ends[k])))
+    return flips
+
+
+def detect_replays(observations, max_replay_frames=450, max_flip_frames=45, **cut_params):
+    """
+    リプレイとみなした区間を (開始フレーム, 終了フレーム, 理由) のリストで返す．
+    理由は "cut"（2つのカットの間）か "direction_flip"（短い direction の反転）
+    """
+    frames, cuts = cut_frames(observations, **cut_params)
+    ranges = []
+    k = 0
+    while k + 1 < len(cuts):
+        start, end = cuts[k], cuts[k + 1]
+        if frames[end] - frames[start] <= max_replay_frames:
+            ranges.append((int(start), int(end) - 1, "cut"))
+            k += 2
+        else:
+            k += 1
+
+    # フレームごとの direction はそのフレームの最初の観測のもの
+    group_frames, group_directions, _ = observations.frame_groups()
+    first = np.ones(len(group_frames), dtype=bool)
+    first[1:] = group_frames[1:] != group_frames[:-1]
+    for start, end in direction_flips(group_frames[first], group_directions[first], max_flip_frames):
+        ranges.append((start, end, "direction_flip"))
+
+    # 重なる区間はまとめる（理由は先に見つかったもの）
+    ranges.sort()
+    merged = []
+    for start, end, reason in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end), merged[-1][2])
+        else:
+            merged.append((start, end, reason))
+    return [(int(frames[start]), int(frames[end]), reason) for start, end, reason in merged]
+
+
+def drop_ranges(observations, ranges):
+    """(開始フレーム, 終了フレーム, ...) の区間に入る観測を取り除いた Observations を返す"""
+    if not ranges:
+        return observations
+    starts = np.array([r[0] for r in ranges])
+    ends = np.array([r[1] for r in ranges])
+    idx = np.searchsorted(starts, observations.frame_num, side="right") - 1
+    inside = (idx >= 0) & (observations.frame_num <= ends[np.maximum(idx, 0)])
+    return observations.take(~inside)
+
+
+def save_skipped_ranges(ranges, output_file):
+    """取り除いた区間をCSVに保存する"""
+    with open(output_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["開始フレーム", "終了フレーム", "フレーム数", "理由"])
+        for start_frame, end_frame, reason in ranges:
+            writer.writerow([start_frame, end_frame, end_frame - start_frame + 1, reason])
+
+
+if __name__ == "__main__":
+    from observations import Observations
+
+    csv_file = "../data/transform/transformed_player_points.csv"
+    output_file = "../data/output/skipped_replays.csv"
+
+    observations = Observations.from_csv(csv_file)
+    ranges = detect_replays(observations)
+    save_skipped_ranges(ranges, output_file)
+    skipped = sum(end - start + 1 for start, end, _ in ranges)
+    print(f"{len(ranges)}区間（{skipped}フレーム）をリプレイとして除きました。")
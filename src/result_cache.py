@@ -0,0 +1,241 @@
+"""
+フレームごとの推定結果と結合前の防御フェーズをディスクに保存して使い回すモジュールです．
+フェーズの結合（min_phase_length）や代表フォーメーションの集計のパラメータだけを変えて
+何度も実行するときに，重いフレームごとの推定をやり直さずに済みます．
+
+キーは (入力データのハッシュ, 推定方法の名前, 推定方法のパラメータ, CACHE_VERSION) で，
+結果は列ごとの配列（フレーム番号 int32，方向・フォーメーションは番号と名前の表，信頼度 float32）にして
+1件ずつ npz に保存します．保存したファイルの合計が max_bytes を超えたら，
+最後に使った時刻（ファイルの更新時刻）が古いものから消します（LRU）．
+"""
+
+import glob
+import hashlib
+import inspect
+import json
+import os
+
+import numpy as np
+
+from formation_classification_9mline_latest import FormationClassifier
+
+STRATEGY = "9mline_latest"
+# 推定の処理（分類器やフェーズの検出）を変えて結果が変わるときは上げる．古いキャッシュは使われなくなり，LRUで消える
+CACHE_VERSION = "2"
+
+
+def file_hash(path, block_size=1 << 20):
+    """ファイルの中身のハッシュ．CSVを読み込む前に計算できる"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def classifier_params(**params):
+    """
+    FormationClassifier のパラメータを既定値で補った辞書．
+    既定値を省略したかどうかでキャッシュのキーが変わらないように，キーにはこれを使う
+    """
+    signature = inspect.signature(FormationClassifier.__init__)
+    defaults = {
+        name: parameter.default
+        for name, parameter in signature.parameters.items()
+        if name not in ("self", "csv_file", "observations")
+    }
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise TypeError(f"FormationClassifier にないパラメータです: {', '.join(sorted(unknown))}")
+    return {**defaults, **params}
+
+
+def cache_key(data_hash, strategy, params):
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    digest.update(data_hash.encode())
+    digest.update(strategy.encode())
+    digest.update(CACHE_VERSION.encode())
+    return f"{strategy}-{digest.hexdigest()}"
+
+
+def _encode_labels(values):
+    """文字列（または None）のリストを (名前の表, 番号の配列) にする．None は空文字列で持つ"""
+    labels, codes = np.unique(
+        np.asarray(["" if v is None else str(v) for v in values], dtype=str), return_inverse=True
+    )
+    return labels, codes.astype(np.int16)
+
+
+def _decode_labels(labels):
+    return [label if label != "" else None for label in labels.tolist()]
+
+
+def encode_results(classified_formations, raw_phases=None):
+    """(frame_num, direction, formation, confidence) と (開始, 終了, 方向, 終了理由) のリストを配列の辞書にする"""
+    arrays = {}
+    if classified_formations:
+        frame_num, direction, formation, confidence = zip(*classified_formations)
+    else:
+        frame_num, direction, formation, confidence = (), (), (), ()
+    arrays["frame_num"] = np.asarray(frame_num, dtype=np.int32)
+    arrays["direction_labels"], arrays["direction"] = _encode_labels(direction)
+    arrays["formation_labels"], arrays["formation"] = _encode_labels(formation)
+    arrays["confidence"] = np.asarray(confidence, dtype=np.float32)
+    if raw_phases is not None:
+        start, end, phase_direction, reason = zip(*raw_phases) if raw_phases else ((), (), (), ())
+        arrays["phase_start"] = np.asarray(start, dtype=np.int32)
+        arrays["phase_end"] = np.asarray(end, dtype=np.int32)
+        arrays["phase_direction_labels"], arrays["phase_direction"] = _encode_labels(phase_direction)
+        arrays["phase_reason_labels"], arrays["phase_reason"] = _encode_labels(reason)
+    return arrays
+
+
+def decode_results(data):
+    """encode_results の逆．結合前のフェーズを保存していなければ None を返す"""
+    directions = _decode_labels(data["direction_labels"])
+    formations = _decode_labels(data["formation_labels"])
+    classified_formations = [
+        (frame_num, directions[d], formations[f], confidence)
+        for frame_num, d, f, confidence in zip(
+            data["frame_num"].tolist(), data["direction"].tolist(),
+            data["formation"].tolist(), data["confidence"].tolist(),
+        )
+    ]
+    if "phase_start" not in data:
+        return classified_formations, None
+    phase_directions = _decode_labels(data["phase_direction_labels"])
+    reasons = _decode_labels(data["phase_reason_labels"])
+    raw_phases = [
+        (start, end, phase_directions[d], reasons[r])
+        for start, end, d, r in zip(
+            data["phase_start"].tolist(), data["phase_end"].tolist(),
+            data["phase_direction"].tolist(), data["phase_reason"].tolist(),
+        )
+    ]
+    return classified_formations, raw_phases
+
+
+class ResultCache:
+    def __init__(self, cache_dir="../data/cache/results", max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, data_hash, strategy, params):
+        """保存した (classified_formations, raw_phases) を返す．なければ None"""
+        path = self._path(cache_key(data_hash, strategy, params))
+        try:
+            with np.load(path) as data:
+                result = decode_results(data)
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            self.stats["misses"] += 1
+            return None
+        # 使った時刻を更新して LRU の順に反映する
+        os.utime(path)
+        self.stats["hits"] += 1
+        return result
+
+    def put(self, data_hash, strategy, params, classified_formations, raw_phases=None):
+        key = cache_key(data_hash, strategy, params)
+        path = self._path(key)
+        # 書きかけのファイルを読まないように，別名で書いてから置き換える
+        tmp_path = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.tmp.npz")
+        np.savez_compressed(tmp_path, **encode_results(classified_formations, raw_phases))
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def entries(self):
+        """(パス, バイト数, 最後に使った時刻) のリストを古い順に返す"""
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, "*.npz")):
+            if path.endswith(".tmp.npz"):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self, keep=None):
+        """合計が max_bytes 以下になるまで，最後に使った時刻が古いものから消す"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.stats["evicted"] += 1
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+    def report(self):
+        """キャッシュの状態と，このインスタンスでのヒット率をまとめた辞書"""
+        entries = self.entries()
+        by_strategy = {}
+        for path, size, _ in entries:
+            strategy = os.path.basename(path).rsplit("-", 1)[0]
+            count, total = by_strategy.get(strategy, (0, 0))
+            by_strategy[strategy] = (count + 1, total + size)
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "by_strategy": by_strategy,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+
+def classify_cached(csv_file, cache, **params):
+    """
+    FormationClassifier(csv_file, **params) のフレームごとの推定と結合前のフェーズを，キャッシュがあればそこから返す．
+    キャッシュにあればCSVの読み込みも前処理も行わない．
+    フェーズの結合は FormationClassifier._merge_short_phases(raw_phases, min_phase_length) で行う
+    """
+    params = classifier_params(**params)
+    data_hash = file_hash(csv_file)
+    cached = cache.get(data_hash, STRATEGY, params)
+    if cached is not None and cached[1] is not None:
+        return cached
+    classifier = FormationClassifier(csv_file, **params)
+    classified_formations = classifier.classify_formations()
+    raw_phases = classifier.detect_raw_defense_phases()
+    cache.put(data_hash, STRATEGY, params, classified_formations, raw_phases)
+    return classified_formations, raw_phases
+
+
+if __name__ == "__main__":
+    import time
+
+    csv_file = "../data/transform/transformed_player_points.csv"
+
+    cache = ResultCache()
+    start_time = time.time()
+    classified_formations, raw_phases = classify_cached(csv_file, cache, zone_mode="box")
+    print(f"フレームごとの推定: {time.time() - start_time:.2f} 秒")
+
+    # フェーズの結合のパラメータだけを変えて比べる
+    for min_phase_length in (25, 50, 100, 200):
+        defense_phases = FormationClassifier._merge_short_phases(raw_phases, min_phase_length)
+        print(f"min_phase_length={min_phase_length}: {len(defense_phases)} フェーズ")
+
+    report = cache.report()
+    print(
+        f"キャッシュ: {report['entries']} 件, {report['bytes'] / 1024:.1f} KB / {report['max_bytes'] / 1024 / 1024:.0f} MB, "
+        f"ヒット率 {report['hit_rate']:.0%}"
+    )
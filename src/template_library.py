@@ -0,0 +1,209 @@
+"""
+ラベル付きの選手配置の例をたくさん集めたテンプレートライブラリで，最近傍探索によりフォーメーションを推定するモジュールです．
+手書きの10個の理想座標（formation_positions）だけでは，実際の崩れた防御が別のテンプレートに近くなってしまうので，
+推定済み・手作業で確認済みの防御フェーズの全フレームを例として使います．
+
+配置は正準化してから固定長のベクトルにします．
+    ・left のフレームはx座標を反転して，全て right（ゴールが x=1）の向きにそろえる（Observations.canonical_x）
+    ・ゴールに近い防御選手 N_PLAYERS 人を選び，ゴールライン方向（y）の順に並べる
+ベクトルは KD木（scipy.spatial.cKDTree）に入れ，全フレームをまとめて k 近傍探索するので，
+テンプレートが数千個に増えても1フレームあたりの時間はほとんど変わりません．
+"""
+
+import csv
+from collections import Counter
+
+import numpy as np
+
+from observations import DIRECTION_NAMES, decode
+
+N_PLAYERS = 6
+# 正準化した向き（right）でのゴールの位置
+GOAL = (1.0, 0.5)
+
+
+def frame_vectors(observations, n_players=N_PLAYERS):
+    """
+    防御選手が n_players 人以上いるフレームごとに，ゴールに近い n_players 人をy順に並べたベクトルを作る．
+    (フレーム番号, 方向コード, (フレーム数, n_players * 2) の配列) を返す
+    """
+    obs = observations.take(observations.defender_mask())
+    frames, directions, starts = obs.frame_groups()
+    if len(frames) == 0:
+        return frames, directions, np.zeros((0, n_players * 2), dtype=np.float32)
+    counts = np.diff(np.append(starts, len(obs)))
+    group = np.repeat(np.arange(len(frames)), counts)
+
+    x = obs.canonical_x
+    y = obs.y
+    distance = np.hypot(x - GOAL[0], y - GOAL[1])
+    order = np.lexsort((distance, group))
+    rank = np.arange(len(order)) - starts[group[order]]
+    nearest = order[rank < n_players]
+
+    full = counts >= n_players
+    keep = full[group[nearest]]
+    nearest = nearest[keep]
+    xs = x[nearest].reshape(-1, n_players)
+    ys = y[nearest].reshape(-1, n_players)
+    by_y = np.argsort(ys, axis=1, kind="stable")
+    xs = np.take_along_axis(xs, by_y, axis=1)
+    ys = np.take_along_axis(ys, by_y, axis=1)
+    vectors = np.stack([xs, ys], axis=2).reshape(-1, n_players * 2).astype(np.float32)
+    return frames[full], directions[full], vectors
+
+
+def positions_vector(positions, direction="right"):
+    """[(x, y), ...] の配置（formation_positions の形）を1つのベクトルにする"""
+    positions = np.asarray(positions, dtype=np.float64)
+    x = 1.0 - positions[:, 0] if direction == "left" else positions[:, 0]
+    by_y = np.argsort(positions[:, 1], kind="stable")
+    return np.stack([x[by_y], positions[by_y, 1]], axis=1).reshape(-1).astype(np.float32)
+
+
+def load_labeled_phases(phase_file):
+    """フェーズのCSV（開始フレーム, 終了フレーム, フォーメーション, 方向, ...）を読む"""
+    with open(phase_file, 'r') as file:
+        reader = csv.reader(file)
+        next(reader)
+        return [(int(row[0]), int(row[1]), row[2], row[3]) for row in reader]
+
+
+class TemplateLibrary:
+    def __init__(self, n_players=N_PLAYERS):
+        self.n_players = n_players
+        self.labels = []
+        self._vectors = []
+        self._label_ids = []
+        self._tree = None
+
+    def __len__(self):
+        return sum(len(v) for v in self._vectors)
+
+    def _label_id(self, formation):
+        if formation not in self.labels:
+            self.labels.append(formation)
+        return self.labels.index(formation)
+
+    def add(self, vectors, formation):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.n_players * 2)
+        self._vectors.append(vectors)
+        self._label_ids.append(np.full(len(vectors), self._label_id(formation), dtype=np.int16))
+        self._tree = None
+
+    def add_formation_positions(self, formation_positions, n_jitter=0, sigma=0.02, seed=0):
+        """
+        formation_positions（"0-6_right" などをキーにした理想座標）をテンプレートとして加える．
+        right の向きのものだけを使い（left は正準化すると同じになる），n_jitter 個ずつ座標をずらした例も加える
+        """
+        rng = np.random.default_rng(seed)
+        for name, positions in formation_positions.items():
+            formation, _, side = name.rpartition("_")
+            if side != "right" or len(positions) != self.n_players:
+                continue
+            vector = positions_vector(positions)
+            self.add(vector, formation)
+            if n_jitter:
+                jittered = vector + rng.normal(0.0, sigma, (n_jitter, len(vector))).astype(np.float32)
+                self.add(jittered, formation)
+
+    def add_labeled_phases(self, observations, phases):
+        """
+        phases: (開始フレーム, 終了フレーム, フォーメーション, 方向) のリスト
+        フェーズ内の全フレームの配置を，そのフェーズのフォーメーションの例として加える
+        """
+        frames, directions, vectors = frame_vectors(observations, self.n_players)
+        direction_names = np.array([decode(d, DIRECTION_NAMES) for d in directions.tolist()], dtype=str)
+        for start_frame, end_frame, formation, direction in phases:
+            inside = (frames >= start_frame) & (frames <= end_frame) & (direction_names == direction)
+            if inside.any():
+                self.add(vectors[inside], formation)
+
+    def arrays(self):
+        if not self._vectors:
+            return np.zeros((0, self.n_players * 2), dtype=np.float32), np.zeros(0, dtype=np.int16)
+        return np.concatenate(self._vectors), np.concatenate(self._label_ids)
+
+    def tree(self):
+        if self._tree is None:
+            from scipy.spatial import cKDTree
+
+            vectors, _ = self.arrays()
+            self._tree = cKDTree(vectors)
+        return self._tree
+
+    def query(self, vectors, k=5):
+        """
+        (ベクトル数, n_players * 2) の配列をまとめて k 近傍で推定する．
+        距離の逆数で重み付けした多数決で (フォーメーション番号, 信頼度) の配列を返す．
+        k が1未満か，テンプレートが1つもなければ ValueError
+        """
+        if k < 1:
+            raise ValueError(f"k は1以上にしてください: {k}")
+        _, label_ids = self.arrays()
+        if len(label_ids) == 0:
+            raise ValueError("テンプレートが1つもありません")
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.n_players * 2)
+        if len(vectors) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+        k = min(k, len(label_ids))
+        distances, index = self.tree().query(vectors, k=k)
+        distances = distances.reshape(len(vectors), k)
+        index = index.reshape(len(vectors), k)
+        weights = 1.0 / (distances + 1e-6)
+        votes = np.zeros((len(vectors), len(self.labels)))
+        np.add.at(votes, (np.repeat(np.arange(len(vectors)), k), label_ids[index].reshape(-1)), weights.reshape(-1))
+        best = votes.argmax(axis=1)
+        confidence = votes[np.arange(len(vectors)), best] / votes.sum(axis=1)
+        return best, confidence
+
+    def classify(self, observations, k=5):
+        """classify_formations と同じ (frame_num, direction, formation, confidence) のリストを返す"""
+        frames, directions, vectors = frame_vectors(observations, self.n_players)
+        if len(frames) == 0:
+            return []
+        best, confidence = self.query(vectors, k)
+        return [
+            (frame_num, decode(direction, DIRECTION_NAMES), self.labels[label_id], round(conf, 3))
+            for frame_num, direction, label_id, conf in zip(
+                frames.tolist(), directions.tolist(), best.tolist(), confidence.tolist()
+            )
+        ]
+
+    def label_counts(self):
+        _, label_ids = self.arrays()
+        return Counter(self.labels[i] for i in label_ids.tolist())
+
+    def save(self, path):
+        vectors, label_ids = self.arrays()
+        np.savez_compressed(path, vectors=vectors, label_ids=label_ids, labels=np.asarray(self.labels, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            library = cls(n_players=data["vectors"].shape[1] // 2)
+            library.labels = data["labels"].tolist()
+            library._vectors = [data["vectors"]]
+            library._label_ids = [data["label_ids"]]
+        return library
+
+
+if __name__ == "__main__":
+    import time
+
+    from formation_classification_9mline_latest import FormationClassifier
+
+    csv_file = "../data/transform/transformed_player_points.csv"
+    phase_file = "../data/output/formations_output_latest.csv"
+    library_file = "../data/output/template_library.npz"
+
+    observations = FormationClassifier(csv_file).observations
+    library = TemplateLibrary()
+    library.add_labeled_phases(observations, load_labeled_phases(phase_file))
+    library.save(library_file)
+    print(f"テンプレート {len(library)} 個: {dict(library.label_counts())}")
+
+    start_time = time.time()
+    classified_formations = library.classify(observations)
+    elapsed = time.time() - start_time
+    print(f"{len(classified_formations)} フレームを {elapsed:.2f} 秒で推定しました。")
@@ -0,0 +1,57 @@
+"""
+検出の途切れた選手の位置を補完するモジュールです．
+同じIDの選手が数フレームだけ検出されなかった場合に，前後の位置から線形補間（または直前の位置で埋める）し，
+防御選手が6人未満で推定に使えなかったフレームを減らします．
+全試合分の配列をIDごとにまとめて処理し，フレームごとのPythonループは使いません．
+補完した点は imputed 列が True になります．
+"""
+
+import numpy as np
+
+from observations import Observations
+
+
+def fill_track_gaps(observations, max_gap=5, method="linear"):
+    """
+    observations: Observations
+    同じ player_id・team・direction の前後の検出の間が max_gap フレーム以下なら間を埋める。
+    method は "linear"（線形補間）か "ffill"（直前の位置で埋める）。
+    補完した点（imputed が True）を加え，(player_id, frame_num) 順に並べ替えて返す
+    """
+    n = len(observations)
+    order = np.lexsort((observations.frame_num, observations.player_id))
+    tracks = observations.take(order)
+    if n < 2:
+        return tracks
+
+    frame_nums = tracks.frame_num
+    gaps = frame_nums[1:] - frame_nums[:-1] - 1
+    # 同じ選手の連続した検出で，チームと方向が変わっていない間だけを対象にする
+    same_track = (
+        (tracks.player_id[1:] == tracks.player_id[:-1])
+        & (tracks.team[1:] == tracks.team[:-1])
+        & (tracks.direction[1:] == tracks.direction[:-1])
+    )
+    fillable = same_track & (gaps >= 1) & (gaps <= max_gap)
+    before = np.flatnonzero(fillable)
+    if len(before) == 0:
+        return tracks
+
+    # 補完する点ごとに，直前の検出のインデックスと間の何フレーム目かを求める
+    counts = gaps[before]
+    src = np.repeat(before, counts)
+    step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+
+    filled = tracks.take(src)
+    filled.frame_num = (frame_nums[src] + step).astype(np.int32)
+    if method == "linear":
+        t = (step / (np.repeat(counts, counts) + 1)).astype(np.float32)
+        filled.x = tracks.x[src] + t * (tracks.x[src + 1] - tracks.x[src])
+        filled.y = tracks.y[src] + t * (tracks.y[src + 1] - tracks.y[src])
+    elif method != "ffill":
+        raise ValueError(f"未対応の補完方法です: {method}")
+    filled.imputed = np.ones(len(src), dtype=bool)
+
+    merged = Observations.concat(tracks, filled)
+    order = np.lexsort((merged.frame_num, merged.player_id))
+    return merged.take(order)
@@ -0,0 +1,168 @@
+"""
+トラッカーのIDの入れ替わりで途切れた選手の軌跡（フラグメント）をつなぎ，試合を通して同じIDにするモジュールです．
+detect_defense_phases の outer_return の判定は選手IDで選手を対応付けるので，
+IDが1回入れ替わるだけでフェーズが長く続いたり早く終わったりします．
+
+各IDの軌跡の終わりと，その後 max_gap フレーム以内に始まる同じチームの別のIDの軌跡の始まりを候補の組にし，
+終わりの位置と速度から予測した位置との距離でふるいにかけます（ゲート）．
+候補の組はつながりのある塊ごとにまとめ，塊ごとに1回だけ割り当て問題を解きます（フレームごとのループは使いません）．
+"""
+
+import numpy as np
+
+from observations import Observations
+
+
+def track_fragments(observations, velocity_frames=5):
+    """
+    選手IDごとの軌跡の始まりと終わりの情報を辞書の配列で返す．
+    速度は始まり・終わりから velocity_frames 個の観測の間の平均（1フレームあたり）
+    """
+    order = np.lexsort((observations.frame_num, observations.player_id))
+    pids = observations.player_id[order]
+    frames = observations.frame_num[order].astype(np.int64)
+    x = observations.x[order].astype(np.float64)
+    y = observations.y[order].astype(np.float64)
+    ids, first = np.unique(pids, return_index=True)
+    last = np.append(first[1:], len(pids)) - 1
+
+    def velocity(a, b):
+        dt = np.maximum(frames[b] - frames[a], 1)
+        return (x[b] - x[a]) / dt, (y[b] - y[a]) / dt
+
+    head = np.minimum(first + velocity_frames, last)
+    tail = np.maximum(last - velocity_frames, first)
+    start_vx, start_vy = velocity(first, head)
+    end_vx, end_vy = velocity(tail, last)
+
+    # チームは軌跡の中で最も多いもの
+    teams = observations.team[order].astype(np.int64) + 1
+    team_counts = np.zeros((len(ids), teams.max() + 1 if len(teams) else 1), dtype=np.int64)
+    np.add.at(team_counts, (np.repeat(np.arange(len(ids)), last - first + 1), teams), 1)
+
+    return {
+        "id": ids,
+        "team": team_counts.argmax(axis=1) - 1,
+        "start_frame": frames[first],
+        "end_frame": frames[last],
+        "start_x": x[first], "start_y": y[first],
+        "end_x": x[last], "end_y": y[last],
+        "start_vx": start_vx, "start_vy": start_vy,
+        "end_vx": end_vx, "end_vy": end_vy,
+    }
+
+
+def candidate_links(fragments, max_gap=30, gate=0.03, gate_per_frame=0.004):
+    """
+    つなげる候補の (前のフラグメント, 後のフラグメント, コスト) の配列を返す．
+    前の軌跡の終わりを速度で延ばした位置と，後の軌跡の始まりを速度で戻した位置の中点との距離がコスト．
+    コストが gate + gate_per_frame * 間のフレーム数 を超える組は候補にしない
+    """
+    order = np.argsort(fragments["start_frame"], kind="stable")
+    starts = fragments["start_frame"][order]
+    ends = fragments["end_frame"]
+    lo = np.searchsorted(starts, ends + 1, side="left")
+    hi = np.searchsorted(starts, ends + max_gap, side="right")
+    counts = hi - lo
+    a = np.repeat(np.arange(len(ends)), counts)
+    b = order[np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+
+    gap = (fragments["start_frame"][b] - ends[a]).astype(np.float64)
+    forward_x = fragments["end_x"][a] + fragments["end_vx"][a] * gap
+    forward_y = fragments["end_y"][a] + fragments["end_vy"][a] * gap
+    backward_x = fragments["start_x"][b] - fragments["start_vx"][b] * gap
+    backward_y = fragments["start_y"][b] - fragments["start_vy"][b] * gap
+    cost = 0.5 * (
+        np.hypot(forward_x - fragments["start_x"][b], forward_y - fragments["start_y"][b])
+        + np.hypot(backward_x - fragments["end_x"][a], backward_y - fragments["end_y"][a])
+    )
+    keep = (fragments["team"][a] == fragments["team"][b]) & (cost <= gate + gate_per_frame * gap)
+    return a[keep], b[keep], cost[keep]
+
+
+def solve_links(n_fragments, a, b, cost, gate_cost):
+    """
+    候補の組の中から，各フラグメントの前と後をそれぞれ高々1つにする割り当てを選ぶ．
+    候補の組のつながりで塊に分け，塊ごとに「つながない」（gate_cost）を加えた割り当て問題を解く
+    """
+    from scipy.optimize import linear_sum_assignment
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    if len(a) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # 前の役（0..n-1）と後の役（n..2n-1）を頂点にした二部グラフの連結成分
+    graph = coo_matrix((np.ones(len(a)), (a, b + n_fragments)), shape=(2 * n_fragments, 2 * n_fragments))
+    _, labels = connected_components(graph, directed=False)
+    component = labels[a]
+
+    linked_a = []
+    linked_b = []
+    order = np.argsort(component, kind="stable")
+    bounds = np.flatnonzero(np.diff(component[order])) + 1
+    for group in np.split(order, bounds):
+        rows, row_index = np.unique(a[group], return_inverse=True)
+        cols, col_index = np.unique(b[group], return_inverse=True)
+        n_rows, n_cols = len(rows), len(cols)
+        if len(group) == 1:
+            linked_a.append(rows)
+            linked_b.append(cols)
+            continue
+        # 右上と左下に「つながない」を置いた (n_rows + n_cols) 四方の行列
+        size = n_rows + n_cols
+        big = gate_cost * 10 + 1.0
+        matrix = np.full((size, size), big)
+        matrix[row_index, col_index] = cost[group]
+        matrix[:n_rows, n_cols:] = np.where(np.eye(n_rows, dtype=bool), gate_cost, big)
+        matrix[n_rows:, :n_cols] = np.where(np.eye(n_cols, dtype=bool), gate_cost, big)
+        matrix[n_rows:, n_cols:] = 0.0
+        row_ind, col_ind = linear_sum_assignment(matrix)
+        chosen = (row_ind < n_rows) & (col_ind < n_cols)
+        chosen &= matrix[row_ind, col_ind] < big
+        linked_a.append(rows[row_ind[chosen]])
+        linked_b.append(cols[col_ind[chosen]])
+    return np.concatenate(linked_a), np.concatenate(linked_b)
+
+
+def stitch_tracks(observations, max_gap=30, gate=0.03, gate_per_frame=0.004, velocity_frames=5):
+    """
+    IDの入れ替わりをつないだ Observations と，(元のID, つないだ先のID, 間のフレーム数) のリストを返す．
+    つながった軌跡には最初のフラグメントのIDを使う
+    """
+    if len(observations) == 0:
+        return observations, []
+    fragments = track_fragments(observations, velocity_frames)
+    a, b, cost = candidate_links(fragments, max_gap, gate, gate_per_frame)
+    gate_cost = gate + gate_per_frame * max_gap
+    linked_a, linked_b = solve_links(len(fragments["id"]), a, b, cost, gate_cost)
+
+    # 後のフラグメントから前のフラグメントへたどり，つながりの先頭のIDにする
+    previous = np.arange(len(fragments["id"]))
+    previous[linked_b] = linked_a
+    root = previous.copy()
+    while True:
+        next_root = previous[root]
+        if np.array_equal(next_root, root):
+            break
+        root = next_root
+
+    stable_ids = fragments["id"][root]
+    index = np.searchsorted(fragments["id"], observations.player_id)
+    stitched = observations.take(slice(None))
+    stitched.player_id = stable_ids[index].astype(np.int32)
+    links = [
+        (observations.id_name(int(fragments["id"][j])), observations.id_name(int(fragments["id"][i])),
+         int(fragments["start_frame"][j] - fragments["end_frame"][i] - 1))
+        for i, j in sorted(zip(linked_a.tolist(), linked_b.tolist()), key=lambda pair: fragments["end_frame"][pair[0]])
+    ]
+    return stitched, links
+
+
+if __name__ == "__main__":
+    csv_file = "../data/transform/transformed_player_points.csv"
+
+    observations = Observations.from_csv(csv_file)
+    stitched, links = stitch_tracks(observations)
+    n_before = len(np.unique(observations.player_id))
+    n_after = len(np.unique(stitched.player_id))
+    print(f"{len(links)}か所をつなぎ，IDの数が {n_before} から {n_after} になりました。")
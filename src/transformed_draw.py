@@ -3,14 +3,14 @@
 攻撃方向から防御選手のみを描画する
 """
 # -*- coding: utf-8 -*-
-import pandas as pd
-import matplotlib.pyplot as plt
 import tkinter as tk
 from tkinter import filedialog
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.image as mpimg
 import numpy as np  
 
+from court_zones import get_zone_grid
+from observation_pages import PagedObservations
+from observations import CANONICAL_SIDE, DIRECTION_NAMES, decode
+
 
 class TrajectoryViewerWithFormation:
     def __init__(self, root):
@@ -94,23 +94,66 @@ class TrajectoryViewerWithFormation:
     def load_csv(self):
         self.file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
         if self.file_path:
-            self.df = pd.read_csv(self.file_path)
-            print("CSV読み込み完了")
+            # オフセットは読み込み時に適用する．全体の読み込みは別スレッドで行い，
+            # それまでは表示するフレーム範囲だけをCSV（またはバイナリキャッシュ）から読む
+            self.pages = PagedObservations(
+                self.file_path,
+                (self.RED_X_OFFSET, self.RED_Y_OFFSET),
+                (self.WHITE_X_OFFSET, self.WHITE_Y_OFFSET),
+            )
+            # インデックスの走査は別スレッドで行われるので，終わるまでメインループから確認する
+            self.wait_for_index(self.pages)
+
+    def wait_for_index(self, pages):
+        """インデックスの走査が終わったら最初のフレームを表示し，全体の読み込みを始める"""
+        if pages is not self.pages:
+            return
+        if not (pages.loaded or pages.index.ready):
+            self.root.after(50, self.wait_for_index, pages)
+            return
+
+        if pages.loaded:
+            print("CSV読み込み完了（キャッシュ）")
+        else:
+            pages.load_all_in_background()
+            # フレーム番号が昇順でないCSVは，全体を読み終わってから表示する
+            self.root.after(200, self.wait_for_loading, pages, not pages.ready)
+        if pages.ready:
+            self.show_first_frame(pages)
+
+    def show_first_frame(self, pages):
+        min_frame, max_frame = pages.frame_bounds
+        if min_frame is None:
+            return
+
+        self.min_frame = min_frame
+        self.max_frame = max_frame
 
-            self.min_frame = self.df["frame_num"].min()
-            self.max_frame = self.df["frame_num"].max()
+        # Update start and current frame UI
+        self.start_frame_entry.delete(0, tk.END)
+        self.start_frame_entry.insert(0, str(self.min_frame))
 
-            # Update start and current frame UI
-            self.start_frame_entry.delete(0, tk.END)
-            self.start_frame_entry.insert(0, str(self.min_frame))
+        self.current_frame_entry.delete(0, tk.END)
+        self.current_frame_entry.insert(0, str(self.min_frame))
 
-            self.current_frame_entry.delete(0, tk.END)
-            self.current_frame_entry.insert(0, str(self.min_frame))
+        self.load_court_images()
+        self.update_plot()
 
-            self.load_court_images()
-            self.update_plot()
+    def wait_for_loading(self, pages, show_when_loaded=False):
+        """全体の読み込みが終わるまで Tk のメインループから定期的に確認する"""
+        if pages is not self.pages:
+            return
+        if pages.loaded:
+            print("CSV読み込み完了")
+            if show_when_loaded:
+                self.show_first_frame(pages)
+        else:
+            self.root.after(200, self.wait_for_loading, pages, show_when_loaded)
 
     def load_court_images(self):
+        # matplotlib は読み込みに時間がかかるので，ウィンドウを出した後で必要になったときに読み込む
+        import matplotlib.image as mpimg
+
         try:
             self.right_court_image = mpimg.imread(self.right_court_image_path)
             self.left_court_image = mpimg.imread(self.left_court_image_path)
@@ -120,7 +163,8 @@ class TrajectoryViewerWithFormation:
 
     def update_plot(self, event=None):
         """現在のフレーム範囲に応じてコートと選手軌跡を描画"""
-        if not hasattr(self, 'df'):
+        # インデックスの走査中や全体の読み込み待ちのときは描画しない（メインスレッドで待たない）
+        if not hasattr(self, 'pages') or not self.pages.ready:
             return
 
         try:
@@ -135,81 +179,38 @@ class TrajectoryViewerWithFormation:
             return
 
         # フレーム範囲のデータを取得 (指定した開始フレームから現在のフレームまで)
-        df_filtered = self.df[(self.df["frame_num"] >= start_frame) & (self.df["frame_num"] <= current_frame)]
-        if df_filtered.empty:
+        filtered = self.pages.frame_range(start_frame, current_frame)
+        if len(filtered) == 0:
             print("指定されたフレーム範囲にデータがありません")
             return
 
         if self.figure is None:
-            self.figure = plt.Figure(figsize=(10, 6))
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+            self.figure = Figure(figsize=(10, 6))
             self.ax = self.figure.add_subplot(111)
             self.canvas = FigureCanvasTkAgg(self.figure, master=self.root)
             self.canvas.get_tk_widget().pack(fill="both", expand=True)
         else:
             self.ax.clear()
 
-        directions = df_filtered["direction"].unique()
+        # 方向は現在フレームの行から決める（範囲の途中で方向が変わっていてもよい）
+        current_rows = filtered.take(filtered.frame_num == current_frame)
+        direction = decode(int(current_rows.direction[0]), DIRECTION_NAMES) if len(current_rows) else None
 
-        if len(directions) == 1:
-            direction = directions[0]
+        # 現在フレームの防御選手（オフセット適用済み）
+        current = current_rows.take(current_rows.defender_mask())
 
+        if direction in ("right", "left"):
             if direction == "right" and self.right_court_image is not None:
                 self.ax.imshow(self.right_court_image, extent=[0, 1, 1, 0], aspect='auto')
             elif direction == "left" and self.left_court_image is not None:
                 self.ax.imshow(self.left_court_image, extent=[0, 1, 1, 0], aspect='auto')
 
-            # Use constants for offsets
-            x_offset = self.RED_X_OFFSET
-            y_offset = self.RED_Y_OFFSET
-            white_x_offset = self.WHITE_X_OFFSET
-            white_y_offset = self.WHITE_Y_OFFSET
-
-            # フレームごとに選手の位置をプロット(移動軌跡を描画)
-            # for frame in range(start_frame, current_frame + 1):
-            #     frame_data = df_filtered[df_filtered["frame_num"] == frame]
-            #     for _, person_data in frame_data.iterrows():
-            #         x, y = person_data["x"], person_data["y"]
-            #         team_color = person_data["team_color"]
-
-            #         # Redチームの場合、座標にオフセットを適用
-            #         if team_color == "red":
-            #             x += x_offset
-            #             y += y_offset
-
-            #         # Whiteチームの場合、座標にオフセットを適用
-            #         if team_color == "white":
-            #             x += white_x_offset
-            #             y += white_y_offset
-                    
-            #         # 防御選手のみを描画
-            #         if (direction == "left" and team_color != "white") or (direction == "right" and team_color != "red"):
-            #             continue
-
-            #         # フレームが離れるほど透明度を上げる
-            #         alpha = max(0.1, 1.0 - (current_frame - frame) / (current_frame - start_frame + 1))
-            #         color = "black" if frame == current_frame else "gray"
-
-            #         # 選手の位置をプロット
-            #         self.ax.scatter(x, y, color=color, alpha=alpha, s=50)
-
-            # 現在フレームの選手の位置だけをプロット
-            frame_data = df_filtered[df_filtered["frame_num"] == current_frame]
-            for _, person_data in frame_data.iterrows():
-                x, y = person_data["x"], person_data["y"]
-                team_color = person_data["team_color"]
-
-                if team_color == "red":
-                    x += x_offset
-                    y += y_offset
-                elif team_color == "white":
-                    x += white_x_offset
-                    y += white_y_offset
-
-                # 防御選手のみを描画
-                if (direction == "left" and team_color != "white") or (direction == "right" and team_color != "red"):
-                    continue
-
-                self.ax.scatter(x, y, color="black", alpha=1.0, s=50)
+            # 現在フレームの防御選手の位置だけをまとめてプロット
+            if len(current):
+                self.ax.scatter(current.x, current.y, color="black", alpha=1.0, s=50)
 
         self.ax.set_xlabel("X")
         self.ax.set_ylabel("Y")
@@ -220,36 +221,17 @@ class TrajectoryViewerWithFormation:
         self.canvas.draw()
 
         # === フォーメーション推定 ===
-        formation = "Unknown"
-        frame_data = df_filtered[df_filtered["frame_num"] == current_frame]
-        defender_team = "red" if direction == "right" else "white"
-
-        # オフセット適用 + 防御側選手だけ抽出
-        defenders = []
-        for _, row in frame_data.iterrows():
-            if row["team_color"] != defender_team:
-                continue
-            x, y = row["x"], row["y"]
-            if defender_team == "red":
-                x += self.RED_X_OFFSET
-                y += self.RED_Y_OFFSET
-            else:
-                x += self.WHITE_X_OFFSET
-                y += self.WHITE_Y_OFFSET
-            defenders.append((x, y))
-
         # 防御選手が6人以上いない場合はフォーメーション推定を行わない
-        if len(defenders) < 6:
+        if len(current) < 6:
             self.formation_label.config(text="フォーメーション: 推定不可")
             return
 
         # 中央ゾーンにいる防御選手のカウント
+        formation = "Unknown"
         red_count = 0
-        for x, y in defenders:
-            if direction == "right" and (0.4 < x < 0.55) and (0.2 < y < 0.8):
-                red_count += 1
-            elif direction == "left" and (0.45 < x < 0.6) and (0.2 < y < 0.8):
-                red_count += 1
+        if direction in ("right", "left"):
+            # 描画は元の座標，判定は正準座標で行う
+            red_count = int(get_zone_grid(CANONICAL_SIDE).contains("outer_box", current.canonical_x, current.y).sum())
 
         if red_count == 0:
             formation = "0-6"
@@ -0,0 +1,162 @@
+"""
+試合映像のフレームを別スレッドで先読みするモジュールです．
+cv2.VideoCapture のデコードを使う側のスレッドで行うと，デコードの間は処理が止まってしまうので，
+デコード用のスレッドが buffer_size 枚分の確保済みの配列（リングバッファ）に先にフレームを書き込み，
+使う側はそれを順に受け取ります．配列は使い回すので，フレームごとのメモリ確保はありません．
+リングバッファは read_range を呼ぶたびに作るので，1つの VideoFrameReader で同時に複数の範囲を読めます．
+
+選手検出，フォーメーションを重ねた映像の書き出し，フェーズの開始フレームの切り出しなど，
+映像を読む処理はすべて VideoFrameReader を通して読みます．
+"""
+
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+def video_info(video_path):
+    """映像の fps，フレーム数，幅，高さの辞書を返す"""
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise OSError(f"動画を開けませんでした: {video_path}")
+    try:
+        return {
+            "fps": cap.get(cv2.CAP_PROP_FPS),
+            "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        }
+    finally:
+        cap.release()
+
+
+class VideoFrameReader:
+    def __init__(self, video_path, buffer_size=16):
+        self.video_path = video_path
+        self.buffer_size = buffer_size
+        info = video_info(video_path)
+        self.fps = info["fps"]
+        self.frame_count = info["frame_count"]
+        self.width = info["width"]
+        self.height = info["height"]
+        # 全ての read_range を合わせたデコードの統計
+        self.decoded_frames = 0
+        self.decode_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def decode_fps(self):
+        """デコード用のスレッドが実際にデコードに使った時間あたりのフレーム数"""
+        return self.decoded_frames / self.decode_seconds if self.decode_seconds > 0 else 0.0
+
+    def __iter__(self):
+        return self.read_range()
+
+    def read_range(self, start_frame=0, end_frame=None, step=1, copy=False):
+        """
+        start_frame から end_frame（含む）まで step フレームおきに (frame_num, フレーム) を順に返す．
+        フレームはリングバッファの配列なので，次のフレームを受け取るまでしか使えない．
+        それより長く持つときは copy=True にするか，使う側でコピーする．
+        リングバッファはこの呼び出し専用なので，同じ reader の別の read_range と同時に使ってよい
+        """
+        if end_frame is None or end_frame >= self.frame_count:
+            end_frame = self.frame_count - 1
+        # デコード先の配列．返すフレームはこのどれかへのビュー
+        slots = np.empty((self.buffer_size, self.height, self.width, 3), dtype=np.uint8)
+        free = queue.Queue()
+        for slot in range(self.buffer_size):
+            free.put(slot)
+        ready = queue.Queue()
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._decode, args=(start_frame, end_frame, step, slots, free, ready, stop), daemon=True
+        )
+        thread.start()
+
+        previous = None
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                # 使い終わった前のフレームの配列をデコード用のスレッドに返す
+                if previous is not None:
+                    free.put(previous)
+                frame_num, slot, frame = item
+                previous = slot
+                yield frame_num, frame.copy() if copy else frame
+        finally:
+            stop.set()
+            # free.get() で待っているデコード用のスレッドを起こす
+            free.put(None)
+            thread.join()
+
+    def _decode(self, start_frame, end_frame, step, slots, free, ready, stop):
+        import cv2
+
+        decoded_frames = 0
+        decode_seconds = 0.0
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            if start_frame > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            frame_num = start_frame
+            while frame_num <= end_frame and not stop.is_set():
+                slot = free.get()
+                if slot is None or stop.is_set():
+                    break
+                start_time = time.perf_counter()
+                ok, frame = cap.read(slots[slot])
+                # 間のフレームはデコードせずに読み飛ばす
+                for _ in range(step - 1):
+                    cap.grab()
+                decode_seconds += time.perf_counter() - start_time
+                if not ok:
+                    break
+                decoded_frames += 1
+                ready.put((frame_num, slot, frame))
+                frame_num += step
+        except Exception as error:
+            ready.put(error)
+        finally:
+            cap.release()
+            with self._stats_lock:
+                self.decoded_frames += decoded_frames
+                self.decode_seconds += decode_seconds
+            ready.put(None)
+
+
+def save_phase_frames(video_path, phases, output_dir, buffer_size=4):
+    """防御フェーズ (開始フレーム, 終了フレーム, ...) ごとに開始フレームの画像を保存し，保存したパスのリストを返す"""
+    import cv2
+
+    os.makedirs(output_dir, exist_ok=True)
+    reader = VideoFrameReader(video_path, buffer_size)
+    paths = []
+    for phase in sorted(phases):
+        start_frame = phase[0]
+        for frame_num, frame in reader.read_range(start_frame, start_frame):
+            path = os.path.join(output_dir, f"phase_{frame_num:06d}.jpg")
+            cv2.imwrite(path, frame)
+            paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    video_path = "../data/video/match.mp4"
+
+    reader = VideoFrameReader(video_path)
+    start_time = time.time()
+    n_frames = 0
+    for frame_num, frame in reader:
+        n_frames += 1
+    elapsed = time.time() - start_time
+    print(f"{n_frames} フレームを {elapsed:.2f} 秒で読みました（{n_frames / elapsed:.1f} fps）。")
+    print(f"デコード: {reader.decode_fps:.1f} fps（映像は {reader.fps:.1f} fps）")
@@ -1,7 +1,8 @@
-import cv2
 import tkinter as tk
 from tkinter import filedialog
 
+from video_frames import video_info
+
 def select_video():
     path = filedialog.askopenfilename(filetypes=[("Video files", "*.mp4 *.avi *.mov *.mkv")])
     if path:
@@ -20,17 +21,17 @@ def calculate_frame():
         result_label.config(text="時間を正しく入力してください（数字）")
         return
 
-    cap = cv2.VideoCapture(path)
-    if not cap.isOpened():
+    try:
+        info = video_info(path)
+    except OSError:
         result_label.config(text="動画を開けませんでした")
         return
 
-    fps = cap.get(cv2.CAP_PROP_FPS)
+    fps = info["fps"]
     total_time_sec = minutes * 60 + seconds
     frame_number = int(fps * total_time_sec)
 
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    cap.release()
+    total_frames = info["frame_count"]
 
     if frame_number >= total_frames:
         result_label.config(text=f"指定時間は動画の長さを超えています（最大 {total_frames-1} フレーム）")
@@ -0,0 +1,45 @@
+import csv
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+def write_tracking_csv(path, n_frames=1500, seed=0):
+    """
+    direction が何度も切り替わる試合の追跡データのCSVを作る．
+    選手IDは試合を通して同じで，防御選手は9mラインのあたりを行き来する
+    """
+    rng = np.random.default_rng(seed)
+    directions = []
+    while len(directions) < n_frames:
+        side = "right" if len(directions) % 2 == 0 or rng.random() < 0.3 else "left"
+        directions += [side] * int(rng.integers(60, 300))
+    directions = directions[:n_frames]
+
+    # 正準座標（right）でのゴールからの距離[m]と，y
+    distance = rng.uniform(7.0, 11.0, 12)
+    y = rng.uniform(0.25, 0.75, 12)
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["frame_num", "id", "team_color", "x", "y", "direction"])
+        for frame_num, direction in enumerate(directions, start=1):
+            distance = np.clip(distance + rng.normal(0.0, 0.3, 12), 5.0, 13.0)
+            y = np.clip(y + rng.normal(0.0, 0.005, 12), 0.1, 0.9)
+            x = 1.0 - distance * 0.048
+            for player_id in range(12):
+                team = "red" if player_id < 6 else "white"
+                px = x[player_id] if direction == "right" else 1.0 - x[player_id]
+                # 読み込み時のチームごとのオフセットを打ち消しておく
+                px -= 0.1 if team == "red" else 0.06
+                py = y[player_id] + (0.1 if team == "red" else 0.0)
+                writer.writerow([frame_num, player_id, team, px, py, direction])
+    return path
+
+
+@pytest.fixture(params=[0, 1, 2])
+def tracking_csv(request, tmp_path):
+    return str(write_tracking_csv(tmp_path / f"track_{request.param}.csv", seed=request.param))
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from court_zones import BOX_ZONES, get_zone_grid, zone_masks
+
+
+def near(values):
+    """各値と，float32 でその前後の値"""
+    values = np.asarray(values, dtype=np.float32)
+    return np.concatenate([np.nextafter(values, np.float32(-1)), values, np.nextafter(values, np.float32(2))])
+
+
+@pytest.mark.parametrize("side", ["right", "left"])
+def test_box_zones_match_strict_test_on_edges(side):
+    edges_x = near([0.4, 0.45, 0.55, 0.6])
+    edges_y = near([0.2, 0.5, 0.8])
+    x, y = (grid.ravel() for grid in np.meshgrid(edges_x, edges_y))
+    grid = get_zone_grid(side)
+    expected = zone_masks(x, y, side)
+    for zone in BOX_ZONES:
+        np.testing.assert_array_equal(grid.contains(zone, x, y), expected[zone], err_msg=zone)
+
+
+def test_grid_matches_direct_masks_away_from_edges():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0.0, 1.0, 20000).astype(np.float32)
+    y = rng.uniform(0.0, 1.0, 20000).astype(np.float32)
+    grid = get_zone_grid("right")
+    expected = zone_masks(x, y, "right")
+    for zone in BOX_ZONES:
+        np.testing.assert_array_equal(grid.contains(zone, x, y), expected[zone])
+    # 曲線のゾーンはセルの大きさの分だけ食い違うことがある
+    for zone in ("6m_area", "9m_band", "center"):
+        assert np.mean(grid.contains(zone, x, y) != expected[zone]) < 0.01, zone
+
+
+@pytest.mark.parametrize("side", ["right", "left"])
+def test_distance_field_matches_exact_distance(side):
+    from court_zones import get_distance_field, goal_line_distance
+
+    rng = np.random.default_rng(1)
+    x = rng.uniform(0.0, 1.0, 5000)
+    y = rng.uniform(0.0, 1.0, 5000)
+    field = get_distance_field(side)
+    # 格子の間隔 0.005 は約 0.1m
+    np.testing.assert_allclose(field.sample(x, y), goal_line_distance(x, y, side), atol=0.05)
+    np.testing.assert_allclose(field.distance_to_line(x, y, 9.0), field.sample(x, y) - 9.0)
+
+
+def test_hysteresis_keeps_state_inside_margin_and_restarts_per_group():
+    from court_zones import hysteresis_states
+
+    values = np.array([0.0, 0.6, 0.2, -0.2, -0.6, 0.3, 0.8, 0.1])
+    groups = np.array([0, 0, 0, 0, 0, 0, 1, 1])
+    np.testing.assert_array_equal(
+        hysteresis_states(values, groups, 0.5, 0.5),
+        [False, True, True, True, False, False, True, True],
+    )
+    np.testing.assert_array_equal(
+        hysteresis_states(np.array([0.1, 0.1]), np.array([0, 1]), initial=True), [True, True],
+    )
+
+
+def test_distance_mode_flags_follow_nine_metre_line(tracking_csv):
+    from court_zones import get_distance_field
+    from formation_classification_9mline_latest import FormationClassifier
+
+    classifier = FormationClassifier(tracking_csv, zone_mode="distance")
+    obs = classifier.observations.canonical()
+    distance = get_distance_field("right").distance_to_line(obs.x, obs.y, 9.0)
+    outer = classifier._zone_flags("outer_9m")
+    returned = classifier._zone_flags("returned_9m")
+    # 外側と判定するのは 9m ラインより enter_margin 以上外に出てから，帯の幅の中だけ
+    assert np.all(distance[outer] > -classifier.exit_margin)
+    assert np.all(distance[outer] <= classifier.band_width)
+    assert np.all(outer[(distance > classifier.enter_margin) & (distance <= classifier.band_width)])
+    np.testing.assert_array_equal(returned, distance < -classifier.exit_margin)
+    assert not np.any(outer & returned)
@@ -0,0 +1,48 @@
+import numpy as np
+
+from direction_estimator import (
+    DirectionEstimator, apply_estimated_directions, estimate_directions, frame_scores, with_estimated_directions,
+)
+from observations import DIRECTION_NAMES, LEFT, RIGHT, UNKNOWN, Observations
+from online_classifier import iter_tracking_frames
+
+
+def test_streaming_matches_batch(tracking_csv):
+    observations = Observations.from_csv(tracking_csv)
+    _, scores = frame_scores(observations)
+    expected = estimate_directions(scores)
+
+    estimator = DirectionEstimator()
+    assert [estimator.push_score(score) for score in scores] == expected.tolist()
+
+    streamed = [DIRECTION_NAMES.index(key[1]) for key, _, _ in with_estimated_directions(
+        iter_tracking_frames(tracking_csv))]
+    assert streamed == expected.tolist()
+
+
+def test_short_flip_does_not_switch_direction():
+    scores = np.r_[np.full(100, 0.2), np.full(29, -0.2), np.full(100, 0.2), np.full(40, -0.2)]
+    directions = estimate_directions(scores, min_dwell=30)
+    assert (directions[:229] == RIGHT).all()
+    # 30フレーム続いた時点で切り替わり，backdate なら最初のフレームまでさかのぼる
+    assert (directions[229:258] == RIGHT).all() and (directions[258:] == LEFT).all()
+    backdated = estimate_directions(scores, min_dwell=30, backdate=True)
+    assert (backdated[:229] == RIGHT).all() and (backdated[229:] == LEFT).all()
+    assert (estimate_directions(np.zeros(10)) == UNKNOWN).all()
+
+
+def test_override_repairs_corrupted_direction_column(tracking_csv):
+    observations = Observations.from_csv(tracking_csv)
+    repaired, _ = apply_estimated_directions(observations)
+    # 推定は座標だけから求めるので，direction 列のほとんどと一致する
+    assert np.mean(repaired.direction == observations.direction) > 0.8
+
+    # direction 列の一部を反転させても，置き換えた結果は変わらず，食い違いとして報告される
+    corrupted = observations.take(slice(None))
+    block = (corrupted.frame_num >= 700) & (corrupted.frame_num < 720)
+    corrupted.direction = np.where(block, 1 - corrupted.direction, corrupted.direction).astype(np.int8)
+    corrupted = corrupted.sorted()
+    fixed, mismatches = apply_estimated_directions(corrupted)
+    np.testing.assert_array_equal(fixed.direction, repaired.direction)
+    np.testing.assert_array_equal(fixed.frame_num, repaired.frame_num)
+    assert any(start <= 700 and 719 <= end for start, end, _ in mismatches)
@@ -0,0 +1,37 @@
+from formation_classification_9mline_latest import FormationClassifier
+from formation_rle import FormationRLE
+
+
+def test_rle_matches_per_frame_results(tracking_csv, tmp_path):
+    classifier = FormationClassifier(tracking_csv)
+    classified_formations = classifier.classify_formations()
+    rle = classifier.classify_formations_rle()
+    assert len(rle) < len(classified_formations)
+    assert list(rle.iter_frames()) == classified_formations
+
+    phases = classifier.detect_defense_phases()
+    assert classifier.get_dominant_formations_from_rle(rle, phases) == \
+        classifier.get_dominant_formations_by_defense_phase(classified_formations, phases)
+
+    path = str(tmp_path / "rle.npz")
+    rle.save(path)
+    loaded = FormationRLE.load(path)
+    assert list(loaded.iter_frames()) == classified_formations
+    assert loaded.total_counts() == rle.total_counts()
+
+
+def test_query_counts_partial_runs():
+    rle = FormationRLE()
+    for frame_num in range(10):
+        rle.append(frame_num, "right", "1--5" if frame_num < 6 else "2--4", 0.5)
+    for frame_num in range(20, 25):
+        rle.append(frame_num, "left", "0--6", 1.0)
+    counts, confidences = rle.query(4, 21)
+    assert counts == {"1--5": 2, "2--4": 4, "0--6": 2}
+    assert confidences["2--4"] == 2.0
+    counts, _ = rle.query(4, 21, "left")
+    assert counts == {"0--6": 2}
+
+    # 終わったランだけを捨てる
+    assert rle.discard_before(8) == 1
+    assert rle.query(0, 30)[0] == {"2--4": 4, "0--6": 5}
@@ -0,0 +1,36 @@
+from formation_classification_9mline_latest import FormationClassifier
+from incremental_pipeline import IncrementalClassifier
+from result_cache import ResultCache
+
+
+def test_incremental_matches_full_run_in_distance_mode(tracking_csv, tmp_path):
+    classifier = FormationClassifier(tracking_csv, zone_mode="distance")
+    expected = (classifier.classify_formations(), classifier.detect_defense_phases())
+    incremental = IncrementalClassifier(str(tmp_path / "chunks"), zone_mode="distance")
+    assert incremental.run(classifier.observations) == expected
+    # 2回目はキャッシュから読んでも同じ
+    assert incremental.run(classifier.observations) == expected
+    assert incremental.stats["recomputed"] == 0
+
+
+def test_local_edit_recomputes_only_its_chunk(tracking_csv, tmp_path, monkeypatch):
+    import result_cache
+
+    observations = FormationClassifier(tracking_csv).observations
+    cache = ResultCache(str(tmp_path / "results"))
+    incremental = IncrementalClassifier(cache=cache)
+    incremental.run(observations)
+    n_chunks = incremental.stats["chunks"]
+
+    # 1つのチャンクの中の座標だけを直す
+    edited = observations.take(slice(None))
+    edited.x = observations.x.copy()
+    edited.x[len(edited) // 2] += 0.01
+    expected = FormationClassifier(None, observations=edited)
+    assert incremental.run(edited) == (expected.classify_formations(), expected.detect_defense_phases())
+    assert incremental.stats == {"chunks": n_chunks, "recomputed": 1}
+
+    # 分類の処理のバージョンが変われば全て計算し直す
+    monkeypatch.setattr(result_cache, "CACHE_VERSION", result_cache.CACHE_VERSION + "-next")
+    incremental.run(edited)
+    assert incremental.stats["recomputed"] == n_chunks
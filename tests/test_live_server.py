@@ -0,0 +1,59 @@
+import asyncio
+import json
+import os
+
+from live_server import DEFAULT_HOST, LiveFormationServer, encode_frame, read_frame
+from online_classifier import classify_windowed, iter_tracking_frames
+
+
+async def request(port, lines):
+    reader, writer = await asyncio.open_connection(DEFAULT_HOST, port)
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    await writer.drain()
+    return reader, writer
+
+
+def test_replay_counts_frames_and_keeps_history(tracking_csv):
+    live = LiveFormationServer(history_size=1000, breakdown_window=10 ** 6)
+    asyncio.run(live.replay(iter_tracking_frames(tracking_csv), fps=None))
+
+    n_frames = sum(1 for _ in iter_tracking_frames(tracking_csv))
+    assert live.frames_processed == n_frames
+    # flush で最後のフレームを二重に数えない
+    assert sum(live.recent_counts.values()) == n_frames
+    assert list(live.history) == list(classify_windowed(tracking_csv))
+
+
+def test_server_binds_localhost_and_rejects_websocket_without_key(tracking_csv):
+    async def run():
+        live = LiveFormationServer()
+        server = await live.start(port=0)
+        host, port = server.sockets[0].getsockname()[:2]
+        assert host == DEFAULT_HOST == "127.0.0.1"
+
+        reader, writer = await request(port, [
+            "GET /ws HTTP/1.1", f"Host: {host}:{port}", "Upgrade: websocket", "Connection: Upgrade",
+        ])
+        bad = await reader.read()
+        writer.close()
+
+        # 正しい WebSocket のクライアントは状態を受け取れる
+        reader, writer = await request(port, [
+            "GET /ws HTTP/1.1", f"Host: {host}:{port}", "Upgrade: websocket", "Connection: Upgrade",
+            f"Sec-WebSocket-Key: {os.urandom(16).hex()[:22]}==", "Sec-WebSocket-Version: 13",
+        ])
+        status = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        _, payload = await read_frame(reader)
+        await live.replay(iter_tracking_frames(tracking_csv), fps=None)
+        writer.write(encode_frame(b"", opcode=0x8, mask=os.urandom(4)))
+        await writer.drain()
+        await live.stop()
+        writer.close()
+        return bad, status, json.loads(payload)
+
+    bad, status, state = asyncio.run(run())
+    assert bad.startswith(b"HTTP/1.1 400 Bad Request")
+    assert status.startswith(b"HTTP/1.1 101")
+    assert state["frame_num"] is None
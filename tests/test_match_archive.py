@@ -0,0 +1,45 @@
+from collections import Counter
+
+from formation_classification_9mline_latest import FormationClassifier
+from match_archive import MatchArchive, parse_breakdown
+
+
+def test_archive_round_trips_classifier_output(tracking_csv, tmp_path):
+    classifier = FormationClassifier(tracking_csv)
+    classified_formations = classifier.classify_formations()
+    rle = classifier.classify_formations_rle()
+    phases = classifier.detect_defense_phases()
+    dominant_formations = classifier.get_dominant_formations_by_defense_phase(classified_formations, phases)
+
+    output_file = str(tmp_path / "formations_output.csv")
+    classifier.save_dominant_formations_by_defense_phase(dominant_formations, classified_formations, output_file)
+
+    with MatchArchive(str(tmp_path / "archive.sqlite3")) as archive:
+        archive.add_match_from_rle("rle", dominant_formations, rle, red_team="A", white_team="B")
+        archive.import_phase_csv("csv", output_file, red_team="A", white_team="B")
+        # 同じ名前で登録し直すと置き換わる
+        archive.import_phase_csv("csv", output_file, red_team="A", white_team="B")
+
+        for name in ("rle", "csv"):
+            rows = archive.phases(match=name)
+            assert [(start, end, formation, direction) for _, start, end, direction, _, formation, _ in rows] == \
+                [tuple(phase) for phase in dominant_formations]
+            assert [row[4] for row in rows] == ["A" if phase[3] == "right" else "B" for phase in dominant_formations]
+
+        expected = Counter(formation for _, _, formation, _ in dominant_formations)
+        assert archive.formation_counts() == Counter({k: 2 * v for k, v in expected.items()})
+
+        for start, end, _, direction in dominant_formations:
+            counts = Counter(f for frame, d, f, _ in classified_formations if start <= frame <= end and d == direction)
+            assert archive.frame_breakdown("rle", start, end, direction) == counts
+
+
+def test_transitions_and_breakdown_parsing(tmp_path):
+    with MatchArchive(str(tmp_path / "archive.sqlite3")) as archive:
+        phases = [(0, 99, "0--6", "right"), (200, 299, "1--5", "left"), (400, 499, "1--5", "right")]
+        breakdowns = [Counter({"0--6": 100}), Counter({"1--5": 100}), Counter({"1--5": 90, "2--4": 10})]
+        archive.add_match("m", phases, breakdowns)
+        assert archive.formation_transitions("red") == Counter({("0--6", "1--5"): 1})
+        assert [row[5] for row in archive.phases(team="white")] == ["1--5"]
+        assert archive.phases(formation="2--4") == []
+    assert parse_breakdown("0--6: 447, 1--5: 175, 2--4: 18") == {"0--6": 447, "1--5": 175, "2--4": 18}
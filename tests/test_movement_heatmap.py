@@ -0,0 +1,43 @@
+import numpy as np
+
+from court_zones import METER
+from formation_classification_9mline_latest import FormationClassifier
+from movement_heatmap import movement_by_phase, season_movement
+
+
+def naive_distance(observations, phases, max_step=3):
+    """フェーズ・チーム（防御 0，攻撃 1）ごとの移動距離を1行ずつ数える"""
+    totals = np.zeros((len(phases), 2))
+    rows = observations.to_attack_formations()
+    for p, (start, end, direction) in enumerate(phases):
+        defender_team = "red" if direction == "right" else "white"
+        last = {}
+        for frame_num in range(start, end + 1):
+            for x, y, team, player_id in rows.get((frame_num, direction), []):
+                previous = last.get(player_id)
+                if previous is not None and frame_num - previous[0] <= max_step:
+                    t = 0 if team == defender_team else 1
+                    totals[p, t] += np.hypot(np.float32(x) - np.float32(previous[1]),
+                                             np.float32(y) - np.float32(previous[2])) / METER
+                last[player_id] = (frame_num, x, y)
+    return totals
+
+
+def test_movement_matches_naive_sum(tracking_csv):
+    classifier = FormationClassifier(tracking_csv)
+    phases = classifier.detect_defense_phases()
+    result = movement_by_phase(classifier.observations, phases)
+    np.testing.assert_allclose(result["total_distance"], naive_distance(classifier.observations, phases), rtol=1e-4)
+    np.testing.assert_allclose(result["heatmap"].sum(axis=(2, 3)), result["total_distance"], rtol=1e-4)
+    assert np.all(result["zone_totals"].sum(axis=2) <= result["total_distance"] + 1e-6)
+    assert np.all(result["mean_speed"] >= 0)
+
+
+def test_season_keeps_matches_apart(tracking_csv):
+    classifier = FormationClassifier(tracking_csv)
+    phases = classifier.detect_defense_phases()
+    single = movement_by_phase(classifier.observations, phases)
+    season, rows = season_movement([("a", classifier.observations, phases), ("b", classifier.observations, phases)])
+    assert [row[0] for row in rows] == ["a"] * len(phases) + ["b"] * len(phases)
+    np.testing.assert_allclose(season["total_distance"][:len(phases)], single["total_distance"], rtol=1e-6)
+    np.testing.assert_allclose(season["total_distance"][len(phases):], single["total_distance"], rtol=1e-6)
@@ -0,0 +1,101 @@
+import csv
+import threading
+
+import numpy as np
+
+import observation_pages
+from observation_pages import FrameIndex, PagedObservations, _line_frames
+from observations import Observations
+
+
+def assert_same_observations(actual, expected):
+    for name in Observations.FIELDS:
+        np.testing.assert_array_equal(getattr(actual, name), getattr(expected, name))
+
+
+def test_paged_ranges_match_full_load(tracking_csv, tmp_path, monkeypatch):
+    # 小さいブロックで走査して，ブロックの境目をまたぐ行も確かめる
+    monkeypatch.setattr(observation_pages, "SCAN_BYTES", 4096)
+    pages = PagedObservations(tracking_csv, cache_root=str(tmp_path / "cache"))
+    full = Observations.from_csv(tracking_csv)
+    assert pages.index.is_sorted
+    assert pages.frame_bounds == (int(full.frame_num[0]), int(full.frame_num[-1]))
+    for start_frame, end_frame in ((1, 100), (250, 251), (777, 1300), (1490, 2000), (3000, 3100)):
+        mask = (full.frame_num >= start_frame) & (full.frame_num <= end_frame)
+        assert_same_observations(pages.frame_range(start_frame, end_frame), full.take(mask))
+    assert not pages.loaded
+
+
+def test_unsorted_csv_falls_back_to_full_load(tmp_path):
+    csv_file = tmp_path / "unsorted.csv"
+    with open(csv_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["frame_num", "id", "team_color", "x", "y", "direction"])
+        for frame_num in (1, 2, 5, 3, 4, 6):
+            writer.writerow([frame_num, 0, "red", 0.5, 0.5, "right"])
+    pages = PagedObservations(str(csv_file), cache_root=str(tmp_path / "cache"))
+    assert not pages.index.is_sorted
+    assert pages.frame_bounds == (1, 6)
+    np.testing.assert_array_equal(pages.frame_range(3, 5).frame_num, [3, 4, 5])
+    assert pages.loaded
+
+
+def test_string_ids_share_codes_across_pages(tmp_path):
+    csv_file = tmp_path / "names.csv"
+    with open(csv_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["frame_num", "id", "team_color", "x", "y", "direction"])
+        writer.writerow([1, "red_7", "red", 0.5, 0.5, "right"])
+        writer.writerow([2, "red_3", "red", 0.5, 0.5, "right"])
+        writer.writerow([2, "red_7", "red", 0.5, 0.5, "right"])
+    pages = PagedObservations(str(csv_file), cache_root=str(tmp_path / "cache"))
+    first = pages.frame_range(1, 1)
+    second = pages.frame_range(2, 2)
+    assert first.id_name(int(first.player_id[0])) == "red_7"
+    assert [second.id_name(code) for code in second.player_id.tolist()] == ["red_3", "red_7"]
+    assert second.player_id[1] == first.player_id[0]
+    full = pages.load_all()
+    assert full.player_id.tolist() == [first.player_id[0], *second.player_id.tolist()]
+
+
+def test_frame_column_anywhere_is_read_vectorized(tracking_csv, tmp_path):
+    # frame_num が先頭の列でなく，改行が CRLF でも，1行ずつ読んだ結果と同じになる
+    with open(tracking_csv, newline='') as file:
+        rows = list(csv.reader(file))
+    moved = tmp_path / "moved.csv"
+    with open(moved, 'w', newline='') as file:
+        writer = csv.writer(file, lineterminator="\r\n")
+        for row in rows:
+            writer.writerow(row[1:3] + row[:1] + row[3:])
+    block = moved.read_bytes().split(b"\n", 1)[1]
+    starts, values = _line_frames(block, 2)
+    expected = [int(line.split(b",")[2]) for line in block.splitlines()]
+    assert values.tolist() == expected
+    assert [block[start:].split(b",")[2] for start in starts[:5].tolist()] == [str(v).encode() for v in expected[:5]]
+
+    index = FrameIndex(str(moved))
+    original = FrameIndex(tracking_csv)
+    assert index.is_sorted
+    np.testing.assert_array_equal(index.frames, original.frames)
+
+
+def test_index_is_built_in_background(tracking_csv, tmp_path, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    build = FrameIndex.build
+
+    def slow_build(self):
+        started.set()
+        release.wait(10)
+        build(self)
+
+    monkeypatch.setattr(FrameIndex, "build", slow_build)
+    pages = PagedObservations(tracking_csv, cache_root=str(tmp_path / "cache"))
+    # 作った時点では走査が終わっていない（呼び出し側のスレッドでは走査しない）
+    assert started.wait(10)
+    assert not pages.ready and not pages.index.ready
+    release.set()
+    full = Observations.from_csv(tracking_csv)
+    assert pages.frame_bounds == (int(full.frame_num[0]), int(full.frame_num[-1]))
+    assert pages.ready and not pages.loaded
+    assert_same_observations(pages.frame_range(100, 200), full.take((full.frame_num >= 100) & (full.frame_num <= 200)))
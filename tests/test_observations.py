@@ -0,0 +1,86 @@
+import csv
+import sys
+
+import numpy as np
+
+from court_zones import box_masks, zone_masks
+from observations import LEFT, RIGHT, IdTable, Observations, mirror_x
+
+
+def assert_same_observations(actual, expected):
+    for name in Observations.FIELDS:
+        np.testing.assert_array_equal(getattr(actual, name), getattr(expected, name))
+    assert actual.id_names == expected.id_names
+
+
+def read_rows(csv_file):
+    with open(csv_file, 'r') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        return header, list(reader)
+
+
+def test_from_csv_matches_row_parser(tracking_csv):
+    # pandas での読み込みと csv モジュールでの読み込みは座標の丸めまで同じになる
+    observations = Observations.from_csv(tracking_csv)
+    assert_same_observations(observations, Observations.from_rows(*read_rows(tracking_csv)))
+    assert observations.content_hash() == Observations.from_rows(*read_rows(tracking_csv)).content_hash()
+
+
+def test_from_csv_without_pandas(tracking_csv, monkeypatch):
+    expected = Observations.from_csv(tracking_csv)
+    monkeypatch.setitem(sys.modules, "pandas", None)
+    assert_same_observations(Observations.from_csv(tracking_csv), expected)
+
+
+def test_from_csv_string_ids_share_id_table(tmp_path):
+    csv_file = tmp_path / "named.csv"
+    with open(csv_file, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["frame_num", "id", "team_color", "x", "y", "direction"])
+        writer.writerow([2, "b", "white", 0.2, 0.5, "left"])
+        writer.writerow([1, "a", "red", 0.4, 0.3, "right"])
+        writer.writerow([1, "c", "blue", 0.6, 0.7, "sideways"])
+
+    id_table = IdTable(["c"])
+    observations = Observations.from_csv(csv_file, id_table=id_table)
+    assert observations.frame_num.tolist() == [1, 1, 2]
+    assert [observations.id_names[i] for i in observations.player_id] == ["c", "a", "b"]
+    assert observations.team.tolist() == [-1, 0, 1]
+    assert observations.direction.tolist() == [-1, 1, 0]
+    assert id_table.names == ["c", "a", "b"]
+    assert_same_observations(Observations.from_rows(*read_rows(csv_file), id_table=IdTable(["c"])), observations)
+
+
+def test_canonical_mirrors_only_left_frames(tracking_csv):
+    observations = Observations.from_csv(tracking_csv)
+    canonical = observations.canonical()
+    left = observations.direction == LEFT
+    assert left.any() and (observations.direction == RIGHT).any()
+
+    np.testing.assert_array_equal(canonical.x[~left], observations.x[~left])
+    np.testing.assert_array_equal(canonical.x[left], np.float32(1.0) - observations.x[left])
+    # x 以外の列は元の配列を共有する
+    for name in ("frame_num", "player_id", "team", "direction", "y"):
+        assert np.shares_memory(getattr(canonical, name), getattr(observations, name))
+    # 2回反転すると元に戻る
+    np.testing.assert_allclose(mirror_x(canonical.x, canonical.direction), observations.x, atol=1e-7)
+
+
+def test_zone_flags_in_canonical_coordinates_match_per_side(tracking_csv):
+    observations = Observations.from_csv(tracking_csv)
+    left = observations.direction == LEFT
+    x, y = observations.x[left], observations.y[left]
+    canonical_x = observations.canonical_x[left]
+
+    direct = box_masks(x, y, "left")
+    for name, mask in box_masks(canonical_x, y, "right").items():
+        np.testing.assert_array_equal(mask, direct[name])
+
+    # 距離で決まるゾーンは同じで，攻撃側から見た左右だけが入れ替わる
+    direct = zone_masks(x, y, "left")
+    mirrored = zone_masks(canonical_x, y, "right")
+    for name in ("6m_area", "9m_band", "center", "outer_box", "returned"):
+        np.testing.assert_array_equal(mirrored[name], direct[name])
+    np.testing.assert_array_equal(mirrored["left"], direct["right"])
+    np.testing.assert_array_equal(mirrored["right"], direct["left"])
@@ -0,0 +1,20 @@
+from formation_classification_9mline_latest import FormationClassifier
+from online_classifier import OnlineFormationClassifier, classify_windowed, frame_from_positions, iter_tracking_frames
+
+
+def test_online_matches_batch_run(tracking_csv):
+    classifier = FormationClassifier(tracking_csv)
+    expected = classifier.detect_defense_phases()
+    online = [(record["start_frame"], record["end_frame"], record["direction"])
+              for record in classify_windowed(tracking_csv)]
+    assert online == expected
+
+
+def test_frames_from_positions_match_csv_frames(tracking_csv):
+    from_csv = OnlineFormationClassifier()
+    from_positions = OnlineFormationClassifier()
+    for key, frame in iter_tracking_frames(tracking_csv, block_rows=1000):
+        positions = frame.to_attack_formations()[key]
+        expected = from_csv.push_frame(key, frame)
+        assert from_positions.push_frame(key, frame_from_positions(key, positions)) == expected
+    assert from_positions.flush() == from_csv.flush()
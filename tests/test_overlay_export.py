@@ -0,0 +1,136 @@
+import sys
+import threading
+import types
+
+import numpy as np
+import pytest
+
+from formation_classification_9mline_latest import FormationClassifier
+from observations import DIRECTION_NAMES
+from overlay_export import MatchOverlay, export_overlay_video
+
+N_FRAMES = 300
+WIDTH, HEIGHT = 64, 48
+
+
+class FakeCapture:
+    """フレーム番号で塗りつぶしたフレームを返す cv2.VideoCapture の代わり"""
+
+    def __init__(self, path):
+        self.position = 0
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return {"fps": 30.0, "count": N_FRAMES, "width": WIDTH, "height": HEIGHT}[prop]
+
+    def set(self, prop, value):
+        self.position = int(value)
+
+    def read(self, image=None):
+        if self.position >= N_FRAMES:
+            return False, None
+        if image is None:
+            image = np.empty((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        image[...] = self.position % 256
+        self.position += 1
+        return True, image
+
+    def grab(self):
+        self.position += 1
+        return self.position <= N_FRAMES
+
+    def release(self):
+        pass
+
+
+class FakeWriter:
+    def __init__(self, path, fourcc, fps, size):
+        self.frames = []
+        FakeWriter.last = self
+
+    def isOpened(self):
+        return True
+
+    def write(self, frame):
+        self.frames.append(frame.copy())
+
+    def release(self):
+        pass
+
+
+@pytest.fixture
+def fake_cv2(monkeypatch):
+    # 描画は何もせず，フレームの左上の画素（映像のフレーム番号）ごとに書いた文字を記録する
+    texts = {}
+    lock = threading.Lock()
+
+    def put_text(frame, text, *args):
+        with lock:
+            texts.setdefault(int(frame[0, 0, 0]), []).append(text)
+
+    cv2 = types.SimpleNamespace(
+        VideoCapture=FakeCapture, VideoWriter=FakeWriter, VideoWriter_fourcc=lambda *chars: 0,
+        CAP_PROP_FPS="fps", CAP_PROP_FRAME_COUNT="count",
+        CAP_PROP_FRAME_WIDTH="width", CAP_PROP_FRAME_HEIGHT="height", CAP_PROP_POS_FRAMES="position",
+        imread=lambda path: np.zeros((40, 80, 3), dtype=np.uint8),
+        resize=lambda image, size, interpolation=None: np.full((size[1], size[0], 3), 255, dtype=np.uint8),
+        circle=lambda *args: None, rectangle=lambda *args: None, putText=put_text,
+        LINE_AA=16, INTER_AREA=3, FONT_HERSHEY_SIMPLEX=0,
+    )
+    monkeypatch.setitem(sys.modules, "cv2", cv2)
+    cv2.texts = texts
+    return cv2
+
+
+def classified_phases(tracking_csv):
+    classifier = FormationClassifier(tracking_csv)
+    classified = classifier.classify_formations()
+    return classifier.observations, classifier.get_dominant_formations_by_defense_phase(
+        classified, classifier.detect_defense_phases())
+
+
+def test_overlay_lookup_matches_phases_and_defenders(tracking_csv):
+    observations, phases = classified_phases(tracking_csv)
+    overlay = MatchOverlay(observations, phases)
+
+    inside = np.zeros(observations.frame_num.max() + 2, dtype=bool)
+    for k, (start_frame, end_frame, formation, direction) in enumerate(sorted(phases)):
+        assert overlay.phase_at(start_frame) == overlay.phase_at(end_frame) == k
+        assert (overlay.formations[k], overlay.directions[k]) == (formation, direction)
+        inside[start_frame:end_frame + 1] = True
+    for frame_num in np.flatnonzero(~inside).tolist():
+        assert overlay.phase_at(frame_num) == -1
+
+    defenders = observations.take(observations.defender_mask())
+    for frame_num in (1, 500, 1342, 1500):
+        xs, ys, direction = overlay.defenders_at(frame_num)
+        mask = defenders.frame_num == frame_num
+        np.testing.assert_array_equal(xs, defenders.x[mask])
+        np.testing.assert_array_equal(ys, defenders.y[mask])
+        assert direction == DIRECTION_NAMES[defenders.direction[mask][0]]
+    assert overlay.defenders_at(10 ** 6)[2] is None
+
+
+def test_export_writes_frames_in_order_with_phase_text(tracking_csv, fake_cv2, tmp_path):
+    observations, phases = classified_phases(tracking_csv)
+    overlay = MatchOverlay(observations, phases)
+    # 映像のフレーム番号 = 追跡データのフレーム番号 + 5
+    summary = export_overlay_video(
+        "match.mp4", observations, phases, str(tmp_path / "overlay.mp4"),
+        workers=3, start_frame=20, end_frame=250, frame_offset=5,
+    )
+
+    written = FakeWriter.last.frames
+    assert summary["frames"] == len(written) == 231
+    assert [int(frame[0, 0, 0]) for frame in written] == list(range(20, 251))
+    # ミニマップは右下に貼られる
+    assert all(frame[-10, -10, 0] == 255 for frame in written)
+    for video_frame in range(20, 251):
+        phase = overlay.phase_at(video_frame - 5)
+        first_line = fake_cv2.texts[video_frame][0]
+        if phase >= 0:
+            assert first_line == f"Formation: {overlay.formations[phase]} ({overlay.directions[phase]})"
+        else:
+            assert first_line == "Formation: -"
@@ -0,0 +1,12 @@
+import pytest
+
+from formation_classification_9mline_latest import FormationClassifier
+from parallel_phases import classify_in_parallel
+
+
+@pytest.mark.parametrize("zone_mode", ["box", "distance"])
+def test_parallel_matches_serial(tracking_csv, zone_mode):
+    classifier = FormationClassifier(tracking_csv, zone_mode=zone_mode)
+    expected = (classifier.classify_formations(), classifier.detect_defense_phases())
+    for workers in (1, 2):
+        assert classify_in_parallel(classifier.observations, zone_mode=zone_mode, workers=workers) == expected
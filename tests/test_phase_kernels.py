@@ -0,0 +1,22 @@
+import pytest
+
+import phase_kernels
+from formation_classification_9mline_latest import FormationClassifier
+
+
+def test_kernel_matches_set_based_detection(tracking_csv):
+    # numba がなくてもカーネルは普通の関数として動くので，規則が同じことはいつでも確かめる
+    classifier = FormationClassifier(tracking_csv)
+    expected = classifier.detect_raw_defense_phases(use_jit=False)
+    assert expected
+    assert classifier.detect_raw_defense_phases(use_jit=True) == expected
+
+
+def test_compiled_kernel_matches_set_based_detection(tracking_csv):
+    pytest.importorskip("numba")
+    classifier = FormationClassifier(tracking_csv)
+    expected = classifier.detect_raw_defense_phases(use_jit=False)
+    assert classifier.detect_raw_defense_phases(use_jit=True) == expected
+    # numba があれば既定でJITカーネルを使い，コンパイル済みの関数が登録されている
+    assert classifier.detect_raw_defense_phases() == expected
+    assert phase_kernels._raw_phase_kernel in phase_kernels._compiled
@@ -0,0 +1,49 @@
+from formation_classification_9mline_latest import FormationClassifier
+from observations import Observations
+from phase_smoothing import smooth_classified_formations, smooth_raw_phases, viterbi_smooth
+
+
+def test_viterbi_removes_single_frame_switches():
+    labels = [0] * 10 + [1] + [0] * 10 + [1] * 20
+    scores = [[1.0 if label == k else 0.0 for k in range(2)] for label in labels]
+    assert viterbi_smooth(scores, switch_penalty=1.5).tolist() == [0] * 21 + [1] * 20
+
+
+def test_smoothed_phases_match_merge_on_clean_input(tracking_csv):
+    raw_phases = [
+        (0, 100, 'right', 'direction_change'), (130, 140, 'right', 'direction_change'),
+        (160, 400, 'right', 'outer_return'), (500, 700, 'left', 'direction_change'),
+        (720, 730, 'left', 'direction_change'), (800, 805, 'right', 'outer_return'), (900, 1000, 'left', None),
+    ]
+    assert smooth_raw_phases(raw_phases, 50) == FormationClassifier._merge_short_phases(raw_phases, 50)
+
+    merge = FormationClassifier(tracking_csv)
+    viterbi = FormationClassifier(tracking_csv, smoothing="viterbi")
+    assert viterbi.detect_defense_phases() == merge.detect_defense_phases()
+
+
+def test_smoothed_phases_remove_direction_flicker():
+    raw_phases = [
+        (0, 300, 'right', 'direction_change'), (310, 320, 'left', 'direction_change'),
+        (330, 335, 'right', 'direction_change'), (340, 348, 'left', 'direction_change'), (360, 700, 'right', None),
+    ]
+    # 1つずつ結合するだけでは left の短いフェーズが残る
+    assert [phase[2] for phase in FormationClassifier._merge_short_phases(raw_phases, 50)].count('left') == 2
+    assert smooth_raw_phases(raw_phases, 50) == [(0, 300, 'right'), (310, 700, 'right')]
+
+
+def test_dominant_formations_by_viterbi():
+    empty = Observations([], [], [], [], [], [])
+    merge = FormationClassifier(None, observations=empty)
+    viterbi = FormationClassifier(None, observations=empty, smoothing="viterbi")
+    phases = [(0, 99, 'right'), (200, 299, 'left')]
+    clean = [(f, 'right', '1--5', 1.0) for f in range(100)] + [(f, 'left', '0--6', 1.0) for f in range(200, 300)]
+    assert viterbi.get_dominant_formations_by_defense_phase(clean, phases) == \
+        merge.get_dominant_formations_by_defense_phase(clean, phases)
+
+    # 1--5 の中に 2--4 が1フレームずつ混ざっても，平滑化すると 1--5 だけになる
+    flicker = [(f, 'right', '2--4' if f % 3 == 0 else '1--5', 1.0) for f in range(100)]
+    smoothed, segments = smooth_classified_formations(flicker)
+    assert {formation for _, _, formation, _ in smoothed} == {'1--5'}
+    assert segments == [(0, 99, '1--5', 'right')]
+    assert viterbi.get_dominant_formations_by_defense_phase(flicker, phases) == [(0, 99, '1--5', 'right')]
@@ -0,0 +1,43 @@
+import json
+
+from online_classifier import classify_windowed
+from phase_stream import JsonlPhaseSink, stream_phases
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_stream_matches_windowed_classifier(tracking_csv, tmp_path):
+    output_file = str(tmp_path / "out" / "phases.jsonl")
+    n_phases = stream_phases(tracking_csv, output_file, heartbeat_seconds=0.0)
+    lines = read_jsonl(output_file)
+
+    phases = [line for line in lines if line["type"] == "phase"]
+    expected = list(classify_windowed(tracking_csv))
+    assert n_phases == len(phases) == len(expected)
+    for line, record in zip(phases, expected):
+        assert {key: line[key] for key in record} == json.loads(json.dumps(record))
+
+    # heartbeat は毎フレーム書かれ，最後の行は end
+    assert any(line["type"] == "heartbeat" for line in lines)
+    assert lines[-1]["type"] == "end"
+    assert lines[-1]["phases"] == n_phases
+    assert lines[-1]["frame_num"] == max(line["frame_num"] for line in lines if line["type"] == "heartbeat")
+
+
+def test_sink_heartbeat_interval_and_append(tmp_path):
+    output_file = str(tmp_path / "phases.jsonl")
+    with JsonlPhaseSink(output_file, heartbeat_seconds=3600.0) as sink:
+        assert not sink.heartbeat(1, "right", "3-3", None)
+        assert sink.heartbeat(2, "right", "3-3", None, force=True)
+        sink({"start_frame": 1, "end_frame": 2, "direction": "right"})
+    with JsonlPhaseSink(output_file, append=True) as sink:
+        sink.close(frame_num=5)
+        sink.close(frame_num=6)
+
+    # 2回目の close では何も書かない
+    lines = read_jsonl(output_file)
+    assert [line["type"] for line in lines] == ["heartbeat", "phase", "end", "end"]
+    assert (lines[-1]["frame_num"], lines[-1]["phases"]) == (5, 0)
@@ -0,0 +1,44 @@
+import numpy as np
+
+from observations import Observations
+from replay_detector import cut_frames, detect_replays, drop_ranges
+
+
+def splice_replay(observations, source_start, source_end, after_frame):
+    """
+    source_start..source_end のフレームを新しいIDで after_frame の後ろに差し込む（映像に入るリプレイの代わり）．
+    後ろのフレームは差し込んだ分だけずらす
+    """
+    length = source_end - source_start + 1
+    source = (observations.frame_num >= source_start) & (observations.frame_num <= source_end)
+    replay = observations.take(source)
+    replay.frame_num = replay.frame_num - source_start + after_frame + 1
+    replay.player_id = replay.player_id + 100
+    shifted = observations.take(slice(None))
+    shifted.frame_num = np.where(shifted.frame_num > after_frame, shifted.frame_num + length, shifted.frame_num)
+    return Observations.concat(shifted, replay).sorted()
+
+
+def test_no_replays_in_continuous_tracks(tracking_csv):
+    # direction の切り替わりで座標が反転しても映像の切り替わりとはみなさない
+    observations = Observations.from_csv(tracking_csv)
+    assert len(cut_frames(observations)[1]) == 0
+    assert detect_replays(observations) == []
+
+
+def test_spliced_replay_is_detected_and_dropped(tracking_csv):
+    observations = Observations.from_csv(tracking_csv)
+    spliced = splice_replay(observations, 400, 549, after_frame=900)
+
+    frames, cuts = cut_frames(spliced)
+    assert frames[cuts].tolist() == [901, 1051]
+    # 差し込んだ境目で direction が短く反転していれば，その区間とまとめて返る
+    ranges = detect_replays(spliced)
+    assert len(ranges) == 1
+    start_frame, end_frame, _ = ranges[0]
+    assert start_frame <= 901 and end_frame >= 1050
+    assert end_frame - start_frame + 1 <= 150 + 45
+
+    kept = drop_ranges(spliced, ranges)
+    assert kept.player_id.max() < 100
+    assert len(spliced) - len(kept) >= 150 * 12
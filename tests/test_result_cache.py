@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+import result_cache
+from formation_classification_9mline_latest import FormationClassifier
+from result_cache import ResultCache, cache_key, classify_cached, decode_results, encode_results
+
+
+def test_cached_results_match_classifier(tracking_csv, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    classifier = FormationClassifier(tracking_csv)
+    expected = (classifier.classify_formations(), classifier.detect_raw_defense_phases())
+    assert classify_cached(tracking_csv, cache) == expected
+    # 既定値を書いても書かなくても同じキャッシュを使う
+    assert classify_cached(tracking_csv, cache, zone_mode="box", max_gap=0) == expected
+    assert cache.stats == {"hits": 1, "misses": 1, "evicted": 0}
+    classify_cached(tracking_csv, cache, zone_mode="distance")
+    assert cache.stats["misses"] == 2
+    with pytest.raises(TypeError):
+        classify_cached(tracking_csv, cache, zone="box")
+
+
+def test_version_change_misses(tracking_csv, tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / "cache"))
+    classify_cached(tracking_csv, cache)
+    monkeypatch.setattr(result_cache, "CACHE_VERSION", result_cache.CACHE_VERSION + "-next")
+    classify_cached(tracking_csv, cache)
+    assert cache.stats["hits"] == 0 and cache.stats["misses"] == 2
+
+
+def test_encode_round_trip_and_lru_eviction(tmp_path):
+    classified = [(1, "right", "1--5", 1.0), (2, "left", None, 0.5)]
+    raw_phases = [(1, 2, "right", "outer_return"), (5, 9, "left", None)]
+    assert decode_results(encode_results(classified, raw_phases)) == (classified, raw_phases)
+
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=10 ** 9)
+    for n in range(3):
+        cache.put(f"data{n}", "s", {}, classified * 100, raw_phases)
+    sizes = [size for _, size, _ in cache.entries()]
+    oldest = cache._path(cache_key("data0", "s", {}))
+    os.utime(oldest, (0, 0))
+    cache.get("data1", "s", {})
+    cache.max_bytes = sum(sizes) - 1
+    cache.evict()
+    paths = [path for path, _, _ in cache.entries()]
+    assert oldest not in paths and len(paths) == 2
+    assert cache.get("data1", "s", {}) is not None
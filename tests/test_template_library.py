@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from formation_classification_9mline_latest import FormationClassifier
+from observations import Observations
+from template_library import TemplateLibrary, frame_vectors, positions_vector
+
+
+def labeled_phases(tracking_csv):
+    classifier = FormationClassifier(tracking_csv)
+    classified = classifier.classify_formations()
+    return classifier.observations, classifier.get_dominant_formations_by_defense_phase(
+        classified, classifier.detect_defense_phases())
+
+
+def test_nearest_template_recovers_training_labels(tracking_csv):
+    observations, phases = labeled_phases(tracking_csv)
+    library = TemplateLibrary()
+    library.add_labeled_phases(observations, phases)
+    assert len(library) > 0
+
+    # 学習に使ったフレームは自分自身が最近傍になる
+    classified = {frame_num: formation for frame_num, _, formation, _ in library.classify(observations, k=1)}
+    for start_frame, end_frame, formation, _ in phases:
+        labels = [classified[f] for f in range(start_frame, end_frame + 1) if f in classified]
+        assert labels and all(label == formation for label in labels)
+
+
+def test_left_frames_are_mirrored_to_right(tracking_csv):
+    observations = Observations.from_csv(tracking_csv)
+    mirrored = observations.take(slice(None))
+    mirrored.x = (np.float32(1.0) - observations.x).astype(np.float32)
+    # 攻撃方向が逆になると防御するチームも入れ替わる
+    mirrored.direction = (1 - observations.direction).astype(np.int8)
+    mirrored.team = (1 - observations.team).astype(np.int8)
+    frames, _, vectors = frame_vectors(observations)
+    mirrored_frames, _, mirrored_vectors = frame_vectors(mirrored.sorted())
+    np.testing.assert_array_equal(mirrored_frames, frames)
+    np.testing.assert_allclose(mirrored_vectors, vectors, atol=1e-6)
+
+    positions = [(0.8, 0.175), (0.7, 0.3), (0.65, 0.4), (0.65, 0.6), (0.7, 0.7), (0.8, 0.825)]
+    left = [(1.0 - x, y) for x, y in positions]
+    np.testing.assert_allclose(positions_vector(left, "left"), positions_vector(positions), atol=1e-6)
+
+
+def test_invalid_queries_raise_clear_errors():
+    library = TemplateLibrary()
+    vector = positions_vector([(0.8, 0.175), (0.7, 0.3), (0.65, 0.4), (0.65, 0.6), (0.7, 0.7), (0.8, 0.825)])
+    with pytest.raises(ValueError):
+        library.query([vector])
+
+    library.add(vector, "0--6")
+    with pytest.raises(ValueError):
+        library.query([vector], k=0)
+    best, confidence = library.query(np.zeros((0, vector.size)))
+    assert len(best) == len(confidence) == 0
+    # k がテンプレートの数より大きくても使える
+    best, confidence = library.query([vector], k=10)
+    assert library.labels[best[0]] == "0--6" and confidence[0] == 1.0
+    assert library.classify(Observations([], [], [], [], [], []), k=0) == []
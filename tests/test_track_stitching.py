@@ -0,0 +1,42 @@
+import numpy as np
+
+from observations import Observations
+from track_stitching import stitch_tracks
+
+
+def break_track(observations, player_id, new_id, after_frame, gap=0):
+    """player_id の軌跡を after_frame の後で new_id に入れ替え，gap フレームの間は観測を消す"""
+    player = observations.player_id == player_id
+    lost = player & (observations.frame_num > after_frame) & (observations.frame_num <= after_frame + gap)
+    result = observations.take(~lost)
+    renamed = (result.player_id == player_id) & (result.frame_num > after_frame + gap)
+    result.player_id = np.where(renamed, new_id, result.player_id).astype(np.int32)
+    return result
+
+
+def test_continuous_tracks_are_unchanged(tracking_csv):
+    observations = Observations.from_csv(tracking_csv)
+    stitched, links = stitch_tracks(observations)
+    assert links == []
+    np.testing.assert_array_equal(stitched.player_id, observations.player_id)
+
+
+def test_id_switches_are_stitched_back(tracking_csv):
+    observations = Observations.from_csv(tracking_csv)
+    broken = break_track(observations, 3, 50, after_frame=600, gap=4)
+    broken = break_track(broken, 8, 60, after_frame=1100)
+    expected = break_track(observations, 3, 3, after_frame=600, gap=4)
+
+    stitched, links = stitch_tracks(broken)
+    assert links == [("50", "3", 4), ("60", "8", 0)]
+    np.testing.assert_array_equal(stitched.player_id, expected.player_id)
+    np.testing.assert_array_equal(stitched.frame_num, expected.frame_num)
+
+
+def test_other_team_is_never_linked(tracking_csv):
+    # 赤の選手が消えた直後に白の新しいIDが同じ位置に出ても，チームが違えばつながない
+    observations = Observations.from_csv(tracking_csv)
+    broken = break_track(observations, 2, 70, after_frame=800)
+    broken.team = np.where(broken.player_id == 70, 1, broken.team).astype(np.int8)
+    _, links = stitch_tracks(broken)
+    assert links == []
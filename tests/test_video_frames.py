@@ -0,0 +1,97 @@
+import sys
+import threading
+import types
+
+import numpy as np
+import pytest
+
+from video_frames import VideoFrameReader
+
+N_FRAMES = 120
+WIDTH, HEIGHT = 8, 6
+
+
+class FakeCapture:
+    """フレーム番号で塗りつぶしたフレームを返す cv2.VideoCapture の代わり"""
+
+    def __init__(self, path):
+        self.position = 0
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return {"fps": 30.0, "count": N_FRAMES, "width": WIDTH, "height": HEIGHT}[prop]
+
+    def set(self, prop, value):
+        self.position = int(value)
+
+    def read(self, image=None):
+        if self.position >= N_FRAMES:
+            return False, None
+        if image is None:
+            image = np.empty((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        image[...] = self.position % 256
+        self.position += 1
+        # デコードの間に別のスレッドへ切り替わるようにする
+        threading.Event().wait(0.0005)
+        return True, image
+
+    def grab(self):
+        self.position += 1
+        return self.position <= N_FRAMES
+
+    def release(self):
+        pass
+
+
+@pytest.fixture
+def fake_cv2(monkeypatch):
+    cv2 = types.SimpleNamespace(
+        VideoCapture=FakeCapture, CAP_PROP_FPS="fps", CAP_PROP_FRAME_COUNT="count",
+        CAP_PROP_FRAME_WIDTH="width", CAP_PROP_FRAME_HEIGHT="height", CAP_PROP_POS_FRAMES="position",
+    )
+    monkeypatch.setitem(sys.modules, "cv2", cv2)
+    return cv2
+
+
+def assert_frames(items):
+    for frame_num, frame in items:
+        assert frame.shape == (HEIGHT, WIDTH, 3)
+        assert np.all(frame == frame_num % 256), frame_num
+
+
+def test_read_range_returns_requested_frames(fake_cv2):
+    reader = VideoFrameReader("match.mp4", buffer_size=4)
+    frames = list(reader.read_range(10, 40, step=3, copy=True))
+    assert [frame_num for frame_num, _ in frames] == list(range(10, 41, 3))
+    assert_frames(frames)
+    assert reader.decoded_frames == len(frames)
+
+
+def test_concurrent_read_ranges_on_one_reader(fake_cv2):
+    reader = VideoFrameReader("match.mp4", buffer_size=4)
+
+    # 同じスレッドで交互に進める
+    checked = 0
+    for first, second in zip(reader.read_range(0, 100), reader.read_range(7, 107)):
+        assert_frames([first, second])
+        checked += 1
+    assert checked == 101
+
+    # 別々のスレッドで同時に進める
+    errors = []
+
+    def consume(start_frame):
+        try:
+            assert_frames(reader.read_range(start_frame, start_frame + 80))
+        except AssertionError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=consume, args=(start_frame,)) for start_frame in (0, 13, 29)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert reader.decoded_frames == 2 * 101 + 3 * 81